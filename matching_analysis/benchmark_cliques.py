@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the unit grouping in cleaning.cliques on dense wind-farm
+duplicates: every farm consists of many turbines which duke links almost
+completely with each other
+
+@author: fabian
+"""
+from __future__ import print_function, division
+import time
+import numpy as np
+import pandas as pd
+import networkx as nx
+from powerplantmatching.cleaning import cliques
+
+n_farms = 100
+turbines_per_farm = 30
+link_probability = 0.9
+
+rng = np.random.RandomState(0)
+farm = np.repeat(np.arange(n_farms), turbines_per_farm)
+df = pd.DataFrame({'Name': ['Windpark {}'.format(f) for f in farm],
+                   'Fueltype': 'Wind', 'Capacity': 2.})
+
+# directed links within every farm, a link is missing with 1 - link_probability
+one, two = np.nonzero(farm[:, None] == farm[None, :])
+keep = (one != two) & (rng.rand(len(one)) < link_probability)
+duplicates = pd.DataFrame({'one': one[keep], 'two': two[keep]},
+                          columns=['one', 'two'])
+print('{} units, {} links'.format(len(df), len(duplicates)))
+
+#%% networkx clique search on the whole graph, as done before
+
+def networkx_cliques(df, dataduplicates):
+    G = nx.DiGraph()
+    G.add_nodes_from(df.index)
+    G.add_edges_from((r.one, r.two) for r in dataduplicates.itertuples())
+    H = G.to_undirected(reciprocal=True)
+    grouped = pd.Series(np.nan, index=df.index)
+    for i, inds in enumerate(nx.algorithms.clique.find_cliques(H)):
+        grouped.loc[inds] = i
+    return df.assign(grouped=grouped)
+
+#%% compare the implementations
+
+for name, func in [('networkx find_cliques', networkx_cliques),
+                   ('components, clique refinement',
+                    lambda df, d: cliques(df, d)),
+                   ('components only', lambda df, d: cliques(df, d, refine=None))]:
+    start = time.time()
+    grouped = func(df, duplicates).grouped
+    print('{}: {:.2f}s, {} groups, {:.1f} units per group'
+          .format(name, time.time() - start, grouped.nunique(),
+                  len(grouped) / grouped.nunique()))
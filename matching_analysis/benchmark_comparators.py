@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the batch string comparators against the per-pair Python
+implementations on the names of CARMA and OPSD
+
+@author: fabian
+"""
+from __future__ import print_function, division
+import time
+import numpy as np
+import powerplantmatching as pm
+from powerplantmatching.comparators import (lowercase_normalize,
+    jaro_winkler_tokenized, jaro_winkler_tokenized_batch, qgram, qgram_batch)
+
+n_pairs = 200000
+
+carma = pm.data.CARMA()
+opsd = pm.data.OPSD()
+
+names1 = carma.Name.dropna().map(lowercase_normalize).unique()
+names2 = opsd.Name.dropna().map(lowercase_normalize).unique()
+rng = np.random.RandomState(0)
+i = rng.randint(0, len(names1), n_pairs)
+j = rng.randint(0, len(names2), n_pairs)
+
+#%% compare the implementations
+
+for name, scalar, batch in [('JaroWinklerTokenized', jaro_winkler_tokenized,
+                             jaro_winkler_tokenized_batch),
+                            ('QGram', qgram, qgram_batch)]:
+    start = time.time()
+    loop = np.array([scalar(names1[a], names2[b]) for a, b in zip(i, j)])
+    t_loop = time.time() - start
+
+    start = time.time()
+    vectorized = batch(names1, names2, i, j)
+    t_batch = time.time() - start
+
+    print('{}: {:.2f}s per-pair, {:.2f}s batch, speedup {:.1f}x, '
+          'max deviation {:.2e}'.format(name, t_loop, t_batch, t_loop / t_batch,
+                                        np.abs(loop - vectorized).max()))
+
+#%% throughput of the native linker
+
+start = time.time()
+links = pm.duke.duke([carma, opsd], labels=['CARMA', 'OPSD'], backend='native',
+                     singlematch=True)
+print('native linkage of CARMA and OPSD: {:.1f}s, {} links'
+      .format(time.time() - start, len(links)))
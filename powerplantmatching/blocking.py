@@ -0,0 +1,501 @@
+# -*- coding: utf-8 -*-
+## Copyright 2015-2016 Fabian Hofmann (FIAS), Jonas Hoersch (FIAS)
+
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 3 of the
+## License, or (at your option) any later version.
+
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Functions for reducing the number of record pairs which have to be
+compared when linking or deduplicating datasets
+"""
+
+from __future__ import absolute_import, print_function, division
+
+import numpy as np
+import pandas as pd
+import six
+from six.moves import reduce
+import logging
+logger = logging.getLogger(__name__)
+
+
+def block_labels(df, keys=['Country', 'Fueltype'], capacity_bands=None):
+    """
+    Returns a pandas.Series with the block label of every record, which
+    is composed of the values of the blocking keys. Records with a
+    missing key get a NaN label.
+
+    Parameters
+    ----------
+    df : pandas.Dataframe
+        dataframe which should be partitioned
+    keys : list of strings, default ['Country', 'Fueltype']
+        columns which records have to agree on in order to be compared
+    capacity_bands : float, default None
+        If given, the records are additionally partitioned into bands of
+        the logarithmic capacity, where the value gives the width of a
+        band in decades (e.g. 0.5 puts 100 MW and 300 MW into the same
+        band, but not 100 MW and 400 MW)
+    """
+    parts = df.reindex(columns=keys)
+    if capacity_bands is not None:
+        capacity = pd.to_numeric(df['Capacity'], errors='coerce')
+        parts = parts.assign(CapacityBand=np.floor(
+                    np.log10(capacity.where(capacity > 0)) / capacity_bands))
+    labels = reduce(lambda a, b: a + '|' + b, (parts[c].astype(str) for c in parts))
+    return labels.where(parts.notnull().all(axis=1))
+
+
+def blocks(block_ids):
+    """
+    Yields the label and the positions of the records of each dataset
+    for all blocks. Records without a block label are assigned to every
+    block.
+
+    Parameters
+    ----------
+    block_ids : list of pandas.Series
+        block labels of one (deduplication) or two (record linkage)
+        datasets, as returned by block_labels()
+    """
+    empty = np.array([], dtype=int)
+    wildcards = [np.flatnonzero(b.isnull().values) for b in block_ids]
+    groups = [pd.Series(b.values).groupby(b.values).indices for b in block_ids]
+    labels = sorted(set().union(*groups))
+    if not labels:
+        labels = [None]
+
+    for label in labels:
+        positions = [np.sort(np.concatenate([g.get(label, empty), w]))
+                     for g, w in zip(groups, wildcards)]
+        if len(positions) == 1 and len(positions[0]) < 2:
+            continue
+        if any(len(p) == 0 for p in positions):
+            continue
+        yield label, positions
+
+
+def blocking_statistics(block_ids, labels=['one', 'two']):
+    """
+    Returns a pandas.Dataframe with the number of records of each dataset
+    per block, the number of compared pairs, their share of the full
+    cross product and the share of comparisons of the block's records
+    which is removed by the blocking.
+
+    Parameters
+    ----------
+    block_ids : list of pandas.Series
+        block labels of one (deduplication) or two (record linkage)
+        datasets, as returned by block_labels()
+    labels : list of strings
+        names of the datasets
+    """
+    dedup = len(block_ids) == 1
+    sizes = [len(b) for b in block_ids]
+    if dedup:
+        total = sizes[0] * (sizes[0] - 1) // 2
+    else:
+        total = sizes[0] * sizes[1]
+
+    stats = []
+    for label, positions in blocks(block_ids):
+        n = [len(p) for p in positions]
+        if dedup:
+            pairs = n[0] * (n[0] - 1) // 2
+            removed = 1. - (n[0] - 1) / (sizes[0] - 1)
+        else:
+            pairs = n[0] * n[1]
+            removed = 1. - n[1] / sizes[1]
+        stats.append(dict(zip(labels, n), block=label, pairs=pairs,
+                          share=pairs / total if total else 0., removed=removed))
+    return (pd.DataFrame(stats, columns=['block'] + labels[:len(block_ids)] +
+                                        ['pairs', 'share', 'removed'])
+            .set_index('block'))
+
+
+def candidate_pairs(datasets, labels, i, j):
+    """
+    Returns the candidate pairs given by the positions `i` and `j` as a
+    pandas.Dataframe of index labels, in the same shape as the links
+    returned by duke() (without scores). In deduplication mode every
+    pair is reported once.
+    """
+    dedup = len(datasets) == 1
+    i, j = np.asarray(i, dtype=int), np.asarray(j, dtype=int)
+    if dedup:
+        i, j = np.minimum(i, j), np.maximum(i, j)
+        i, j = i[i != j], j[i != j]
+    pairs = np.unique(i * np.int64(len(datasets[-1])) + j)
+    i, j = pairs // len(datasets[-1]), pairs % len(datasets[-1])
+    return pd.DataFrame({labels[0]: datasets[0].index.values[i],
+                         labels[1]: datasets[-1].index.values[j]},
+                        columns=labels[:2])
+
+
+def candidate_positions(datasets, candidates):
+    """
+    Translate candidate pairs of index labels into positions of the
+    records in the datasets.
+    """
+    i = datasets[0].index.get_indexer(candidates.iloc[:, 0])
+    j = datasets[-1].index.get_indexer(candidates.iloc[:, 1])
+    if (i < 0).any() or (j < 0).any():
+        raise ValueError("Candidate pairs refer to records which are not "
+                         "contained in the datasets")
+    return i, j
+
+
+def _unit_vectors(coords):
+    lat, lon = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+    return np.c_[np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)]
+
+
+def spatial_candidates(datasets, labels=['one', 'two'], radius=5000.):
+    """
+    Returns all pairs of records which are located within `radius`
+    meters of each other, and all pairs where at least one record lacks
+    coordinates. The search uses a KD-tree over the coordinates mapped
+    onto the unit sphere.
+
+    Parameters
+    ----------
+    datasets : pd.DataFrame or [pd.DataFrame]
+        A single dataframe for deduplication or two dataframes for
+        record linkage
+    labels : [str], default ['one', 'two']
+        Labels for the columns of the candidate pairs
+    radius : float, default 5000.
+        Maximal distance in meters, corresponds to the max-distance of
+        the GeoComparator in the Duke configurations
+    """
+    from scipy.spatial import cKDTree as KDTree
+    if isinstance(datasets, pd.DataFrame):
+        datasets = [datasets]
+
+    coords = [df.reindex(columns=['lat', 'lon']).astype(float).values
+              for df in datasets]
+    located = [np.flatnonzero(~np.isnan(c).any(axis=1)) for c in coords]
+    missing = [np.flatnonzero(np.isnan(c).any(axis=1)) for c in coords]
+    n = [len(df) for df in datasets]
+
+    i, j = [np.array([], dtype=int)], [np.array([], dtype=int)]
+    if len(located[0]) and len(located[-1]):
+        # chord length on the unit sphere corresponding to the radius
+        chord = 2 * np.sin(radius / 6371000. / 2)
+        trees = [KDTree(_unit_vectors(c[l])) for c, l in zip(coords, located)]
+        neighbours = trees[0].query_ball_tree(trees[-1], chord)
+        i.append(np.repeat(located[0], [len(nb) for nb in neighbours]))
+        j.append(located[-1][np.concatenate([np.array([], dtype=int)] +
+                                            [np.asarray(nb, dtype=int) for nb in neighbours])])
+
+    i += [np.repeat(missing[0], n[-1]), np.repeat(located[0], len(missing[-1]))]
+    j += [np.tile(np.arange(n[-1]), len(missing[0])), np.tile(missing[-1], len(located[0]))]
+    return candidate_pairs(datasets, labels, np.concatenate(i), np.concatenate(j))
+
+
+def _qgram_matrices(datasets, q=3, features=None):
+    """
+    Binary sparse matrices (records x q-grams) of the lowercased and
+    normalized names of the datasets over a common q-gram vocabulary.
+    """
+    from scipy.sparse import csr_matrix
+    from .comparators import lowercase_normalize, qgrams
+
+    if features is not None and q == 3:
+        grams = [f['trigrams'] for f in features]
+    elif features is not None:
+        grams = [f['cleaned'].map(lambda s: qgrams(s, q)) for f in features]
+    else:
+        grams = [df['Name'].fillna('').astype(str).map(lowercase_normalize)
+                 .map(lambda s: qgrams(s, q)) for df in datasets]
+    vocabulary = {}
+    indices = [[vocabulary.setdefault(g, len(vocabulary)) for s in gs for g in s]
+               for gs in grams]
+    return [csr_matrix((np.ones(len(ind)), ind, np.r_[0, np.cumsum([len(s) for s in gs])]),
+                       shape=(len(gs), max(len(vocabulary), 1)))
+            for ind, gs in zip(indices, grams)], pd.Index(sorted(vocabulary, key=vocabulary.get))
+
+
+def qgram_index(df, q=3):
+    """
+    Returns the inverted index of the name q-grams of a dataset, i.e. a
+    pandas.Series which maps every q-gram to the index labels of the
+    records whose (lowercased and normalized) name contains it.
+    """
+    (matrix,), vocabulary = _qgram_matrices([df], q)
+    matrix = matrix.tocsc()
+    return pd.Series([df.index.values[matrix.indices[a:b]]
+                      for a, b in zip(matrix.indptr[:-1], matrix.indptr[1:])],
+                     index=vocabulary)
+
+
+def qgram_candidates(datasets, labels=['one', 'two'], q=3, k=2, max_df=0.01,
+                     min_df=20, features=None):
+    """
+    Returns all pairs of records whose names share at least `k` rare
+    q-grams. Q-grams which occur in more than `max_df` records are
+    considered uninformative and ignored, as are records without any rare
+    q-gram. The result can be combined with the spatial candidates in
+    order to recover pairs with bad or missing coordinates, e.g.
+
+        pd.concat([spatial_candidates(dfs), qgram_candidates(dfs)]).drop_duplicates()
+
+    Parameters
+    ----------
+    datasets : pd.DataFrame or [pd.DataFrame]
+        A single dataframe for deduplication or two dataframes for
+        record linkage
+    labels : [str], default ['one', 'two']
+        Labels for the columns of the candidate pairs
+    q : int, default 3
+        Length of the q-grams, trigrams are much more selective than the
+        bigrams used by the QGramComparator
+    k : int, default 2
+        Minimal number of shared rare q-grams
+    max_df : int or float, default 0.01
+        Maximal document frequency of a q-gram, as absolute number of
+        records (int) or as share of all records (float)
+    min_df : int, default 20
+        Only if max_df is a share. Lower bound for the maximal document
+        frequency in records, such that small datasets (e.g. of a single
+        country) keep their q-grams
+    features : [pd.DataFrame], default None
+        Precomputed name features as returned by
+        powerplantmatching.features.name_features, one per dataset
+    """
+    if isinstance(datasets, pd.DataFrame):
+        datasets = [datasets]
+    if isinstance(features, pd.DataFrame):
+        features = [features]
+    dedup = len(datasets) == 1
+
+    matrices, _ = _qgram_matrices(datasets, q, features)
+    frequency = sum(np.asarray(m.sum(axis=0)).ravel() for m in matrices)
+    if isinstance(max_df, float):
+        max_df = max(max_df * sum(len(df) for df in datasets), min_df)
+    rare = np.flatnonzero(frequency <= max_df)
+    logger.info("Using {} of {} q-grams for candidate generation"
+                .format(len(rare), len(frequency)))
+
+    shared = (matrices[0][:, rare] * matrices[-1][:, rare].T).tocoo()
+    keep = shared.data >= k
+    if dedup:
+        keep &= shared.row < shared.col
+    return candidate_pairs(datasets, labels, shared.row[keep], shared.col[keep])
+
+
+def _neighbourhood_keys(df, key, features=None):
+    from .comparators import lowercase_normalize
+    from .features import soundex
+    if features is not None:
+        names = features['cleaned']
+    else:
+        names = df['Name'].fillna('').astype(str).map(lowercase_normalize)
+    if key == 'name':
+        return names
+    elif key == 'phonetic':
+        if features is not None:
+            return features['phonetic']
+        return names.map(lambda s: ' '.join(soundex(t) for t in s.split()))
+    elif key == 'reversed':
+        return names.str[::-1]
+    elif key == 'sorted':
+        if features is not None:
+            return features['sorted_tokens']
+        return names.map(lambda s: ' '.join(sorted(s.split())))
+    raise ValueError("Unknown sorting key '{}'".format(key))
+
+
+def sorted_neighbourhood_candidates(datasets, labels=['one', 'two'],
+                                    keys=['name', 'phonetic', 'reversed'],
+                                    window=10, features=None):
+    """
+    Returns the pairs of records which are less than `window` positions
+    apart when the records of all datasets are sorted by one of the
+    `keys`. Records with an empty key are not sorted in.
+
+    Parameters
+    ----------
+    datasets : pd.DataFrame or [pd.DataFrame]
+        A single dataframe for deduplication or two dataframes for
+        record linkage
+    labels : [str], default ['one', 'two']
+        Labels for the columns of the candidate pairs
+    keys : list of strings, default ['name', 'phonetic', 'reversed']
+        Sorting keys derived from the lowercased and normalized names:
+        'name', 'phonetic' (Soundex codes of the words), 'reversed' (name
+        spelled backwards) and 'sorted' (words in alphabetical order)
+    window : int, default 10
+        Size of the sliding window
+    features : [pd.DataFrame], default None
+        Precomputed name features as returned by
+        powerplantmatching.features.name_features, one per dataset
+    """
+    if isinstance(datasets, pd.DataFrame):
+        datasets = [datasets]
+    if isinstance(features, pd.DataFrame):
+        features = [features]
+    if features is None:
+        features = [None] * len(datasets)
+    dedup = len(datasets) == 1
+    # position of every record within its dataset and the dataset number
+    position = np.concatenate([np.arange(len(df)) for df in datasets])
+    origin = np.repeat(np.arange(len(datasets)), [len(df) for df in datasets])
+
+    i, j = [np.array([], dtype=int)], [np.array([], dtype=int)]
+    for key in keys:
+        values = np.concatenate([_neighbourhood_keys(df, key, f).values
+                                 for df, f in zip(datasets, features)]).astype(object)
+        order = np.flatnonzero(values != '')
+        order = order[np.argsort(values[order].astype(six.text_type), kind='mergesort')]
+        for offset in range(1, window):
+            a, b = order[:-offset], order[offset:]
+            if not dedup:
+                # orient the pairs such that a belongs to the first dataset
+                a, b = np.where(origin[a] == 0, a, b), np.where(origin[a] == 0, b, a)
+                keep = origin[a] != origin[b]
+                a, b = a[keep], b[keep]
+            i.append(position[a])
+            j.append(position[b])
+    return candidate_pairs(datasets, labels, np.concatenate(i), np.concatenate(j))
+
+
+candidate_generators = {'spatial': spatial_candidates,
+                        'qgram': qgram_candidates,
+                        'sorted_neighbourhood': sorted_neighbourhood_candidates}
+
+
+def generate_candidates(datasets, labels, candidates, features=None):
+    """
+    Returns the candidate pairs given by `candidates`, which is either a
+    pandas.Dataframe of pairs, the name of a candidate generator in
+    `candidate_generators` or a function with the same signature as the
+    candidate generators, e.g.
+    functools.partial(sorted_neighbourhood_candidates, window=20).
+    Precomputed name `features` are handed to the generators working on
+    names.
+    """
+    if isinstance(candidates, pd.DataFrame):
+        return candidates
+    if isinstance(candidates, six.string_types):
+        if candidates not in candidate_generators:
+            raise ValueError("Unknown candidate generator '{}', choose one of {}"
+                             .format(candidates, ', '.join(sorted(candidate_generators))))
+        candidates = candidate_generators[candidates]
+    kwargs = {}
+    if features is not None and candidates in (qgram_candidates,
+                                               sorted_neighbourhood_candidates):
+        kwargs['features'] = features
+    pairs = candidates(datasets[0] if len(datasets) == 1 else datasets, labels,
+                       **kwargs)
+    stats = candidate_statistics(datasets, pairs)
+    logger.info("Generated {:.0f} candidate pairs, reduction ratio {:.4f}"
+                .format(stats['pairs'], stats['reduction_ratio']))
+    return pairs
+
+
+def candidate_statistics(datasets, candidates, links=None):
+    """
+    Returns the number of candidate pairs, the reduction ratio, i.e. the
+    share of all pairs of records which is not compared, and, if the
+    true `links` are given, the pair completeness, i.e. the share of the
+    true links which is contained in the candidates.
+
+    Parameters
+    ----------
+    datasets : pd.DataFrame or [pd.DataFrame]
+        A single dataframe for deduplication or two dataframes for
+        record linkage
+    candidates : pd.DataFrame
+        candidate pairs of index labels
+    links : pd.DataFrame, default None
+        true links, e.g. manually verified matches or the links of an
+        unblocked run of duke
+    """
+    if isinstance(datasets, pd.DataFrame):
+        datasets = [datasets]
+    n = [len(df) for df in datasets]
+    total = n[0] * (n[0] - 1) // 2 if len(n) == 1 else n[0] * n[1]
+    labels = list(candidates.columns[:2])
+    pairs = candidate_pairs(datasets, labels, *candidate_positions(datasets, candidates))
+    stats = pd.Series({'pairs': len(pairs),
+                       'reduction_ratio': 1. - len(pairs) / total if total else 0.,
+                       'pair_completeness': np.nan})
+    if links is not None:
+        links = links.iloc[:, :2].copy()
+        links.columns = labels
+        links = candidate_pairs(datasets, labels, *candidate_positions(datasets, links))
+        found = links.merge(pairs, on=labels, how='inner')
+        stats['pair_completeness'] = len(found) / len(links) if len(links) else np.nan
+    return stats
+
+
+def candidate_blocks(datasets, candidates, min_block_size=1000, max_share=0.5):
+    """
+    Returns block labels for the records of the datasets such that all
+    candidate pairs lie within one block. Connected components of the
+    candidate graph are merged into blocks of at least `min_block_size`
+    records. Records which are candidates of all records of the other dataset (of
+    all other records for deduplication), as the records without
+    coordinates for spatial_candidates(), get no block label and thus take
+    part in every block, see blocks().
+
+    Raises a ValueError if the blocks would compare more than `max_share`
+    of the cross product in addition to the candidate pairs, as for the
+    chained pairs of sorted_neighbourhood_candidates(). Then only scoring
+    the candidate pairs themselves (native backend) saves comparisons.
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    dedup = len(datasets) == 1
+    i, j = candidate_positions(datasets, candidates)
+    n = [len(df) for df in datasets]
+    offset = 0 if dedup else n[0]
+    size = sum(n)
+
+    # records linked to everything are handled as wildcards
+    j = j + offset
+    if dedup:
+        i, j = np.minimum(i, j), np.maximum(i, j)
+        i, j = i[i != j], j[i != j]
+    pairs = np.unique(i * np.int64(size) + j)
+    i, j = pairs // size, pairs % size
+    total = size * (size - 1) // 2 if dedup else n[0] * n[1]
+    degree = np.bincount(np.r_[i, j], minlength=size)
+    partners = np.repeat([size - 1] if dedup else [n[1], n[0]],
+                         [size] if dedup else n)
+    wildcard = (degree >= partners) & (partners > 0)
+    keep = ~(wildcard[i] | wildcard[j])
+    i, j = i[keep], j[keep]
+
+    graph = coo_matrix((np.ones(len(i)), (i, j)), shape=(size, size))
+    _, components = connected_components(graph, directed=False)
+
+    sizes = np.bincount(components[~wildcard], minlength=components.max() + 1)
+    # greedily merge subsequent components until they are large enough,
+    # records without candidates (besides wildcards) are components too
+    block_of_component = np.cumsum(np.r_[0, sizes[:-1]]) // min_block_size
+    labels = np.where(wildcard, np.nan,
+                      block_of_component[components].astype(float))
+    splits = [labels[:n[0]]] if dedup else [labels[:n[0]], labels[n[0]:]]
+
+    if size > min_block_size:
+        share = (blocking_statistics([pd.Series(l) for l in splits]).share.sum()
+                 - len(pairs) / total)
+        if share > max_share:
+            raise ValueError("The candidate pairs do not decompose into blocks, "
+                             "the blocks would compare {:.0%} of the cross "
+                             "product in addition to the candidates. Only the "
+                             "native backend benefits from these candidates."
+                             .format(share))
+    return [pd.Series(l, index=df.index) for l, df in zip(splits, datasets)]
@@ -18,18 +18,149 @@ Functions for vertically cleaning a dataset
 """
 from __future__ import absolute_import, print_function
 
+import re
+import itertools
+from collections import Counter, OrderedDict
+import six
 import numpy as np
 import pandas as pd
 import networkx as nx
 import logging
 logger = logging.getLogger(__name__)
 
-from .config import target_columns, target_technologies
-from .utils import read_csv_if_string
+from .config import target_columns, target_technologies, identifier_columns
+from .utils import read_csv_if_string, map_unique
 from .duke import duke
+from .blocking import block_labels, generate_candidates
 from .utils import (_data_out)
 
 
+# words removed from the plant names in clean_powerplantname, in addition
+# to very frequent words, numerals and single letters
+name_stopwords = ['I', 'II', 'III', 'IV', 'V', 'VI', 'VII', 'VIII', 'IX', 'X', 'XI',
+                  'Grupo', 'parque', 'eolico', 'gas', 'biomasa', 'COGENERACION', 'gt',
+                  'unnamed', 'tratamiento de purines', 'planta', 'de', 'la', 'station',
+                  'power', 'storage', 'plant', 'stage', 'pumped', 'project',
+                  'dt', 'gud', 'hkw', 'kbr', 'Kernkraft', 'Kernkraftwerk',
+                  'kwg', 'krb', 'ohu', 'gkn', 'Gemeinschaftskernkraftwerk',
+                  'kki', 'kkp', 'kle', 'wkw', 'rwe', 'bis', 'nordsee', 'ostsee',
+                  'dampfturbinenanlage', 'ikw', 'kw', 'kohlekraftwerk',
+                  'raffineriekraftwerk']
+
+# characters which are replaced by spaces before splitting the names
+_name_separators = dict.fromkeys(map(ord, u'-/,()[]+0123456789'), u' ')
+# single letters, as matched case-insensitively by the regex [a-z]
+_single_letters = set(u'abcdefghijklmnopqrstuvwxyz\u0130\u0131\u017f\u212a')
+
+
+# patterns searched by the text classifier, all matched case-insensitively
+text_patterns = OrderedDict([
+        ('technology', target_technologies()),
+        ('lignite', ['lignite', 'brown']),
+        ('chp', ['heizkraftwerk', 'hkw', 'chp', 'bhkw', 'cogeneration',
+                 'power and heat', 'heat and power']),
+        ('store', ['battery', 'storage'])])
+
+# every position at which any of the patterns starts is visited once, the
+# lookaheads report all classes matching there
+_text_classifier = re.compile(
+        '(?=' + '|'.join(itertools.chain(*text_patterns.values())) + ')' +
+        ''.join('(?:(?=(?P<{}>{})))?'.format(k, '|'.join(v))
+                for k, v in text_patterns.items()),
+        re.IGNORECASE)
+
+
+def _classify(text):
+    """
+    Scans a single string once and returns the technologies found (as
+    str.findall would, joined by ', ') and the lignite, chp and store flags.
+    """
+    if not isinstance(text, six.string_types):
+        return '', False, False, False
+    hits, flags, end = [], set(), 0
+    for m in _text_classifier.finditer(text):
+        tech = m.group('technology')
+        # technologies do not overlap, the next one is searched after the end
+        if tech is not None and m.start() >= end:
+            hits.append(tech)
+            end = m.start() + len(tech)
+        flags.update(k for k in ('lignite', 'chp', 'store')
+                     if m.group(k) is not None)
+    return (', '.join(hits), 'lignite' in flags, 'chp' in flags,
+            'store' in flags)
+
+
+def classify_text(s):
+    """
+    Classifies the non-null values of a text column in a single pass over
+    its unique values.
+
+    Returns a dataframe indexed like s.dropna() with the columns
+    'technology' (technologies found, empty string if none), 'lignite',
+    'chp' and 'store' (booleans).
+    """
+    s = s.dropna()
+    codes, uniques = pd.factorize(s)
+    classes = (pd.DataFrame([_classify(text) for text in uniques],
+                            columns=['technology', 'lignite', 'chp', 'store'])
+               .astype({'lignite': bool, 'chp': bool, 'store': bool}))
+    return classes.take(codes).set_index(s.index)
+
+
+def _text_classes(df, column, cache=None):
+    """
+    Returns classify_text(df[column]). With a cache (dict) the
+    classification is stored and reused for all values which did not
+    change since the column was classified the last time.
+    """
+    s = df[column].dropna()
+    if cache is None:
+        return classify_text(s)
+    if column in cache:
+        old, classes = cache[column]
+        same = old.reindex(s.index) == s
+        classes = (pd.concat([classes.reindex(s.index[same]),
+                              classify_text(s[~same])])
+                   .reindex(s.index))
+    else:
+        classes = classify_text(s)
+    cache[column] = (s, classes)
+    return classes
+
+
+def _strip_words(name, words, phrases):
+    """
+    Removes all tokens of `name` contained in `words` (lowercase) and the
+    phrases, given as tuples of lowercase tokens together with the words
+    removed before them. A phrase is only removed if its tokens are
+    separated by single spaces and none of them was removed before.
+    """
+    lower_name = name.lower()
+    phrases = [(p, b) for p, b in phrases if p[0] in lower_name]
+    if phrases:
+        parts = re.split(r'(\s+)', name)
+        tokens, seps = parts[0::2], [u' '] + parts[1::2]
+        keep = [True] * len(tokens)
+        lower = [t.lower() for t in tokens]
+        for phrase, before in phrases:
+            if any(t in before for t in phrase):
+                continue
+            n, k = len(phrase), 0
+            while k + n <= len(tokens):
+                if (tuple(lower[k:k + n]) == phrase and all(keep[k:k + n]) and
+                        all(sep == u' ' for sep in seps[k + 1:k + n])):
+                    keep[k:k + n] = [False] * n
+                    k += n
+                else:
+                    k += 1
+        tokens = [t for t, kp in zip(tokens, keep) if kp and t]
+    else:
+        tokens = name.split()
+    return u' '.join(t for t in tokens
+                     if t.lower() not in words and
+                     not (len(t) == 1 and t.lower() in _single_letters))
+
+
 def clean_powerplantname(df):
     """
     Cleans the column "Name" of the database by deleting very frequent
@@ -42,30 +173,29 @@ def clean_powerplantname(df):
         dataframe which should be cleaned
 
     """
-
-    name = df.Name.replace(regex=True, value=' ',
-                           to_replace=list('-/,')+['\(', '\)', '\[', '\]','\+', '[0-9]'])
-
-    common_words = pd.Series(sum(name.str.split(), [])).value_counts()
-    cw = list(common_words[common_words >= 20].index)
-
-    pattern = [('(?i)(^|\s)'+x+'(?=\s|$)')
-               for x in (cw +
-                        ['[a-z]','I','II','III','IV','V','VI','VII','VIII',
-                        'IX','X','XI','Grupo','parque','eolico','gas',
-                        'biomasa','COGENERACION','gt','unnamed',
-                        'tratamiento de purines','planta','de','la','station',
-                        'power','storage','plant','stage','pumped','project',
-                        'dt','gud', 'hkw', 'kbr', 'Kernkraft', 'Kernkraftwerk',
-                        'kwg', 'krb', 'ohu', 'gkn', 'Gemeinschaftskernkraftwerk',
-                        'kki', 'kkp', 'kle', 'wkw', 'rwe', 'bis', 'nordsee', 'ostsee',
-                        'dampfturbinenanlage', 'ikw', 'kw', 'kohlekraftwerk',
-                        'raffineriekraftwerk'])]
-    name = (name
-            .replace(regex=True, to_replace=pattern, value=' ')
-            .replace('\s+', ' ', regex=True)
-            .str.strip()
-            .str.capitalize())
+    def clean(names):
+        frequency = df.Name.value_counts().reindex(names).values
+        names = [six.text_type(s).translate(_name_separators)
+                 if isinstance(s, six.string_types) else s for s in names]
+
+        # count all words in a single pass over the unique names
+        common_words = Counter()
+        for s, n in zip(names, frequency):
+            if isinstance(s, six.string_types):
+                for w in s.split():
+                    common_words[w] += n
+        cw = set(w.lower() for w, count in common_words.items() if count >= 20)
+
+        fixed = [w.lower() for w in name_stopwords]
+        words = cw | set(w for w in fixed if ' ' not in w)
+        # phrases are only removed if none of their words was removed
+        # before, as it happens when removing the stop words one after the other
+        phrases = [(tuple(w.split()), cw | set(fixed[:k]))
+                   for k, w in enumerate(fixed) if ' ' in w]
+        return [_strip_words(s, words, phrases).capitalize()
+                if isinstance(s, six.string_types) else s for s in names]
+
+    name = map_unique(df.Name, clean)
 
     return (df
             .assign(Name=name)
@@ -74,11 +204,11 @@ def clean_powerplantname(df):
             .reset_index(drop=True))
 
 
-def gather_fueltype_info(df, search_col=['Name', 'Technology']):
+def gather_fueltype_info(df, search_col=['Name', 'Technology'], cache=None):
     fueltype = pd.Series(df['Fueltype'])
 
     for i in search_col:
-        found_b = df[i].dropna().str.contains('(?i)lignite|brown')
+        found_b = _text_classes(df, i, cache).lignite
         fueltype.loc[found_b.reindex(fueltype.index, fill_value=False)] = 'Lignite'
     fueltype.replace({'Coal': 'Hard Coal'}, inplace=True)
 
@@ -86,17 +216,14 @@ def gather_fueltype_info(df, search_col=['Name', 'Technology']):
 
 
 
-def gather_technology_info(df, search_col=['Name', 'Fueltype']):
+def gather_technology_info(df, search_col=['Name', 'Fueltype'], cache=None):
     technology = (df['Technology'].dropna()
                   if 'Technology' in df
                   else pd.Series())
 
-    pattern = '|'.join(('(?i)'+x) for x in target_technologies())
     for i in search_col:
-        found = (df[i].dropna()
-                 .str.findall(pattern)
-                 .loc[lambda s: s.str.len() > 0]
-                 .str.join(sep=', '))
+        found = (_text_classes(df, i, cache).technology
+                 .loc[lambda s: s.str.len() > 0])
 
         exists_i = technology.index.intersection(found.index)
         if len(exists_i) > 0:
@@ -109,22 +236,19 @@ def gather_technology_info(df, search_col=['Name', 'Fueltype']):
     return df.assign(Technology=technology)
 
 
-def gather_set_info(df, search_col=['Name', 'Fueltype', 'Technology']):
+def gather_set_info(df, search_col=['Name', 'Fueltype', 'Technology'],
+                    cache=None):
     Set = (df['Set'].copy()
            if 'Set' in df
            else pd.Series(index=df.index))
 
-    pattern = '|'.join(['heizkraftwerk', 'hkw', 'chp', 'bhkw', 'cogeneration',
-                        'power and heat', 'heat and power'])
-    for i in search_col:
-        isCHP_b = df[i].dropna().str.contains(pattern, case=False)\
-                    .reindex(df.index).fillna(False)
+    classes = [_text_classes(df, i, cache) for i in search_col]
+    for c in classes:
+        isCHP_b = c.chp.reindex(df.index, fill_value=False)
         Set.loc[isCHP_b] = 'CHP'
 
-    pattern = '|'.join(['battery', 'storage'])
-    for i in search_col:
-        isStore_b = df[i].dropna().str.contains(pattern, case=False) \
-                    .reindex(df.index).fillna(False)
+    for c in classes:
+        isStore_b = c.store.reindex(df.index, fill_value=False)
         Set.loc[isStore_b] = 'Store'
 
     df = df.assign(Set=Set)
@@ -132,29 +256,162 @@ def gather_set_info(df, search_col=['Name', 'Fueltype', 'Technology']):
     return df
 
 
+def gather_text_info(df, fueltype_col=None, technology_col=['Name', 'Fueltype'],
+                     set_col=['Name', 'Fueltype', 'Technology']):
+    """
+    Gathers fueltype, technology and set information from the text columns
+    of a dataset. This is the same as piping the dataset through
+    gather_fueltype_info, gather_technology_info and gather_set_info,
+    however, each column is scanned only once by the text classifier and
+    merely the values changed by a previous step are classified again.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        dataset to gather the information for
+    fueltype_col : list, default None
+        columns searched for lignite, if None the fueltypes are not touched
+    technology_col : list, default ['Name', 'Fueltype']
+        columns searched for target technologies, skipped if None
+    set_col : list, default ['Name', 'Fueltype', 'Technology']
+        columns searched for CHP and storage plants, skipped if None
+    """
+    cache = {}
+    if fueltype_col is not None:
+        df = gather_fueltype_info(df, search_col=fueltype_col, cache=cache)
+    if technology_col is not None:
+        df = gather_technology_info(df, search_col=technology_col, cache=cache)
+    if set_col is not None:
+        df = gather_set_info(df, search_col=set_col, cache=cache)
+    return df
+
+
+# rules of clean_technology, applied in this order to every technology:
+#   'sub'    replaces all matches of the pattern by the value
+#   'equal'  replaces the technology if it equals the pattern
+#   'set'    replaces the technology if it contains the pattern (any case)
+#   'hydro'  same as 'set', but only applied if generalize_hydros is True
+#   'title'  title-cases, sorts and deduplicates the comma-separated parts
+technology_rules = [('sub', ' and ', ', '),
+                    ('sub', ' Power Plant', ''),
+                    ('sub', 'Battery', ''),
+                    ('hydro', 'pump', 'Pumped Storage'),
+                    ('hydro', 'reservoir|lake', 'Reservoir'),
+                    ('hydro', 'run-of-river|weir|water', 'Run-Of-River'),
+                    ('hydro', 'dam', 'Reservoir'),
+                    ('equal', 'Gas turbine', 'OCGT'),
+                    ('set', 'combined cycle', 'CCGT'),
+                    ('set', 'steam turbine|critical thermal', 'Steam Turbine'),
+                    ('set', 'ocgt|open cycle', 'OCGT'),
+                    ('title', None, None),
+                    ('sub', 'Ccgt', 'CCGT'),
+                    ('sub', 'Ocgt', 'OCGT')]
+
+
+def _compile_rules(rules):
+    compiled = []
+    for kind, pattern, value in rules:
+        if kind in ('sub', 'set', 'hydro'):
+            flags = re.IGNORECASE if kind in ('set', 'hydro') else 0
+            pattern = re.compile(pattern, flags)
+        compiled.append((kind, pattern, value))
+    return compiled
+
+_technology_rules = _compile_rules(technology_rules)
+
+
+def _apply_technology_rules(tech, rules):
+    for kind, pattern, value in rules:
+        if kind == 'sub':
+            tech = pattern.sub(value, tech)
+        elif kind == 'equal':
+            if tech == pattern:
+                tech = value
+        elif kind == 'title':
+            parts = sorted(set(tech.title().split(', ')))
+            tech = ', '.join(p.strip() for p in parts)
+        elif pattern.search(tech):
+            tech = value
+    return tech
+
+
 def clean_technology(df, generalize_hydros=False):
+    """
+    Standardizes the technology names by applying the technology_rules to
+    the unique technologies. The Technology column of the returned
+    dataframe is categorical.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        dataframe with a Technology column
+    generalize_hydros : bool, default False
+        whether to apply the 'hydro' rules which generalize hydro
+        technologies to 'Pumped Storage', 'Reservoir' and 'Run-Of-River'
+    """
     tech = df['Technology'].dropna()
     if len(tech)==0:
         return df
-    tech = tech.replace(
-            {' and ': ', ', ' Power Plant': '', 'Battery':''}, regex=True)
-    if generalize_hydros:
-        tech[tech.str.contains('pump', case=False)] = 'Pumped Storage'
-        tech[tech.str.contains('reservoir|lake', case=False)] = 'Reservoir'
-        tech[tech.str.contains('run-of-river|weir|water', case=False)] = 'Run-Of-River'
-        tech[tech.str.contains('dam', case=False)] = 'Reservoir'
-    tech = tech.replace({'Gas turbine': 'OCGT'})
-    tech[tech.str.contains('combined cycle', case=False)] = 'CCGT'
-    tech[tech.str.contains('steam turbine|critical thermal', case=False)] = 'Steam Turbine'
-    tech[tech.str.contains('ocgt|open cycle', case=False)] = 'OCGT'
-    tech = (tech.str.title()
-                .str.split(', ')
-                .apply(lambda x: ', '.join(i.strip() for i in np.unique(x))))
-    tech = tech.replace({'Ccgt': 'CCGT', 'Ocgt': 'OCGT'}, regex=True)
-    return df.assign(Technology=tech)
-
-
-def cliques(df, dataduplicates):
+    rules = [(kind, pattern, value) for kind, pattern, value in _technology_rules
+             if generalize_hydros or kind != 'hydro']
+    tech = map_unique(tech, lambda tech: [_apply_technology_rules(t, rules)
+                                          for t in tech])
+    return df.assign(Technology=tech.astype('category'))
+
+
+def _reciprocal_edges(index, duplicates):
+    """
+    Returns the positions (i, j) with i < j of the records in `index`
+    which are linked in both directions by the duplicates.
+    """
+    from scipy.sparse import coo_matrix, triu
+    n = len(index)
+    i = index.get_indexer(duplicates['one'])
+    j = index.get_indexer(duplicates['two'])
+    keep = (i >= 0) & (j >= 0) & (i != j)
+    links = coo_matrix((np.ones(keep.sum()), (i[keep], j[keep])),
+                       shape=(n, n)).tocsr()
+    reciprocal = triu(links.multiply(links.T), k=1).tocoo()
+    return reciprocal.row, reciprocal.col
+
+
+def _unit_groups(index, i, j, refine=2):
+    """
+    Groups the records of `index` connected by the undirected edges (i, j)
+    of their positions and returns the group of every record, numbered
+    consecutively.
+
+    Connected components are the groups. Components with more than
+    `refine` members which are not fully linked are split into their
+    maximal cliques; a record in several cliques belongs to the one
+    found last. The nodes of a component are searched in the order of
+    `index`, such that the groups do not depend on the order of the edges.
+    refine=None keeps all components.
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+    n = len(index)
+    n_groups, labels = connected_components(
+            coo_matrix((np.ones(len(i)), (i, j)), shape=(n, n)), directed=False)
+    if refine is not None and len(i):
+        sizes = np.bincount(labels, minlength=n_groups)
+        n_edges = np.bincount(labels[i], minlength=n_groups)
+        incomplete = (sizes > refine) & (n_edges < sizes * (sizes - 1) // 2)
+        edges = np.flatnonzero(incomplete[labels[i]])
+        edges = edges[np.argsort(labels[i[edges]], kind='mergesort')]
+        splits = np.flatnonzero(np.diff(labels[i[edges]])) + 1
+        for component in np.split(edges, splits) if len(edges) else []:
+            members = np.unique(np.r_[i[component], j[component]])
+            H = nx.Graph()
+            H.add_nodes_from(index[members])
+            H.add_edges_from(zip(index[i[component]], index[j[component]]))
+            for clique in nx.algorithms.clique.find_cliques(H):
+                labels[index.get_indexer(clique)] = n_groups
+                n_groups += 1
+    return np.unique(labels, return_inverse=True)[1]
+
+
+def cliques(df, dataduplicates, refine=2):
     """
     Locate cliques of units which are determined to belong to the same
     powerplant.  Return the same dataframe with an additional column
@@ -168,22 +425,173 @@ def cliques(df, dataduplicates):
     dataduplicates : pandas.Dataframe or string
         dataframe or name of the csv-linkfile which determines the
         link within one dataset
+    refine : int or None, default 2
+        Units linked reciprocally are grouped by connected components.
+        Components with more than `refine` units which are not fully
+        linked are split into maximal cliques (with networkx). The default
+        only leaves out components which are cliques already. Units which
+        are not part of overlapping cliques are grouped as by a clique
+        search on the whole graph; a unit in several cliques is assigned
+        to the one found last within its component, which may differ from
+        the whole-graph search. None groups all connected units, which is
+        fastest.
     """
 #    df = read_csv_if_string(df)
-    G = nx.DiGraph()
-    G.add_nodes_from(df.index)
-    G.add_edges_from((r.one, r.two) for r in dataduplicates.itertuples())
-    H = G.to_undirected(reciprocal=True)
+    i, j = _reciprocal_edges(df.index, dataduplicates)
+    grouped = pd.Series(_unit_groups(df.index, i, j, refine).astype(float),
+                        index=df.index)
+    return df.assign(grouped=grouped)
+
+
+def _record_hashes(df):
+    """
+    Hashes of the columns of every record which are relevant for the
+    deduplication, used to detect changed records.
+    """
+    columns = ['Name', 'Fueltype', 'Technology', 'Country', 'Capacity', 'lat', 'lon']
+    return pd.util.hash_pandas_object(df.reindex(columns=columns).astype(str),
+                                      index=False).astype(str)
 
-    grouped = pd.Series(np.nan, index=df.index)
-    for i, inds in enumerate(nx.algorithms.clique.find_cliques(H)):
-        grouped.loc[inds] = i
 
+def _read_aggregation_groups(path_name):
+    """
+    Reads saved aggregation groups, returns None if the file does not
+    exist or is in the old positional format.
+    """
+    try:
+        saved = pd.read_csv(path_name, dtype={'projectID': str, 'hash': str})
+    except (ValueError, IOError):
+        return None
+    if not {'projectID', 'hash', 'grouped'}.issubset(saved.columns):
+        return None
+    if saved['projectID'].isnull().any() or saved['projectID'].duplicated().any():
+        logger.warning("Saved aggregation groups '{}' do not have unique "
+                       "projectIDs".format(path_name))
+        return None
+    return saved.set_index('projectID')
+
+
+def _write_aggregation_groups(df, path_name):
+    """
+    Saves the aggregation groups by projectID, they are only saved if the
+    projectIDs identify the records uniquely.
+    """
+    if df['projectID'].isnull().any() or df['projectID'].duplicated().any():
+        logger.warning("Not saving aggregation groups to '{}', the projectIDs "
+                       "are not unique".format(path_name))
+        return
+    try:
+        pd.DataFrame({'projectID': df['projectID'].astype(str).values,
+                      'hash': _record_hashes(df).values,
+                      'grouped': df['grouped'].values},
+                     columns=['projectID', 'hash', 'grouped']).to_csv(path_name, index=False)
+    except IndexError:
+        pass
+
+
+def incremental_cliques(df, saved, refine=2, **dukeargs):
+    """
+    Extends saved aggregation groups by the records which are new or
+    changed. Only those records are compared (with duke) against the
+    whole dataset. A new record joins the existing group it has the most
+    reciprocal links with, the remaining new records are grouped by
+    cliques among themselves (see cliques). The native backend scores
+    only the pairs with a new record, the other backends are given the
+    new records together with the records of their blocks or candidates.
+    Without blocking or candidates they would compare the whole dataset,
+    hence None is returned for them. Returns the dataframe with the
+    additional column "grouped", or None if the saved groups cannot be
+    used.
+
+    Parameters
+    ----------
+    df : pandas.Dataframe
+        dataframe which should be aggregated, with unique projectIDs
+    saved : pandas.Dataframe
+        saved aggregation groups indexed by projectID, with the columns
+        "hash" and "grouped"
+    refine : int or None, default 2
+        refinement of the groups of the new records, see cliques
+    **dukeargs : keyword-args for duke
+    """
+    ids = df['projectID'].astype(str)
+    if df['projectID'].isnull().any() or ids.duplicated().any():
+        logger.warning("Incremental aggregation requires unique projectIDs")
+        return None
+
+    previous = saved.reindex(ids.values)
+    known = (previous['hash'].values == _record_hashes(df).values)
+    grouped = pd.Series(np.where(known, previous['grouped'].values, np.nan),
+                        index=df.index)
+    delta = np.flatnonzero(~known)
+    logger.info("Aggregating {} new or changed of {} records incrementally"
+                .format(len(delta), len(df)))
+    if len(delta) == 0:
+        return df.assign(grouped=grouped)
+    backend = dukeargs.get('backend', 'java')
+    if (backend != 'native' and dukeargs.get('blocking') is None and
+            dukeargs.get('candidates') is None):
+        logger.warning("Incremental aggregation with the '{}' backend requires "
+                       "blocking or candidates, aggregating the whole dataset "
+                       "again".format(backend))
+        return None
+
+    # pairs of the new records with all records, within the same block
+    # if blocking is requested
+    i = np.repeat(delta, len(df))
+    j = np.tile(np.arange(len(df)), len(delta))
+    keep = (i != j) & ~(np.isin(j, delta) & (j < i))
+    blocking = dukeargs.pop('blocking', None)
+    capacity_bands = dukeargs.pop('capacity_bands', None)
+    if blocking is not None:
+        labels = block_labels(df, blocking, capacity_bands).values
+        keep &= (labels[i] == labels[j]) | pd.isnull(labels[i]) | pd.isnull(labels[j])
+    candidates = pd.DataFrame({'one': df.index.values[i[keep]],
+                               'two': df.index.values[j[keep]]},
+                              columns=['one', 'two'])
+    generated = dukeargs.pop('candidates', None)
+    if generated is not None:
+        # restrict the pairs further to the requested candidates
+        generated = generate_candidates([df], ['one', 'two'], generated)
+        generated.columns = ['one', 'two']
+        candidates = pd.concat([candidates.merge(generated),
+                                candidates.merge(generated.rename(
+                                    columns={'one': 'two', 'two': 'one'}))])
+
+    if backend == 'native':
+        duplicates = duke(df, candidates=candidates, **dukeargs)
+    else:
+        # the duke binaries compare all records they are given, hence only
+        # the new records and their (blocked) candidates are handed over
+        involved = df.index.isin(np.r_[candidates.one.values, candidates.two.values])
+        duplicates = duke(df[involved], blocking=blocking,
+                          capacity_bands=capacity_bands, **dukeargs)
+        duplicates = duplicates.merge(pd.concat([candidates, candidates.rename(
+                                columns={'one': 'two', 'two': 'one'})]))
+
+    i, j = _reciprocal_edges(df.index, duplicates)
+    neighbours = (pd.Series(df.index[np.r_[j, i]].values,
+                            index=df.index[np.r_[i, j]])
+                  .groupby(level=0).apply(list))
+
+    new = df.index[delta]
+    for n in new:
+        links = grouped.reindex(neighbours.get(n, [])).dropna()
+        if len(links):
+            counts = links.value_counts()
+            grouped.loc[n] = counts[counts == counts.max()].index.min()
+
+    remaining = np.flatnonzero(grouped.isnull().values)
+    inner = np.isin(i, remaining) & np.isin(j, remaining)
+    start = np.nanmax(np.r_[-1, grouped.values]) + 1
+    groups = _unit_groups(df.index, i[inner], j[inner], refine)
+    grouped.iloc[remaining] = start + pd.factorize(groups[remaining])[0]
     return df.assign(grouped=grouped)
 
 
 def aggregate_units(df, use_saved_aggregation=False, dataset_name=None,
-                    detailed_columns=False, return_aggregation_groups=False):
+                    detailed_columns=False, return_aggregation_groups=False,
+                    incremental=False, refine_cliques=2, **dukeargs):
     """
     Vertical cleaning of the database. Cleans the "Name"-column, sums
     up the capacity of powerplant units which are determined to belong
@@ -202,6 +610,19 @@ def aggregate_units(df, use_saved_aggregation=False, dataset_name=None,
     dataset_name : str
         custom name for dataset identification, choose your own
         identification in case no metadata is passed to the function
+    incremental : bool, default False
+        Reuse the saved aggregation groups and only compare records
+        which are new or changed since they were saved, see
+        incremental_cliques. Falls back to a full aggregation if no
+        usable groups were saved, or if the duke binaries would compare
+        the whole dataset anyway (no blocking or candidates given).
+    refine_cliques : int or None, default 2
+        Units linked by duke are grouped by connected components, and
+        components with more than `refine_cliques` units which are not
+        fully linked are split into cliques, see cliques. None skips the
+        refinement.
+    **dukeargs : keyword-args for duke, e.g. backend='native' and
+        candidates='sorted_neighbourhood'
     """
     def prop_for_groups(x):
         """
@@ -225,34 +646,50 @@ def aggregate_units(df, use_saved_aggregation=False, dataset_name=None,
             results['Duration'] = (x.Duration * x.Capacity / x.Capacity.sum()).sum()
         elif ('Duration' in target_columns()):
             results['Duration'] = np.nan
+        for column in identifier_columns():
+            if column in x:
+                results[column] = list(x[column].dropna())
         return pd.Series(results)
 
     path_name = _data_out('aggregation_groups_{}.csv'.format(dataset_name))
-    if use_saved_aggregation:
-        try:
-            logger.info("Reading saved aggregation groups for dataset '{}'.".format(dataset_name))
-            groups = pd.read_csv(path_name, header=None, index_col=0).reindex(index=df.index)
-            df = df.assign(grouped=groups.values)
-        except (ValueError, IOError):
+    saved = None
+    if use_saved_aggregation or incremental:
+        logger.info("Reading saved aggregation groups for dataset '{}'.".format(dataset_name))
+        saved = _read_aggregation_groups(path_name)
+        if 'grouped' in df:
+            df = df.drop('grouped', axis=1)
+        if saved is None:
             logger.warning("Non-existing saved links for dataset '{0}', "
                            "continuing by aggregating again".format(dataset_name))
-            if 'grouped' in df:
-                df.drop('grouped', axis=1, inplace=True)
+
+    if saved is not None and incremental:
+        aggregated = incremental_cliques(df, saved, refine=refine_cliques,
+                                         **dukeargs)
+        if aggregated is not None:
+            df = aggregated
+    elif saved is not None:
+        groups = saved['grouped'].reindex(df['projectID'].astype(str).values)
+        if groups.isnull().any():
+            logger.warning("Saved links for dataset '{0}' do not cover all "
+                           "records, continuing by aggregating again"
+                           .format(dataset_name))
+        else:
+            df = df.assign(grouped=groups.values)
 
     if 'grouped' not in df:
-        duplicates = duke(df)
-        df = cliques(df, duplicates)
-        try:
-            df.grouped.to_csv(path_name)
-        except IndexError:
-            pass
+        duplicates = duke(df, **dukeargs)
+        df = cliques(df, duplicates, refine=refine_cliques)
+        _write_aggregation_groups(df, path_name)
+    elif incremental:
+        _write_aggregation_groups(df, path_name)
 
     grouped = df.set_index('projectID')['grouped']
     df = df.groupby('grouped').apply(prop_for_groups)
     if 'Duration' in df:
         df['Duration'] = df['Duration'].replace(0., np.nan)
     df = df.reset_index(drop=True).pipe(clean_powerplantname)
-    df = df.loc[:, target_columns(detailed_columns=detailed_columns)]
+    df = df.loc[:, target_columns(detailed_columns=detailed_columns) +
+                [c for c in identifier_columns() if c in df]]
     if return_aggregation_groups:
         return df, grouped
     else:
@@ -261,7 +698,7 @@ def aggregate_units(df, use_saved_aggregation=False, dataset_name=None,
 
 def clean_single(df, dataset_name=None, aggregate_powerplant_units=True,
                  use_saved_aggregation=False, detailed_columns=False,
-                 return_aggregation_groups=False):
+                 return_aggregation_groups=False, **dukeargs):
     """
     Vertical cleaning of the database. Cleans the "Name"-column, sums
     up the capacity of powerplant units which are determined to belong
@@ -289,8 +726,12 @@ def clean_single(df, dataset_name=None, aggregate_powerplant_units=True,
         want to have aggregated powerplants without running the
         aggregation algorithm again
 
+    **dukeargs : keyword-args for duke, used for the aggregation of the units,
+        and ``incremental`` and ``refine_cliques`` of aggregate_units
+
     """
-    if aggregate_powerplant_units and use_saved_aggregation and dataset_name is None:
+    if (aggregate_powerplant_units and dataset_name is None and
+            (use_saved_aggregation or dukeargs.get('incremental', False))):
         raise ValueError('``aggregate_powerplant_units`` is True but no ``dataset_name`` was given!')
     if dataset_name is None:
         dataset_name='Unnamed dataset'
@@ -305,10 +746,12 @@ def clean_single(df, dataset_name=None, aggregate_powerplant_units=True,
                                           use_saved_aggregation=use_saved_aggregation,
                                           dataset_name=dataset_name,
                                           detailed_columns=detailed_columns,
-                                          return_aggregation_groups=True)
+                                          return_aggregation_groups=True,
+                                          **dukeargs)
         else:
             df = aggregate_units(df, use_saved_aggregation=use_saved_aggregation,
-                                 dataset_name=dataset_name, detailed_columns=detailed_columns)
+                                 dataset_name=dataset_name, detailed_columns=detailed_columns,
+                                 **dukeargs)
 
     else:
         df['projectID'] = df['projectID'].dropna().map(lambda x: [x])
@@ -21,12 +21,16 @@ from __future__ import print_function
 import pandas as pd
 import os
 import ast
+import hashlib
+from collections import OrderedDict
 import logging
 logger = logging.getLogger(__name__)
 from .utils import set_uncommon_fueltypes_to_other, _data_in, _data_out
 from .data import data_config, OPSD, ESE
 from .cleaning import clean_single
-from .matching import combine_multiple_datasets, reduce_matched_dataframe
+from .features import name_features
+from .matching import (link_multiple_datasets, link_table, matched_dataframe,
+                       reduce_matched_dataframe)
 from .heuristics import (extend_by_non_matched, extend_by_VRE, remove_oversea_areas,
                          manual_corrections)
 
@@ -47,9 +51,16 @@ def Collection(datasets, update=False, use_saved_aggregation=False, reduced=True
         or to do an vertical update (False)
     reduced : bool
         Switch as to return the reduced (True) or matched (False) dataset.
+        The matches are stored as link table in data/out/Matched_XX_links.csv
+        next to the cleaned datasets they refer to (Matched_XX_datasets.pkl),
+        the matched dataset is only built (and stored) if requested. Without
+        update, it is projected from the stored link table and datasets, an
+        update is forced if these do not belong together.
     custom_config : dict
         Updates to the data_config dict from data module
-    **dukeargs : keyword-args for duke
+    **dukeargs : keyword-args for duke and compare_two_datasets, e.g.
+        use_cache=True for reusing the matches of unchanged pairs of
+        datasets
     """
 
     # Deal with the case that only one dataset is requested
@@ -68,42 +79,85 @@ def Collection(datasets, update=False, use_saved_aggregation=False, reduced=True
                               .format('_'.join(map(str.upper, datasets))))
     outfn_reduced = _data_out('Matched_{}_reduced.csv'
                               .format('_'.join(map(str.upper, datasets))))
+    outfn_links = _data_out('Matched_{}_links.csv'
+                            .format('_'.join(map(str.upper, datasets))))
+    outfn_datasets = _data_out('Matched_{}_datasets.pkl'
+                               .format('_'.join(map(str.upper, datasets))))
 
-    if not update and not os.path.exists(outfn_reduced if reduced else outfn_matched):
+    if not update and not os.path.exists(outfn_reduced if reduced else outfn_links):
         logger.warning("Forcing update since the cache file is missing")
         update = True
         use_saved_aggregation = True
+    elif not update and not reduced:
+        # the stored datasets are those the stored links refer to
+        stored = (pd.read_pickle(outfn_datasets)
+                  if os.path.exists(outfn_datasets) else None)
+        if stored is None or stored['hash'] != _file_hash(outfn_links):
+            logger.warning("Forcing update since the stored links do not "
+                           "belong to the stored datasets")
+            update = True
+            use_saved_aggregation = True
 
     if update:
-        dfs = []
-        for name in datasets:
-            conf = data_config[name].copy()
-            conf.update(custom_config.get(name, {}))
-
-            df = conf['read_function'](**conf.get('read_kwargs', {}))
-            df = clean_single(df, use_saved_aggregation=use_saved_aggregation,
-                              dataset_name=name,
-                              **conf.get('clean_single_kwargs', {}))
-            dfs.append(df)
-        matched = combine_multiple_datasets(dfs, datasets, **dukeargs)
-        matched.to_csv(outfn_matched, index_label='id', encoding='utf-8')
-
-        reduced_df = reduce_matched_dataframe(matched)
+        dfs = _cleaned_datasets(datasets, custom_config, use_saved_aggregation,
+                                backend=dukeargs.get('backend', 'java'))
+        if dukeargs.get('backend') == 'native':
+            dukeargs['features'] = [name_features(df, dataset_name=name)
+                                    for name, df in dfs.items()]
+        links = link_table(link_multiple_datasets(list(dfs.values()), datasets,
+                                                  **dukeargs))
+        links.to_csv(outfn_links, index=False, encoding='utf-8')
+        pd.to_pickle({'hash': _file_hash(outfn_links), 'datasets': dfs},
+                     outfn_datasets)
+        # a matched dataset of earlier links is outdated now
+        if os.path.exists(outfn_matched):
+            os.remove(outfn_matched)
+
+        reduced_df = reduce_matched_dataframe(links, datasets=dfs,
+                                              n_jobs=dukeargs.get('n_jobs', 1))
         reduced_df.to_csv(outfn_reduced, index_label='id', encoding='utf-8')
-
-        return reduced_df if reduced else matched
-    else:
         if reduced:
-            sdf = pd.read_csv(outfn_reduced, index_col=0, encoding='utf-8')
-        else:
-            sdf = pd.read_csv(outfn_matched, index_col=0, header=[0,1], encoding='utf-8')
-        if 'projectID' in sdf and reduced:
+            return reduced_df
+    elif reduced:
+        sdf = pd.read_csv(outfn_reduced, index_col=0, encoding='utf-8')
+        if 'projectID' in sdf:
             try: # ast.literal_eval() seems to be unstable when NaN are given.
                 sdf.projectID = (sdf.projectID.str.replace('\[nan\]','[]')
                                     .apply(lambda df: ast.literal_eval(df)))
             except ValueError:
                 pass
         return sdf
+    else:
+        links = pd.read_csv(outfn_links, encoding='utf-8')
+        dfs = stored['datasets']
+
+    # the wide matched dataframe is only built if requested
+    matched = matched_dataframe(links, dfs)
+    matched.to_csv(outfn_matched, index_label='id', encoding='utf-8')
+    return matched
+
+
+def _file_hash(path_name):
+    with open(path_name, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _cleaned_datasets(datasets, custom_config, use_saved_aggregation,
+                      backend='java'):
+    """
+    Reads and cleans the given datasets, returns them keyed by their
+    identifiers.
+    """
+    dfs = OrderedDict()
+    for name in datasets:
+        conf = data_config[name].copy()
+        conf.update(custom_config.get(name, {}))
+
+        df = conf['read_function'](**conf.get('read_kwargs', {}))
+        dfs[name] = clean_single(df, use_saved_aggregation=use_saved_aggregation,
+                                 dataset_name=name, backend=backend,
+                                 **conf.get('clean_single_kwargs', {}))
+    return dfs
 
 def Carma_ENTSOE_GEO_OPSD_matched(update=False, use_saved_aggregation=False):
     return Collection(['CARMA', 'ENTSOE', 'GEO', 'OPSD'],
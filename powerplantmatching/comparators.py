@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+## Copyright 2015-2016 Fabian Hofmann (FIAS), Jonas Hoersch (FIAS)
+
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 3 of the
+## License, or (at your option) any later version.
+
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Python re-implementations of the Duke cleaners and comparators used in
+the configuration files Comparison.xml and Deleteduplicates.xml
+"""
+
+from __future__ import absolute_import, print_function, division
+
+import unicodedata
+import numpy as np
+import six
+
+
+def lowercase_normalize(s):
+    """
+    Equivalent of Duke's LowerCaseNormalizeCleaner: strips accents,
+    lowercases and collapses whitespace.
+    """
+    s = unicodedata.normalize('NFD', six.text_type(s))
+    s = u''.join(c for c in s if not unicodedata.combining(c))
+    return u' '.join(s.lower().split())
+
+
+def jaro_winkler(s1, s2):
+    """
+    Jaro-Winkler similarity as implemented in Duke (including its way
+    of counting transpositions).
+    """
+    if s1 == s2:
+        return 1.0
+    if len(s1) > len(s2):
+        s1, s2 = s2, s1
+
+    maxdist = len(s2) // 2
+    c = 0
+    t = 0
+    prevpos = -1
+    for ix, ch in enumerate(s1):
+        for ix2 in range(max(0, ix - maxdist), min(len(s2), ix + maxdist)):
+            if ch == s2[ix2]:
+                c += 1
+                if prevpos != -1 and ix2 < prevpos:
+                    t += 1
+                prevpos = ix2
+                break
+
+    if c == 0:
+        return 0.0
+
+    score = (c / len(s1) + c / len(s2) + (c - t) / c) / 3.0
+
+    p = 0
+    last = min(4, len(s1))
+    while p < last and s1[p] == s2[p]:
+        p += 1
+    return score + (p * (1 - score)) / 10
+
+
+def jaro_winkler_tokenized(s1, s2):
+    """
+    Duke's JaroWinklerTokenized: every token of the shorter string is
+    matched with its most similar token in the longer one, unmatched
+    tokens are penalized.
+    """
+    if s1 == s2:
+        return 1.0
+    t1 = s1.split()
+    t2 = s2.split()
+    if not t1 or not t2:
+        return 0.0
+    if len(t1) > len(t2):
+        t1, t2 = t2, t1
+
+    total = sum(max(jaro_winkler(a, b) for b in t2) for a in t1)
+    return total / len(t1) - (len(t2) - len(t1)) / len(t2)
+
+
+def qgrams(s, q=2):
+    return set(s[i:i+q] for i in range(len(s) - q + 1))
+
+
+def qgram(s1, s2, q=2):
+    """
+    Duke's QGramComparator with the default basic tokenizer and
+    overlap formula.
+    """
+    if s1 == s2:
+        return 1.0
+    q1 = qgrams(s1, q)
+    q2 = qgrams(s2, q)
+    if not q1 or not q2:
+        return 0.0
+    return len(q1 & q2) / min(len(q1), len(q2))
+
+
+def numeric(d1, d2, min_ratio=0.):
+    """
+    Duke's NumericComparator, vectorized over arrays of floats. The
+    similarity is the ratio of the smaller to the larger value.
+    """
+    d1 = np.asarray(d1, dtype=float)
+    d2 = np.asarray(d2, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.minimum(d1, d2) / np.maximum(d1, d2)
+    ratio = np.where(d1 == d2, 1.0, np.nan_to_num(ratio))
+    return np.where(ratio < min_ratio, 0., ratio)
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Great circle distance in meters, vectorized over arrays of
+    coordinates in degrees.
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * 6371000. * np.arcsin(np.sqrt(np.clip(a, 0., 1.)))
+
+
+def geoposition(lat1, lon1, lat2, lon2, max_distance=5000.):
+    """
+    Duke's GeopositionComparator, vectorized: linearly decreasing
+    similarity which reaches zero at `max_distance` meters.
+    """
+    dist = haversine(lat1, lon1, lat2, lon2)
+    return np.where(dist > max_distance, 0., 1. - dist / max_distance)
+
+
+def encode_strings(strings):
+    """
+    Returns the unicode code points of the strings as a zero-padded
+    two-dimensional integer array together with the string lengths.
+    """
+    strings = np.asarray(strings, dtype=six.text_type)
+    if strings.size == 0 or strings.dtype.itemsize == 0:
+        return np.zeros((len(strings), 1), dtype=np.uint32), np.zeros(len(strings), dtype=int)
+    codes = strings.view(np.uint32).reshape(len(strings), -1)
+    return codes, (codes != 0).sum(axis=1)
+
+
+def jaro_winkler_batch(codes1, len1, codes2, len2):
+    """
+    Vectorized version of jaro_winkler() for pairs of strings encoded by
+    encode_strings(), the pairs are given by aligned rows. The loops
+    only run over the character positions.
+    """
+    width = max(codes1.shape[1], codes2.shape[1])
+    codes1 = np.pad(codes1, ((0, 0), (0, width - codes1.shape[1])), 'constant')
+    codes2 = np.pad(codes2, ((0, 0), (0, width - codes2.shape[1])), 'constant')
+    equal = (len1 == len2) & (codes1 == codes2).all(axis=1)
+
+    # the first string is the shorter one
+    swap = len1 > len2
+    codes1, codes2 = (np.where(swap[:, None], codes2, codes1),
+                      np.where(swap[:, None], codes1, codes2))
+    len1, len2 = np.where(swap, len2, len1), np.where(swap, len1, len2)
+
+    maxdist = len2 // 2
+    pos = np.arange(width)
+    c = np.zeros(len(len1))
+    t = np.zeros(len(len1))
+    prevpos = np.full(len(len1), -1)
+    for ix in range(width):
+        window = ((pos[None, :] >= (ix - maxdist)[:, None]) &
+                  (pos[None, :] < np.minimum(len2, ix + maxdist)[:, None]))
+        hit = (codes2 == codes1[:, ix:ix+1]) & window & (ix < len1)[:, None]
+        found = hit.any(axis=1)
+        first = hit.argmax(axis=1)
+        c += found
+        t += found & (prevpos != -1) & (first < prevpos)
+        prevpos = np.where(found, first, prevpos)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score = (c / len1 + c / len2 + (c - t) / c) / 3.0
+    score = np.where(c == 0, 0., score)
+
+    prefix = ((codes1[:, :4] == codes2[:, :4]) &
+              (np.arange(min(4, width))[None, :] < np.minimum(4, len1)[:, None]))
+    p = np.cumprod(prefix, axis=1).sum(axis=1)
+    score = score + (p * (1 - score)) / 10
+    return np.where(equal, 1.0, score)
+
+
+def jaro_winkler_tokenized_batch(strings1, strings2, i, j, chunksize=2**18,
+                                 tokens1=None, tokens2=None):
+    """
+    Vectorized version of jaro_winkler_tokenized() for the pairs of
+    strings (strings1[i], strings2[j]). Every distinct pair of tokens is
+    compared only once. The tokens of the strings are split off by
+    whitespace unless given as `tokens1` and `tokens2`, e.g. from
+    powerplantmatching.features.name_features.
+    """
+    strings1 = np.asarray(strings1, dtype=object)
+    strings2 = np.asarray(strings2, dtype=object)
+    i, j = np.asarray(i, dtype=int), np.asarray(j, dtype=int)
+    if len(i) == 0:
+        return np.array([])
+
+    # tokenize every string once, tokens are referenced by vocabulary ids
+    tokenized = [[s.split() for s in strings1] if tokens1 is None else tokens1,
+                 [s.split() for s in strings2] if tokens2 is None else tokens2]
+    vocab, flat = np.unique(np.array([t for side in tokenized for s in side for t in s] or [u''],
+                                     dtype=object).astype(six.text_type),
+                            return_inverse=True)
+    counts = [np.array([len(s) for s in side], dtype=int) for side in tokenized]
+    offsets = [np.r_[0, np.cumsum(counts[0])[:-1]],
+               np.r_[0, np.cumsum(counts[1])[:-1]] + counts[0].sum()]
+
+    n1, n2 = counts[0][i], counts[1][j]
+    o1, o2 = offsets[0][i], offsets[1][j]
+    # tokens of the shorter string (s) are matched in the longer one (l)
+    swap = n1 > n2
+    ns, nl = np.where(swap, n2, n1), np.where(swap, n1, n2)
+    os_, ol = np.where(swap, o2, o1), np.where(swap, o1, o2)
+
+    result = np.zeros(len(i))
+    valid = np.flatnonzero((ns > 0) & (nl > 0))
+    vcodes, vlen = encode_strings(vocab)
+    for start in range(0, len(valid), chunksize):
+        pairs = valid[start:start + chunksize]
+        sizes = ns[pairs] * nl[pairs]
+        rep = np.repeat(np.arange(len(pairs)), sizes)
+        k = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        tok_s = flat[os_[pairs][rep] + k // nl[pairs][rep]]
+        tok_l = flat[ol[pairs][rep] + k % nl[pairs][rep]]
+
+        keys, inverse = np.unique(tok_s.astype(np.int64) * len(vocab) + tok_l,
+                                  return_inverse=True)
+        a, b = keys // len(vocab), keys % len(vocab)
+        sim = jaro_winkler_batch(vcodes[a], vlen[a], vcodes[b], vlen[b])[inverse]
+
+        # best match of every token of the shorter string, then the mean
+        best = np.maximum.reduceat(
+            sim, np.r_[0, np.cumsum(np.repeat(nl[pairs], ns[pairs]))[:-1]])
+        total = np.add.reduceat(best, np.r_[0, np.cumsum(ns[pairs])[:-1]])
+        result[pairs] = (total / ns[pairs] -
+                         (nl[pairs] - ns[pairs]) / nl[pairs].astype(float))
+
+    equal = strings1[i] == strings2[j]
+    return np.where(equal, 1.0, result)
+
+
+def qgram_batch(strings1, strings2, i, j, q=2):
+    """
+    Vectorized version of qgram() for the pairs of strings
+    (strings1[i], strings2[j]) based on sparse q-gram incidence matrices.
+    """
+    from scipy.sparse import csr_matrix
+    strings1 = np.asarray(strings1, dtype=object)
+    strings2 = np.asarray(strings2, dtype=object)
+    i, j = np.asarray(i, dtype=int), np.asarray(j, dtype=int)
+
+    grams = [[qgrams(s, q) for s in strings] for strings in (strings1, strings2)]
+    vocab = {}
+    matrices = []
+    for side in grams:
+        indices = [vocab.setdefault(g, len(vocab)) for s in side for g in s]
+        indptr = np.r_[0, np.cumsum([len(s) for s in side])]
+        matrices.append((indices, indptr))
+    matrices = [csr_matrix((np.ones(len(ind)), ind, ptr),
+                           shape=(len(ptr) - 1, max(len(vocab), 1)))
+                for ind, ptr in matrices]
+
+    sizes1 = np.diff(matrices[0].indptr)[i]
+    sizes2 = np.diff(matrices[1].indptr)[j]
+    common = np.asarray(matrices[0][i].multiply(matrices[1][j]).sum(axis=1)).ravel()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sim = common / np.minimum(sizes1, sizes2)
+    sim = np.where((sizes1 == 0) | (sizes2 == 0), 0., sim)
+    return np.where(strings1[i] == strings2[j], 1.0, sim)
+
+
+def numeric_batch(values1, values2, i, j, min_ratio=0.):
+    """
+    numeric() for the pairs of values (values1[i], values2[j]).
+    """
+    return numeric(np.asarray(values1, dtype=float)[i],
+                   np.asarray(values2, dtype=float)[j], min_ratio)
+
+
+batch_comparators = {
+    'no.priv.garshol.duke.comparators.JaroWinklerTokenized': jaro_winkler_tokenized_batch,
+    'no.priv.garshol.duke.comparators.QGramComparator': qgram_batch,
+}
+
+string_comparators = {
+    'no.priv.garshol.duke.comparators.JaroWinklerTokenized': jaro_winkler_tokenized,
+    'no.priv.garshol.duke.comparators.JaroWinkler': jaro_winkler,
+    'no.priv.garshol.duke.comparators.QGramComparator': qgram,
+    'no.priv.garshol.duke.comparators.ExactComparator': lambda s1, s2: float(s1 == s2),
+}
+
+cleaners = {
+    'no.priv.garshol.duke.cleaners.LowerCaseNormalizeCleaner': lowercase_normalize,
+}
@@ -52,18 +52,30 @@ def target_technologies():
             'PV', 'CSP'] # Solar types
 
 
-def target_columns(detailed_columns=True):
+def identifier_columns():
+    """
+    Returns a list of columns holding identifiers which are shared by
+    several datasets, e.g. the EIC codes of the ENTSOE units which OPSD
+    refers to. They are used for matching by identifiers, see
+    matching.exact_matches.
+    """
+    return ['EIC']
+
+
+def target_columns(detailed_columns=True, identifiers=False):
     """
     Returns a list of columns to which the powerplants should be standardized. For renaming
     columns use df.rename(columns=dic, inplace=True) with dic being a dictionary
-    of the replacements
+    of the replacements. With identifiers=True, the identifier_columns are
+    appended.
     """
     if detailed_columns:
-        return ['Name', 'Fueltype', 'Technology', 'Set', 'Country', 'Capacity',
-                'Duration', 'YearCommissioned', 'lat', 'lon', 'File', 'projectID']
+        columns = ['Name', 'Fueltype', 'Technology', 'Set', 'Country', 'Capacity',
+                   'Duration', 'YearCommissioned', 'lat', 'lon', 'File', 'projectID']
     else:
-        return ['Name', 'Fueltype', 'Technology', 'Set', 'Country', 'Capacity',
-                'YearCommissioned', 'lat', 'lon', 'File', 'projectID']
+        columns = ['Name', 'Fueltype', 'Technology', 'Set', 'Country', 'Capacity',
+                   'YearCommissioned', 'lat', 'lon', 'File', 'projectID']
+    return columns + identifier_columns() if identifiers else columns
 
 
 def fueltype_to_life():
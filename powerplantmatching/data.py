@@ -34,8 +34,8 @@ from six import iteritems
 from six.moves import reduce
 from .config import europeancountries, target_columns, additional_data_config
 from .cleaning import (gather_fueltype_info, gather_set_info,
-                       gather_technology_info, clean_powerplantname,
-                       clean_technology)
+                       gather_technology_info, gather_text_info,
+                       clean_powerplantname, clean_technology)
 from .utils import (parse_Geoposition, _data, _data_in, _data_out)
 from .heuristics import scale_to_net_capacities
 
@@ -75,10 +75,11 @@ def OPSD(rawEU=False, rawDE=False, statusDE=['operating']):
                             'Lon':'lon',
                             'Energy_Source':'Fueltype',
                             'Commissioned':'YearCommissioned',
-                            'Source':'File'},
+                            'Source':'File',
+                            'Eic_Code':'EIC'},
                    inplace=True)
     opsd_EU.loc[:,'projectID'] = 'OEU' + opsd_EU.index.astype(str)
-    opsd_EU = opsd_EU.reindex(columns=target_columns())
+    opsd_EU = opsd_EU.reindex(columns=target_columns(identifiers=True))
     opsd_DE.columns = opsd_DE.columns.str.title()
     # If BNetzA-Name is empty replace by company, if this is empty by city.
     opsd_DE.Name_Bnetza.fillna(opsd_DE.Company, inplace=True)
@@ -95,9 +96,12 @@ def OPSD(rawEU=False, rawDE=False, statusDE=['operating']):
                    inplace=True)
     opsd_DE['Fueltype'].fillna(opsd_DE['Energy_Source_Level_1'], inplace=True)
     opsd_DE['projectID'] = opsd_DE['Id']
+    # EIC codes of the blocks, which ENTSOE lists as production units
+    opsd_DE['EIC'] = (opsd_DE.reindex(columns=['Eic_Code_Block', 'Eic_Code_Plant'])
+                      .bfill(axis=1).iloc[:, 0])
     if statusDE is not None:
         opsd_DE = opsd_DE.loc[opsd_DE.Status.isin(statusDE)]
-    opsd_DE = opsd_DE.reindex(columns=target_columns())
+    opsd_DE = opsd_DE.reindex(columns=target_columns(identifiers=True))
     return (pd.concat([opsd_EU, opsd_DE]).reset_index(drop=True)
             .replace(dict(Fueltype={'Biomass and biogas': 'Bioenergy',
                                     'Fossil fuels': np.nan, # *NEVER EVER* set this to 'Other'!
@@ -115,8 +119,7 @@ def OPSD(rawEU=False, rawDE=False, statusDE=['operating']):
                     Country=lambda df: (pd.Series(df.Country.apply(
                                         lambda c: pycountry.countries.get(alpha_2=c).name),
                                         index=df.index).str.title()))
-            .pipe(gather_technology_info) 
-            .pipe(gather_set_info)
+            .pipe(gather_text_info)
             .pipe(clean_technology)
             .loc[lambda df: df.Country.isin(europeancountries())]
             .pipe(scale_to_net_capacities,
@@ -167,9 +170,8 @@ def GEO(raw=False):
             .loc[lambda df: df.Country.isin(europeancountries())]
             .replace({col: {'Gas': 'Natural Gas'}
                       for col in {'Fueltype', 'FuelClassification1', 'FuelClassification2'}})
-            .pipe(gather_fueltype_info, search_col=['FuelClassification1'])
-            .pipe(gather_technology_info, search_col=['FuelClassification1'])
-            .pipe(gather_set_info)
+            .pipe(gather_text_info, fueltype_col=['FuelClassification1'],
+                  technology_col=['FuelClassification1'])
             .pipe(clean_powerplantname)
             .pipe(clean_technology, generalize_hydros=True)
             .reindex(columns=target_columns())
@@ -217,8 +219,7 @@ def CARMA(raw=False):
                                     'BSOL': 'Bioenergy',
                                     'OTH': 'Other'}))
             .pipe(clean_powerplantname)
-            .pipe(gather_technology_info)
-            .pipe(gather_set_info)
+            .pipe(gather_text_info)
             .pipe(clean_technology)
             .drop_duplicates()
             .reindex(columns=target_columns())
@@ -314,7 +315,7 @@ def WRI(reduced_data=True):
         #wri data consists of ENTSOE data and OPSD, drop those:
         wri = wri.loc[~wri.File.str.contains('ENTSOE', case=False)]
         wri = wri.loc[~wri.Country.isin(['Germany','Poland', 'France', 'Switzerland'])]
-    return wri.reindex(columns=target_columns())
+    return wri.reindex(columns=target_columns(identifiers=True))
 
 data_config['WRI'] = {'read_function': WRI,
                       'clean_single_kwargs': dict(aggregate_powerplant_units=False),
@@ -528,8 +529,9 @@ def ENTSOE(update=False, raw=False, entsoe_token=None):
         entsoe = entsoe.drop_duplicates('projectID').reset_index(drop=True)
         entsoe['File'] = "https://transparency.entsoe.eu/generation/r2/\ninstalledCapacityPerProductionUnit/show"
         entsoe = entsoe.reindex(columns=target_columns())
-        entsoe = gather_technology_info(entsoe)
-        entsoe = gather_set_info(entsoe)
+        # the projectIDs are the EIC codes of the units
+        entsoe['EIC'] = entsoe['projectID']
+        entsoe = gather_text_info(entsoe)
         entsoe = clean_technology(entsoe)
         entsoe.Fueltype.replace(to_replace=['.*Hydro.*','Fossil Gas', '.*(?i)coal.*','.*Peat',
                                             'Marine', 'Wind.*', '.*Oil.*', 'Biomass'],
@@ -554,6 +556,7 @@ def ENTSOE(update=False, raw=False, entsoe_token=None):
         entsoe = pd.read_csv(_data_in('entsoe_powerplants.csv'),
                              index_col='id', encoding='utf-8')
         return (entsoe[entsoe.Country.isin(europeancountries())]
+                    .assign(EIC=lambda df: df['projectID'])
                     .pipe(scale_to_net_capacities,(not data_config['ENTSOE']['net_capacity'])))
 
 data_config['ENTSOE'] = {'read_function': ENTSOE,
@@ -21,12 +21,25 @@ logger = logging.getLogger(__name__)
 
 import os
 from os.path import dirname
+import functools
 import subprocess as sub
 import shutil
 import tempfile
+import threading
+from collections import Counter
+from multiprocessing.pool import ThreadPool
+import xml.etree.ElementTree as ET
+import six
 import pandas as pd
 import numpy as np
 
+from .utils import _data
+from .comparators import (string_comparators, batch_comparators, cleaners,
+                          numeric, geoposition)
+from .blocking import (block_labels, blocks, blocking_statistics,
+                       candidate_blocks, candidate_positions,
+                       generate_candidates, sorted_neighbourhood_candidates)
+
 def add_geoposition_for_duke(df):
     """
     Returns the same pandas.Dataframe with an additional column "Geoposition" which
@@ -41,8 +54,577 @@ def add_geoposition_for_duke(df):
         df.loc[:, 'Geoposition'] = np.NaN
         return df
 
+def read_duke_config(config):
+    """
+    Parse a Duke configuration file into its threshold, the name of the
+    id property and a list of property specifications (name,
+    comparator, low, high, column, cleaner and comparator parameters).
+
+    Parameters
+    ----------
+    config : str
+        path to the xml configuration file
+    """
+    root = ET.parse(config).getroot()
+    objects = {o.get('name'): (o.get('class'),
+                               {p.get('name'): p.get('value') for p in o.findall('param')})
+               for o in root.findall('object')}
+    columns = {c.get('property'): (c.get('name'), c.get('cleaner'))
+               for c in root.iter('column')}
+    schema = root.find('schema')
+
+    properties = []
+    for prop in schema.findall('property'):
+        if prop.get('type') == 'id':
+            id_property = prop.findtext('name').strip()
+            continue
+        name = prop.findtext('name').strip()
+        comparator = prop.findtext('comparator').strip()
+        comparator, params = objects.get(comparator, (comparator, {}))
+        column, cleaner = columns[name]
+        properties.append(dict(name=name, comparator=comparator, params=params,
+                               low=float(prop.findtext('low')),
+                               high=float(prop.findtext('high')),
+                               column=column, cleaner=cleaner))
+    return dict(threshold=float(schema.findtext('threshold')),
+                id=id_property, properties=properties)
+
+
+def _prepare_property(prop, datasets, features=None):
+    """
+    Extract the values of one Duke property from all datasets in a
+    form which can be compared pairwise by index arrays. Normalized
+    names and their tokens are taken from the precomputed `features` if
+    given.
+    """
+    comparator = prop['comparator']
+    if comparator.endswith('GeopositionComparator'):
+        return [df.reindex(columns=['lat', 'lon']).astype(float).values
+                for df in datasets]
+    if comparator.endswith('NumericComparator'):
+        return [pd.to_numeric(df.reindex(columns=[prop['column']]).iloc[:, 0],
+                              errors='coerce').values
+                for df in datasets]
+    if comparator not in string_comparators:
+        raise NotImplementedError("Comparator {} is not supported by the native "
+                                  "backend".format(comparator))
+
+    if (features is not None and prop['column'] == 'Name' and
+        prop['cleaner'] == 'no.priv.garshol.duke.cleaners.LowerCaseNormalizeCleaner'):
+        values = pd.concat([f['cleaned'] for f in features], ignore_index=True)
+        tokens = pd.concat([f['tokens'] for f in features], ignore_index=True)
+    else:
+        tokens = None
+        clean = cleaners.get(prop['cleaner'], lambda s: six.text_type(s).strip())
+        values = pd.concat([df.reindex(columns=[prop['column']]).iloc[:, 0]
+                            for df in datasets], ignore_index=True)
+        values = values[values.notnull()].map(six.text_type).map(clean)
+    values = values[values != '']
+    codes, uniques = pd.factorize(values)
+    if tokens is not None:
+        # tokens of the first occurrence of every unique name
+        tokens = tokens[values.index[np.unique(codes, return_index=True)[1]]].values
+    codes = (pd.Series(codes, index=values.index)
+             .reindex(range(sum(map(len, datasets))), fill_value=-1).values)
+    splits = np.cumsum([len(df) for df in datasets])[:-1]
+    return np.split(codes, splits), np.asarray(uniques, dtype=object), tokens
+
+
+def _similarity(prop, prepared, i, j):
+    """
+    Similarities of one property for the record pairs (i, j), NaN where
+    one of both values is missing.
+    """
+    comparator = prop['comparator']
+    if comparator.endswith('GeopositionComparator'):
+        a, b = prepared[0][i], prepared[-1][j]
+        sim = geoposition(a[:, 0], a[:, 1], b[:, 0], b[:, 1],
+                          float(prop['params'].get('max-distance', 5000.)))
+        return np.where(np.isnan(a).any(axis=1) | np.isnan(b).any(axis=1),
+                        np.nan, sim)
+    if comparator.endswith('NumericComparator'):
+        a, b = prepared[0][i], prepared[-1][j]
+        return np.where(np.isnan(a) | np.isnan(b), np.nan,
+                        numeric(a, b, float(prop['params'].get('min-ratio', 0.))))
+
+    codes, uniques, tokens = prepared
+    c1, c2 = codes[0][i], codes[-1][j]
+    valid = (c1 >= 0) & (c2 >= 0)
+    sim = np.full(len(i), np.nan)
+    if valid.any():
+        # evaluate the comparator only once per distinct pair of values
+        keys = c1[valid].astype(np.int64) * len(uniques) + c2[valid]
+        ukeys, inverse = np.unique(keys, return_inverse=True)
+        a, b = ukeys // len(uniques), ukeys % len(uniques)
+        if comparator in batch_comparators:
+            kwargs = {}
+            if tokens is not None and comparator.endswith('JaroWinklerTokenized'):
+                kwargs = dict(tokens1=tokens, tokens2=tokens)
+            usim = batch_comparators[comparator](uniques, uniques, a, b, **kwargs)
+        else:
+            func = string_comparators[comparator]
+            usim = np.array([func(uniques[k], uniques[l]) for k, l in zip(a, b)],
+                            dtype=float)
+        sim[valid] = usim[inverse]
+    return sim
+
+
+def _probability(sim, low, high):
+    """
+    Duke's translation of a similarity into a match probability.
+    """
+    return np.where(sim < 0.5, low, (high - 0.5) * sim ** 2 + 0.5)
+
+
+def _bayes(prob, p):
+    """
+    Combine the probabilities `prob` and `p` (NaN is neutral).
+    """
+    combined = prob * p / (prob * p + (1. - prob) * (1. - p))
+    return np.where(np.isnan(p), prob, combined)
+
+
+def _combine(props, sims):
+    """
+    Combined match probability of the similarities `sims` of the
+    properties `props`.
+    """
+    prob = np.full(len(sims[0]) if sims else 0, 0.5)
+    for prop, sim in zip(props, sims):
+        prob = _bayes(prob, _probability(sim, prop['low'], prop['high']))
+    return prob
+
+
+# rough relative costs of evaluating the comparators for one pair, the
+# native backend evaluates the properties in this order
+comparator_costs = {'GeopositionComparator': 1, 'NumericComparator': 1,
+                    'ExactComparator': 1, 'QGramComparator': 2,
+                    'JaroWinkler': 5, 'JaroWinklerTokenized': 10}
+
+# number of pairs for which the native backend evaluated each property,
+# accumulated over all runs (call comparator_evaluations.clear() to reset)
+comparator_evaluations = Counter()
+_evaluations_lock = threading.Lock()
+
+
+def _cost(prop):
+    return comparator_costs.get(prop['comparator'].split('.')[-1], 5)
+
+
+def _upper_bounds(props):
+    """
+    Highest probability which the properties props[k:] can contribute
+    together, for every k.
+    """
+    bounds = [np.array([0.5])]
+    for prop in reversed(props):
+        best = max(prop['low'], prop['high'], 0.5)
+        bounds.insert(0, _bayes(bounds[0], np.array([best])))
+    return [b[0] for b in bounds]
+
+
+def _score_pruned(props, prepared, i, j, threshold, counts):
+    """
+    Evaluates the properties in order and drops pairs as soon as the
+    remaining properties cannot lift their probability above the
+    threshold. Returns the positions of the matching pairs within (i, j)
+    and their probabilities.
+    """
+    bounds = _upper_bounds(props)
+    active = np.arange(len(i))
+    prob = np.full(len(i), 0.5)
+    for k, (prop, prep) in enumerate(zip(props, prepared)):
+        sim = _similarity(prop, prep, i[active], j[active])
+        counts[prop['name']] += len(active)
+        prob[active] = _bayes(prob[active], _probability(sim, prop['low'], prop['high']))
+        upper = _bayes(prob[active], np.full(len(active), bounds[k + 1]))
+        active = active[upper > threshold]
+    return active, prob[active]
+
+
+def _pair_chunks(n1, n2, dedup, chunksize=2**20):
+    """
+    Generate all positional pairs between two datasets (or the upper
+    triangle within one dataset) in chunks of about `chunksize`.
+    """
+    rows = max(1, chunksize // max(n2, 1))
+    for start in range(0, n1, rows):
+        stop = min(start + rows, n1)
+        i = np.repeat(np.arange(start, stop), n2)
+        j = np.tile(np.arange(n2), stop - start)
+        if dedup:
+            i, j = i[j > i], j[j > i]
+        yield i, j
+
+
+def _candidate_chunks(i, j, dedup, chunksize=2**20):
+    """
+    Split given candidate pairs into chunks of `chunksize`.
+    """
+    if dedup:
+        i, j = np.minimum(i, j), np.maximum(i, j)
+        i, j = i[i != j], j[i != j]
+    for start in range(0, len(i), chunksize):
+        yield i[start:start + chunksize], j[start:start + chunksize]
+
+
+def _duke_native(datasets, labels, config, dedup, singlematch, candidates=None,
+                 return_scores=False, features=None):
+    """
+    In-process reproduction of a Duke run on pandas.DataFrames, returns
+    the links in the same shape as the java backend. If `candidates`
+    are given, only these pairs are scored. With `return_scores` all
+    scored pairs are returned together with the similarities of each
+    property.
+    """
+    conf = read_duke_config(_data(config))
+    # cheap comparators first, such that the expensive ones can be skipped
+    # for pairs which cannot match anymore
+    props = sorted(conf['properties'], key=_cost)
+    prepared = [_prepare_property(prop, datasets, features) for prop in props]
+    counts = Counter()
+
+    if candidates is None:
+        chunks = _pair_chunks(len(datasets[0]), len(datasets[-1]), dedup)
+    else:
+        chunks = _candidate_chunks(*candidate_positions(datasets, candidates),
+                                   dedup=dedup)
+
+    found_i, found_j, found_s = [np.array([], dtype=int)], [np.array([], dtype=int)], [np.array([])]
+    found_sims = [[np.array([])] for prop in props]
+    for i, j in chunks:
+        if return_scores:
+            sims = [_similarity(prop, prep, i, j) for prop, prep in zip(props, prepared)]
+            for prop, found, sim in zip(props, found_sims, sims):
+                found.append(sim)
+                counts[prop['name']] += len(i)
+            match, prob = slice(None), _combine(props, sims)
+        else:
+            match, prob = _score_pruned(props, prepared, i, j, conf['threshold'], counts)
+        found_i.append(i[match])
+        found_j.append(j[match])
+        found_s.append(prob)
+    i, j, scores = (np.concatenate(found_i), np.concatenate(found_j),
+                    np.concatenate(found_s))
+
+    logger.info("Evaluated properties for {}".format(
+        ', '.join('{} pairs ({})'.format(counts[p['name']], p['name']) for p in props)))
+    with _evaluations_lock:
+        comparator_evaluations.update(counts)
+
+    if return_scores:
+        links = pd.DataFrame({labels[0]: datasets[0].index.values[i],
+                              labels[1]: datasets[-1].index.values[j]},
+                             columns=labels[:2])
+        for prop in conf['properties']:
+            links[prop['name']] = np.concatenate(found_sims[props.index(prop)])
+        return links.assign(scores=scores)
+
+    if singlematch and not dedup and len(i):
+        order = np.lexsort((-scores, i))
+        first = np.r_[True, i[order][1:] != i[order][:-1]]
+        keep = np.sort(order[first])
+        i, j, scores = i[keep], j[keep], scores[keep]
+    if dedup:
+        # duke reports the duplicates in both directions
+        i, j = np.concatenate([i, j]), np.concatenate([j, i])
+    return _links_frame(datasets, labels, i, j, scores, dedup)
+
+
+def property_probabilities(scores, config='Comparison.xml', properties={}):
+    """
+    Returns the contribution of every property to the match probability
+    of the scored pairs as returned by duke(return_scores=True). NaN
+    marks properties which were not compared due to missing values.
+
+    Parameters
+    ----------
+    scores : pd.DataFrame
+        scored pairs with one similarity column per property
+    config : str, default 'Comparison.xml'
+        Duke configuration file in the data directory
+    properties : dict
+        Updates for the low and high values of properties, e.g.
+        {'NAME': {'low': 0.1, 'high': 0.95}}
+    """
+    conf = read_duke_config(_data(config))
+    props = [dict(p, **properties.get(p['name'], {})) for p in conf['properties']]
+    return pd.DataFrame({p['name']: np.where(np.isnan(scores[p['name']].values), np.nan,
+                                             _probability(scores[p['name']].values,
+                                                          p['low'], p['high']))
+                         for p in props},
+                        index=scores.index, columns=[p['name'] for p in props])
+
+
+def rescore(scores, config='Comparison.xml', threshold=None, properties={}):
+    """
+    Recompute the combined match probability of scored pairs as returned
+    by duke(return_scores=True) and return the pairs exceeding the
+    threshold. Allows to tune the threshold and the low/high values of
+    the Duke configuration without comparing the records again.
+
+    Parameters
+    ----------
+    scores : pd.DataFrame
+        scored pairs with one similarity column per property
+    config : str, default 'Comparison.xml'
+        Duke configuration file in the data directory
+    threshold : float, default None
+        Threshold for the combined probability, defaults to the one of
+        the configuration
+    properties : dict
+        Updates for the low and high values of properties, e.g.
+        {'NAME': {'low': 0.1, 'high': 0.95}}
+    """
+    conf = read_duke_config(_data(config))
+    props = [dict(p, **properties.get(p['name'], {})) for p in conf['properties']]
+    if threshold is None:
+        threshold = conf['threshold']
+    prob = _combine(props, [scores[p['name']].values for p in props])
+    return scores.assign(scores=prob).loc[lambda df: df.scores > threshold]
+
+
+def score_matrix(scores, datasets, column='scores'):
+    """
+    Returns the scored pairs as a sparse matrix with the records of the
+    first dataset as rows and those of the second as columns.
+
+    Parameters
+    ----------
+    scores : pd.DataFrame
+        scored pairs as returned by duke(return_scores=True)
+    datasets : pd.DataFrame or [pd.DataFrame]
+        the dataset(s) which were passed to duke
+    column : str, default 'scores'
+        column holding the values of the matrix, e.g. the combined
+        probability or the similarity of a single property
+    """
+    from scipy.sparse import coo_matrix
+    if isinstance(datasets, pd.DataFrame):
+        datasets = [datasets]
+    i, j = candidate_positions(datasets, scores)
+    return coo_matrix((scores[column].values, (i, j)),
+                      shape=(len(datasets[0]), len(datasets[-1]))).tocsr()
+
+
+def _links_frame(datasets, labels, i, j, scores, dedup):
+    """
+    Translate positional links into the link dataframe returned by duke().
+    """
+    if dedup:
+        return pd.DataFrame({labels[0]: datasets[0].index.values[i],
+                             labels[1]: datasets[0].index.values[j]},
+                            columns=labels)
+    return pd.DataFrame({labels[0]: datasets[0].index.values[i],
+                         labels[1]: datasets[1].index.values[j],
+                         'scores': scores},
+                        columns=labels + ['scores'])
+
+
+_jvm_configurations = {}
+_jvm_lock = threading.Lock()
+
+def _jvm_configuration(config):
+    """
+    Start the embedded java virtual machine (only once per python
+    session) and return the loaded Duke configuration.
+    """
+    import jpype
+    with _jvm_lock:
+        if not jpype.isJVMStarted():
+            duke_bin_dir = os.path.join(dirname(os.path.realpath(__file__)), '..', 'duke_binaries')
+            classpath = os.pathsep.join([os.path.join(duke_bin_dir, r)
+                                         for r in os.listdir(duke_bin_dir)])
+            jpype.startJVM(jpype.getDefaultJVMPath(), '-Dfile.encoding=UTF-8',
+                           '-Djava.class.path={}'.format(classpath))
+        if config not in _jvm_configurations:
+            ConfigLoader = jpype.JClass('no.priv.garshol.duke.ConfigLoader')
+            _jvm_configurations[config] = ConfigLoader.load(_data(config))
+        return _jvm_configurations[config]
+
+
+class _LinkCollector(object):
+    """
+    Duke MatchListener (implemented through a JPype proxy) which collects
+    the ids of the matched records and their confidence in python lists.
+    """
+    def __init__(self, id_property):
+        self.id_property = id_property
+        self.i, self.j, self.scores = [], [], []
+
+    def matches(self, r1, r2, confidence):
+        self.i.append(int(str(r1.getValue(self.id_property))))
+        self.j.append(int(str(r2.getValue(self.id_property))))
+        self.scores.append(float(confidence))
+
+    def matchesPerhaps(self, r1, r2, confidence):
+        pass
+
+    def noMatchFor(self, record):
+        pass
+
+    def batchReady(self, size):
+        pass
+
+    def batchDone(self):
+        pass
+
+    def startProcessing(self):
+        pass
+
+    def endProcessing(self):
+        pass
+
+
+def _jvm_sources(templates, df, offset):
+    """
+    Returns a java list with a Duke CSVDataSource which has the columns
+    (and cleaners) of the first data source in `templates` and reads the
+    records of `df` from a single in-memory csv string. The ids are the
+    positions of the records shifted by `offset`.
+    """
+    import jpype
+    template = list(templates)[0]
+    columns = [six.text_type(c.getName()) for c in template.getColumns()]
+    df = add_geoposition_for_duke(df.copy())
+    df.index = offset + np.arange(len(df))
+    text = df.reindex(columns=[c for c in columns if c != 'id']).to_csv(index_label='id')
+
+    source = jpype.JClass('no.priv.garshol.duke.datasources.CSVDataSource')()
+    for column in template.getColumns():
+        source.addColumn(column)
+    source.setReader(jpype.JClass('java.io.StringReader')(text))
+    sources = jpype.JClass('java.util.ArrayList')()
+    sources.add(source)
+    return sources
+
+
+def _duke_jvm(datasets, labels, config, dedup, singlematch, batch_size=40000):
+    """
+    Run Duke inside a java virtual machine embedded via JPype. Every
+    dataset is handed over as one csv string which Duke reads and cleans
+    as configured, the links are collected by a python match listener,
+    such that neither csv nor link files are written and no call crosses
+    the bridge per record.
+    """
+    import jpype
+    configuration = _jvm_configuration(config)
+    database = jpype.JClass('no.priv.garshol.duke.databases.InMemoryDatabase')()
+    database.setConfiguration(configuration)
+    processor = jpype.JClass('no.priv.garshol.duke.Processor')(configuration, database)
+
+    collector = _LinkCollector(configuration.getIdentityProperties().get(0).getName())
+    processor.addMatchListener(
+        jpype.JProxy('no.priv.garshol.duke.MatchListener', inst=collector))
+    try:
+        if dedup:
+            processor.deduplicate(
+                _jvm_sources(configuration.getDataSources(), datasets[0], 0),
+                batch_size)
+        else:
+            # as the command line tool, index the second dataset (group
+            # 1) and look up the records of the first one (group 2)
+            processor.link(
+                _jvm_sources(configuration.getDataSources(1), datasets[1],
+                             len(datasets[0])),
+                _jvm_sources(configuration.getDataSources(2), datasets[0], 0),
+                not singlematch, batch_size)
+    finally:
+        processor.close()
+
+    i = np.array(collector.i, dtype=int)
+    j = np.array(collector.j, dtype=int)
+    scores = np.array(collector.scores, dtype=float)
+    if not dedup:
+        # the first id refers to the first dataset, dedup links are kept in
+        # the direction reported by duke (usually both directions)
+        swap = i >= len(datasets[0])
+        i, j = np.where(swap, j, i), np.where(swap, i, j) - len(datasets[0])
+    return _links_frame(datasets, labels, i, j, scores, dedup)
+
+
+def _duke_blocked(datasets, labels, dedup, singlematch, block_ids,
+                  n_jobs, **dukeargs):
+    """
+    Run duke on every block of records given by `block_ids` separately,
+    in `n_jobs` concurrent threads.
+    """
+    stats = blocking_statistics(block_ids, labels)
+    logger.info("Blocking yields {} blocks which remove {:.1%} of the "
+                "cross product".format(len(stats), 1. - stats.share.sum()))
+    logger.debug("Blocking statistics:\n{}".format(stats))
+
+    def link_block(block):
+        label, positions = block
+        dfs = [df.iloc[p] for df, p in zip(datasets, positions)]
+        kwargs = dict(dukeargs)
+        if kwargs.get('features') is not None:
+            features = ([kwargs['features']] if dedup else kwargs['features'])
+            features = [f.iloc[p] for f, p in zip(features, positions)]
+            kwargs['features'] = features[0] if dedup else features
+        return duke(dfs[0] if dedup else dfs, labels=labels,
+                    singlematch=singlematch, **kwargs)
+
+    pool = ThreadPool(n_jobs)
+    try:
+        links = pool.map(link_block, list(blocks(block_ids)))
+    finally:
+        pool.close()
+
+    if not links:
+        empty = np.array([], dtype=int)
+        return _links_frame(datasets, labels, empty, empty, np.array([]), dedup)
+
+    # records without block label take part in several blocks
+    links = (pd.concat(links, ignore_index=True)
+             .drop_duplicates(subset=labels).reset_index(drop=True))
+    if singlematch and not dedup and not dukeargs.get('return_scores'):
+        links = (links.iloc[np.lexsort((-links.scores.values,
+                                        pd.factorize(links[labels[0]])[0]))]
+                 .drop_duplicates(subset=labels[0]).sort_index())
+    return links
+
+
+def _duke_candidates(datasets, labels, dedup, singlematch, candidates,
+                     n_jobs, **dukeargs):
+    """
+    Run duke on the connected components of the candidate graph and
+    keep only the links between candidate pairs.
+    """
+    block_ids = candidate_blocks(datasets, candidates)
+    # the best match might be outside of the candidates, therefore
+    # singlematch is applied after filtering
+    links = _duke_blocked(datasets, labels, dedup, False, block_ids, n_jobs,
+                          **dukeargs)
+    candidates = candidates.copy()
+    candidates.columns = labels
+    if dedup:
+        candidates = pd.concat([candidates, candidates.rename(
+                        columns={labels[0]: labels[1], labels[1]: labels[0]})])
+    links = links.merge(candidates, on=labels, how='inner')
+    if singlematch and not dedup:
+        links = (links.iloc[np.lexsort((-links.scores.values,
+                                        pd.factorize(links[labels[0]])[0]))]
+                 .drop_duplicates(subset=labels[0]).sort_index())
+    return links.reset_index(drop=True)
+
+
+def _chained_candidates(candidates):
+    """
+    Whether `candidates` refers to the sorted-neighbourhood generator,
+    whose pairs do not decompose into blocks, see candidate_blocks().
+    """
+    if isinstance(candidates, functools.partial):
+        candidates = candidates.func
+    if isinstance(candidates, six.string_types):
+        return candidates == 'sorted_neighbourhood'
+    return candidates is sorted_neighbourhood_candidates
+
+
 def duke(datasets, labels=['one', 'two'], singlematch=False,
-         showmatches=False, keepfiles=False, showoutput=False):
+         showmatches=False, keepfiles=False, showoutput=False,
+         backend='java', blocking=None, capacity_bands=None, candidates=None,
+         n_jobs=1, return_scores=False, features=None):
     """
     Run duke in different modes (Deduplication or Record Linkage Mode) to either
     locate duplicates in one database or find the similar entries in two different datasets.
@@ -61,6 +643,52 @@ def duke(datasets, labels=['one', 'two'], singlematch=False,
         dataset. This does not guarantee a unique match in the second named dataset.
     keepfiles : boolean, default False
         If true, do not delete temporary files
+    backend : str, default 'java'
+        'java' runs the Duke binaries in a separate process, 'native'
+        scores the records in-process with numpy following the same
+        configuration (supported comparators are JaroWinklerTokenized,
+        QGram, Numeric and Geoposition), 'jvm' runs Duke in a java
+        virtual machine embedded in the python process (requires
+        JPype), which is started only once per session
+    blocking : list of strings, default None
+        Columns as e.g. ['Country', 'Fueltype'] which have to agree for
+        two records in order to be compared. Each block of records is
+        linked independently, records with missing values take part in
+        all blocks.
+    capacity_bands : float, default None
+        Only if blocking is given. Additionally block by bands of the
+        logarithmic capacity with a width of `capacity_bands` decades.
+    candidates : pd.DataFrame, str or function, default None
+        Pairs of index labels of the records which should be compared,
+        as e.g. obtained from blocking.spatial_candidates(), or the name
+        of a candidate generator ('spatial', 'qgram' or
+        'sorted_neighbourhood') or a function generating them, see
+        blocking.generate_candidates(). The native
+        backend scores only these pairs, the other backends link the
+        connected components of the candidate pairs separately, see
+        blocking.candidate_blocks(). Records paired with all others (as
+        those without coordinates for 'spatial') take part in every
+        component. Candidates which form one large component raise a
+        ValueError for these backends, since they would not save any
+        comparison. This holds for the chained pairs of
+        'sorted_neighbourhood', which is therefore only supported by the
+        native backend.
+    n_jobs : int, default 1
+        Only if blocking or candidates are given. Number of blocks to
+        link concurrently.
+    return_scores : boolean, default False
+        Only for the native backend. Return all compared pairs regardless
+        of the threshold, with the similarity of every property and the
+        combined probability in the column 'scores'. Use rescore() or
+        best_matches(threshold=...) to apply a threshold afterwards.
+        Should be combined with candidates or blocking, since the
+        result holds all compared pairs.
+    features : pd.DataFrame or [pd.DataFrame], default None
+        Precomputed name features of the dataset(s) as returned by
+        features.name_features(), which are then used instead of
+        normalizing and tokenizing the names again by the native backend
+        and by the candidate generators 'qgram' and
+        'sorted_neighbourhood'.
     """
 
     dedup = isinstance(datasets, pd.DataFrame)
@@ -71,9 +699,50 @@ def duke(datasets, labels=['one', 'two'], singlematch=False,
     else:
         config = "Comparison.xml"
 
+    if blocking is not None and candidates is not None:
+        raise ValueError("Pass either blocking or candidates, not both")
+    if backend != 'native' and _chained_candidates(candidates):
+        raise ValueError("Sorted-neighbourhood candidates chain the records into "
+                         "a single block, which the '{}' backend would compare "
+                         "completely. Use the native backend or the 'spatial' "
+                         "or 'qgram' candidates.".format(backend))
+    if candidates is not None and not isinstance(candidates, pd.DataFrame):
+        candidates = generate_candidates(datasets, labels, candidates, features)
+
+    if blocking is not None:
+        logger.info("Blocking by {}".format(', '.join(blocking)))
+        block_ids = [block_labels(df, blocking, capacity_bands) for df in datasets]
+        return _duke_blocked(datasets, labels, dedup, singlematch, block_ids,
+                             n_jobs, showmatches=showmatches,
+                             keepfiles=keepfiles, showoutput=showoutput,
+                             backend=backend, return_scores=return_scores,
+                             features=features)
+
+    if candidates is not None and backend != 'native':
+        return _duke_candidates(datasets, labels, dedup, singlematch, candidates,
+                                n_jobs, showmatches=showmatches,
+                                keepfiles=keepfiles, showoutput=showoutput,
+                                backend=backend)
+
+    if return_scores and backend != 'native':
+        raise ValueError("return_scores is only supported by the native backend")
+
+    if backend == 'native':
+        if isinstance(features, pd.DataFrame):
+            features = [features]
+        return _duke_native(datasets, labels, config, dedup, singlematch,
+                            candidates, return_scores, features)
+    elif backend == 'jvm':
+        return _duke_jvm(datasets, labels, config, dedup, singlematch)
+    elif backend != 'java':
+        raise ValueError("backend must be one of 'java', 'native' or 'jvm'")
+
     duke_bin_dir = os.path.join(dirname(os.path.realpath(__file__)), '..', 'duke_binaries')
-    os.environ['CLASSPATH'] = os.pathsep.join([os.path.join(duke_bin_dir, r)
-                                               for r in os.listdir(duke_bin_dir)])
+    # set the classpath only for the subprocess, such that concurrent
+    # calls do not interfere via the global environment
+    env = dict(os.environ)
+    env['CLASSPATH'] = os.pathsep.join([os.path.join(duke_bin_dir, r)
+                                        for r in os.listdir(duke_bin_dir)])
     tmpdir = tempfile.mkdtemp()
 
     try:
@@ -83,14 +752,13 @@ def duke(datasets, labels=['one', 'two'], singlematch=False,
         logger.debug("Comparing files: %s", ", ".join(labels))
 
         for n, df in enumerate(datasets):
-            df = add_geoposition_for_duke(df)
+            # work on a copy, the passed dataframes must stay untouched
+            df = add_geoposition_for_duke(df.copy())
 #            due to index unity (see https://github.com/larsga/Duke/issues/236)
             if n==1:
                 shift_by = (datasets[0].index.max()+1)
-                df.index += shift_by 
+                df.index = df.index + shift_by
             df.to_csv(os.path.join(tmpdir, "file{}.csv".format(n+1)), index_label='id', encoding='utf-8')
-            if n==1:
-                df.index -= shift_by
 
         args = ['java', '-Dfile.encoding=UTF-8', 'no.priv.garshol.duke.Duke', '--linkfile=linkfile.txt']
         if singlematch:
@@ -103,7 +771,7 @@ def duke(datasets, labels=['one', 'two'], singlematch=False,
         args.append('config.xml')
 
         run = sub.Popen(args, stderr=sub.PIPE, cwd=tmpdir, stdout=stdout,
-                        universal_newlines=True)
+                        universal_newlines=True, env=env)
         _, stderr = run.communicate()
 
         if showmatches:
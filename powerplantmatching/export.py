@@ -80,7 +80,7 @@ def Export_TIMES(df=None, use_scaled_capacity=False, baseyear=2015):
 
     # add column with TIMES-specific type. The pattern is as follows:
     # 'ConELC-' + Set + '_' + Fueltype + '-' Technology
-    df.loc[:,'Technology'].fillna('', inplace=True)
+    df['Technology'] = df['Technology'].astype(object).fillna('')
     if 'TimesType' not in df:
         pos = [i for i,x in enumerate(df.columns) if x == 'Technology'][0]
         df.insert(pos+1, 'TimesType', np.nan)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+## Copyright 2015-2016 Fabian Hofmann (FIAS), Jonas Hoersch (FIAS)
+
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 3 of the
+## License, or (at your option) any later version.
+
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Precomputed name features of a dataset, which are shared by all
+comparisons the dataset takes part in
+"""
+
+from __future__ import absolute_import, print_function
+
+import os
+import pandas as pd
+import logging
+logger = logging.getLogger(__name__)
+
+from .comparators import lowercase_normalize, qgrams
+from .utils import _data_out, content_hash
+
+
+_soundex_codes = {c: str(d)
+                  for d, letters in enumerate(['aehiouwy', 'bfpv', 'cgjkqsxz',
+                                               'dt', 'l', 'mn', 'r'])
+                  for c in letters}
+
+def soundex(word):
+    """
+    American Soundex code of a lowercase word, characters other than
+    ascii letters are ignored.
+    """
+    word = [c for c in word if c in _soundex_codes]
+    if not word:
+        return ''
+    digits = []
+    prev = _soundex_codes[word[0]]
+    for c in word[1:]:
+        d = _soundex_codes[c]
+        if d != '0' and d != prev:
+            digits.append(d)
+        # vowels separate equal codes, h and w do not
+        if c not in 'hw':
+            prev = d
+    return (word[0].upper() + ''.join(digits) + '000')[:4]
+
+
+def _features(name):
+    cleaned = lowercase_normalize(name)
+    tokens = tuple(cleaned.split())
+    return (cleaned, tokens, frozenset(qgrams(cleaned, 3)),
+            ' '.join(sorted(tokens)),
+            ' '.join(soundex(t) for t in tokens))
+
+
+feature_columns = ['cleaned', 'tokens', 'trigrams', 'sorted_tokens', 'phonetic']
+
+def name_features(df, dataset_name=None, update=False):
+    """
+    Returns a dataframe with the same index as `df` holding precomputed
+    features of the column "Name": the lowercased and normalized name
+    ('cleaned') and its tokens, which the native backend of duke() uses
+    for the name comparisons, the set of its trigrams for
+    blocking.qgram_candidates() as well as the alphabetically sorted
+    tokens and the Soundex keys of the tokens for
+    blocking.sorted_neighbourhood_candidates().
+
+    Tokens and trigrams are stored as strings rather than integer ids,
+    since ids would only be comparable within one vocabulary shared by
+    all datasets. The batch comparators map the tokens of the compared
+    pairs to such a vocabulary and encode only its distinct tokens.
+
+    If a dataset name is given, the features are stored in
+    data/out/name_features_XX.pkl and reused for as long as the names
+    of the dataset do not change.
+
+    Parameters
+    ----------
+    df : pandas.Dataframe
+        dataframe with a column "Name", usually the output of clean_single
+    dataset_name : str, default None
+        name of the dataset used for storing the features
+    update : bool, default False
+        recompute the features even if stored ones are valid
+    """
+    key = (content_hash(df, ['Name']), tuple(feature_columns))
+    path_name = _data_out('name_features_{}.pkl'.format(dataset_name))
+    if dataset_name is not None and not update and os.path.exists(path_name):
+        stored = pd.read_pickle(path_name)
+        if stored['hash'] == key:
+            logger.info("Reading saved name features for dataset '{}'."
+                        .format(dataset_name))
+            return stored['features']
+
+    names = df['Name'].fillna('').astype(str)
+    uniques = names.unique()
+    features = pd.DataFrame([_features(n) for n in uniques], columns=feature_columns)
+    features = (features.iloc[pd.Index(uniques).get_indexer(names)]
+                .set_index(df.index))
+
+    if dataset_name is not None:
+        pd.to_pickle({'hash': key, 'features': features}, path_name)
+    return features
@@ -218,7 +218,7 @@ def aggregate_VRE_by_commyear(df, target_fueltypes=None, agg_geo_by=None):
         target_fueltypes = ['Wind', 'Solar', 'Bioenergy']
     df = df[df.Fueltype.isin(target_fueltypes)]
     df = average_empty_commyears(df)
-    df.Technology.fillna('-', inplace=True)
+    df['Technology'] = df.Technology.astype(object).fillna('-')
     df = df.groupby(['Country','YearCommissioned','Fueltype','Technology'])\
            .agg(f).reset_index().replace({'-': np.NaN})
     df.columns = df.columns.droplevel(level=1)
@@ -316,6 +316,8 @@ def manual_corrections(df):
     data mending, matching or reducing algorithms.
     """
     # 1. German CAES plant Huntorf
+    if hasattr(df.Technology, 'cat') and 'CAES' not in df.Technology.cat.categories:
+        df['Technology'] = df.Technology.cat.add_categories('CAES')
     df.loc[df.Name.str.contains('huntorf', case=False).fillna(False), 'Technology'] = 'CAES'
     return df
 
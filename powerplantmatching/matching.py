@@ -21,17 +21,24 @@ from __future__ import absolute_import, print_function
 
 import pandas as pd
 import numpy as np
+import os
+import hashlib
+import functools
 import itertools
+from collections import OrderedDict
+import multiprocessing
+import six
 import logging
 logger = logging.getLogger(__name__)
-from .config import target_columns
-from .utils import read_csv_if_string
+from .config import target_columns, identifier_columns
+from .utils import read_csv_if_string, content_hash, _data, _data_out
 from .duke import duke
+from .features import name_features
 from .cleaning import clean_technology
 from .data import data_config
 
 
-def best_matches(links):
+def best_matches(links, threshold=None, mode='best'):
     """
     Subsequent to duke() with singlematch=True. Returns reduced list of
     matches on the base of the highest score for each duplicated entry.
@@ -40,13 +47,263 @@ def best_matches(links):
     ----------
     links : pd.DataFrame
         Links as returned by duke
+    threshold : float, default None
+        Only consider links with a score above the threshold. Allows
+        to apply different thresholds to the scored pairs obtained from
+        duke(return_scores=True) without running duke again.
+    mode : 'best' or 'mutual', default 'best'
+        With 'best' every entry of the second dataset keeps its best
+        link. With 'mutual' only links are kept which are the best ones
+        for the entries of both datasets, which should be used on the
+        links of duke() with singlematch=False.
     """
-    labels = links.columns.difference({'scores'})
-    return (links
-            .groupby(links.iloc[:, 1], as_index=False, sort=False)
-            .apply(lambda x: x.loc[x.scores.idxmax(), labels]))
+    if threshold is not None:
+        links = links[links.scores > threshold]
+    labels = links.columns[:2].sort_values()
+    links = links[links.iloc[:, :2].notnull().all(axis=1)].reset_index(drop=True)
+    # stable sort, such that ties are resolved by the first occurrence
+    ranked = links.iloc[np.argsort(-links.scores.values, kind='mergesort')]
+    best = ranked.drop_duplicates(subset=links.columns[1])
+    if mode == 'mutual':
+        best = best[best.index.isin(ranked.drop_duplicates(subset=links.columns[0]).index)]
+    elif mode != 'best':
+        raise ValueError("Unknown mode '{}'".format(mode))
+    # order of the first occurrence of the entries of the second dataset
+    order = pd.factorize(links.iloc[:, 1])[0]
+    best = best.iloc[np.argsort(order[best.index.values], kind='mergesort')]
+    return best.loc[:, labels].reset_index(drop=True)
+
+def _assign_component(i, j, scores, n1, n2, max_dense=10**6):
+    """
+    Maximum weight matching of the links (i, j) between n1 and n2 entries.
+    Components with up to `max_dense` pairs of entries are solved on a
+    dense matrix of scores. Larger ones are solved on the sparse links:
+    every entry gets a dummy partner, such that a full matching exists,
+    and the dummies of linked entries are linked as well. All edges cost 2
+    and the links 2 - score, hence the cheapest full matching maximizes
+    the scores of the matched links.
+    """
+    if n1 * n2 <= max_dense:
+        from scipy.optimize import linear_sum_assignment
+        weights = np.zeros((n1, n2))
+        weights[i, j] = scores
+        rows, cols = linear_sum_assignment(-weights)
+        matched = weights[rows, cols] > 0
+        return rows[matched], cols[matched]
+
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+    # rows are the entries of the first dataset and the dummies of the
+    # second one, columns the entries of the second dataset and the
+    # dummies of the first one
+    rows = np.r_[i, np.arange(n1), n1 + np.arange(n2), n1 + j]
+    cols = np.r_[j, n2 + np.arange(n1), np.arange(n2), n2 + i]
+    costs = np.r_[2. - scores, np.full(n1 + n2 + len(i), 2.)]
+    graph = coo_matrix((costs, (rows, cols)), shape=(n1 + n2, n1 + n2)).tocsr()
+    rows, cols = min_weight_full_bipartite_matching(graph)
+    matched = (rows < n1) & (cols < n2)
+    return rows[matched], cols[matched]
+
+
+def optimal_matches(links, threshold=None, n_jobs=1):
+    """
+    Returns the one-to-one matches which maximize the sum of the scores
+    of all links (maximum weight bipartite matching). The assignment
+    problem is solved separately for every connected component of the
+    links, which should be obtained from duke() with singlematch=False.
+    Large components are solved on their sparse links, such that they do
+    not require a dense matrix of scores.
+
+    Parameters
+    ----------
+    links : pd.DataFrame
+        Links as returned by duke
+    threshold : float, default None
+        Only consider links with a score above the threshold
+    n_jobs : int, default 1
+        Number of threads solving the components in parallel
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+    from multiprocessing.pool import ThreadPool
+
+    if threshold is not None:
+        links = links[links.scores > threshold]
+    labels = links.columns[:2].sort_values()
+    links = (links[links.iloc[:, :2].notnull().all(axis=1) & (links.scores > 0)]
+             .sort_values('scores', ascending=False, kind='mergesort')
+             .drop_duplicates(subset=list(links.columns[:2])))
+    i, ids1 = pd.factorize(links.iloc[:, 0])
+    j, ids2 = pd.factorize(links.iloc[:, 1])
+    graph = coo_matrix((np.ones(len(i)), (i, j + len(ids1))),
+                       shape=(len(ids1) + len(ids2),) * 2)
+    _, components = connected_components(graph, directed=False)
+
+    problems = []
+    for c in pd.Series(components[i]).groupby(components[i]).indices.values():
+        rows, ri = np.unique(i[c], return_inverse=True)
+        cols, ci = np.unique(j[c], return_inverse=True)
+        problems.append((rows, cols, ri, ci, links.scores.values[c]))
+
+    solve = lambda p: _assign_component(p[2], p[3], p[4], len(p[0]), len(p[1]))
+    if n_jobs == 1:
+        solutions = list(map(solve, problems))
+    else:
+        pool = ThreadPool(n_jobs)
+        try:
+            solutions = pool.map(solve, problems)
+        finally:
+            pool.close()
+
+    pairs = np.array([(rows[r], cols[c])
+                      for (rows, cols, _, _, _), (rs, cs) in zip(problems, solutions)
+                      for r, c in zip(rs, cs)], dtype=int).reshape(-1, 2)
+    pairs = pairs[np.argsort(pairs[:, 1], kind='mergesort')]
+    matches = pd.DataFrame({links.columns[0]: ids1.values[pairs[:, 0]],
+                            links.columns[1]: ids2.values[pairs[:, 1]]})
+    return matches.loc[:, labels]
+
+
+def _one_to_one(i, j):
+    """
+    Restricts the pairs of positions (i, j) to those whose entries do
+    not occur in any other pair.
+    """
+    pairs = np.unique(np.c_[i, j], axis=0) if len(i) else np.empty((0, 2), dtype=int)
+    unique = lambda v: ~pd.Series(v).duplicated(keep=False).values
+    keep = unique(pairs[:, 0]) & unique(pairs[:, 1])
+    return pairs[keep, 0], pairs[keep, 1]
+
 
-def compare_two_datasets(datasets, labels, **dukeargs):
+def exact_matches(datasets, labels, id_columns=None,
+                  keys=['Name', 'Country', 'Fueltype', 'Capacity']):
+    """
+    Returns the one-to-one matches which are determined by exact
+    agreement, in the same format as the links of duke() with
+    scores=1.0. First, entries of the same country sharing a (string)
+    identifier are matched, e.g. OPSD DE and BNETZA which both carry the
+    BNetzA ids, or OPSD and ENTSOE by the EIC codes. Lists of identifiers as obtained from the aggregation of
+    units are expanded. Second, the remaining entries are matched if all
+    `keys` agree, the names are compared lowercased and normalized.
+    Pairs in which one entry would be matched to several entries are
+    dropped.
+
+    Parameters
+    ----------
+    datasets : list of two pandas.Dataframe
+        dataframes to match
+    labels : list of strings
+        Names of the datasets
+    id_columns : list of strings, default None
+        columns holding identifiers (or lists of identifiers), defaults
+        to 'projectID' and the config.identifier_columns()
+    keys : list of strings
+        columns which have to agree for a match without identifier
+    """
+    from .comparators import lowercase_normalize
+
+    if id_columns is None:
+        id_columns = ['projectID'] + identifier_columns()
+
+    def identifiers(df, column):
+        values = df[column].values if column in df else np.array([])
+        lists = [v if isinstance(v, (list, tuple, set)) else [v] for v in values]
+        pos = np.repeat(np.arange(len(lists)), [len(l) for l in lists])
+        ids = pd.Series([x for l in lists for x in l], index=pos, dtype=object)
+        return ids[ids.map(lambda x: isinstance(x, six.string_types))]
+
+    found_i, found_j = [np.array([], dtype=int)], [np.array([], dtype=int)]
+    countries = [df['Country'].values for df in datasets]
+    for column in id_columns:
+        ids = [identifiers(df, column) for df in datasets]
+        joined = (pd.DataFrame({'i': ids[0].index, 'id': ids[0].values})
+                  .merge(pd.DataFrame({'j': ids[1].index, 'id': ids[1].values}),
+                         on='id'))
+        same_country = (countries[0][joined.i.values] ==
+                        countries[1][joined.j.values])
+        found_i.append(joined.i.values[same_country])
+        found_j.append(joined.j.values[same_country])
+    i, j = _one_to_one(np.concatenate(found_i), np.concatenate(found_j))
+
+    def key_frame(df, exclude):
+        frame = df.reindex(columns=keys).reset_index(drop=True)
+        if 'Name' in frame:
+            frame['Name'] = frame['Name'].map(lowercase_normalize, na_action='ignore')
+        frame = frame.assign(position=np.arange(len(df)))
+        return frame.drop(exclude).dropna()
+    joined = key_frame(datasets[0], i).merge(key_frame(datasets[1], j),
+                                             on=keys, suffixes=('_i', '_j'))
+    ki, kj = _one_to_one(joined.position_i.values, joined.position_j.values)
+    logger.info('Found {} matches by identifiers and {} by exact keys'
+                .format(len(i), len(ki)))
+
+    i, j = np.r_[i, ki].astype(int), np.r_[j, kj].astype(int)
+    return pd.DataFrame({labels[0]: datasets[0].index.values[i],
+                         labels[1]: datasets[1].index.values[j],
+                         'scores': np.ones(len(i))},
+                        columns=list(labels[:2]) + ['scores'])
+
+
+def _cache_repr(value):
+    """
+    Representation of an argument which is stable across processes, or
+    None if there is none. Functions are represented by their module and
+    qualified name, partial functions additionally by their arguments.
+    Lambdas and locally defined functions have no stable representation.
+    """
+    if isinstance(value, pd.DataFrame):
+        return content_hash(value)
+    if isinstance(value, functools.partial):
+        parts = ([_cache_repr(value.func)] + [_cache_repr(a) for a in value.args] +
+                 [_cache_repr(v) for _, v in sorted(value.keywords.items())])
+        if any(p is None for p in parts):
+            return None
+        return repr((parts, sorted(value.keywords)))
+    if isinstance(value, (list, tuple)):
+        parts = [_cache_repr(v) for v in value]
+        return None if any(p is None for p in parts) else repr(parts)
+    if isinstance(value, dict):
+        parts = [(k, _cache_repr(v)) for k, v in sorted(value.items())]
+        return None if any(p is None for _, p in parts) else repr(parts)
+    if callable(value):
+        name = getattr(value, '__qualname__', getattr(value, '__name__', None))
+        if name is None or '<' in name:
+            return None
+        return '{}.{}'.format(getattr(value, '__module__', None), name)
+    # default representations hold the memory address
+    return None if ' at 0x' in repr(value) else repr(value)
+
+
+def _link_cache_key(datasets, labels, assignment, dukeargs):
+    """
+    Hex digest identifying a comparison of two datasets, composed of the
+    content of the datasets, the duke configuration and the arguments
+    which influence the matches. Returns None if an argument has no
+    stable representation, see _cache_repr.
+    """
+    ignored = ['features', 'n_jobs', 'showmatches', 'showoutput', 'keepfiles']
+    args = [(k, _cache_repr(v))
+            for k, v in sorted(dukeargs.items()) if k not in ignored]
+    unstable = [k for k, v in args if v is None]
+    if unstable:
+        logger.info('Not caching the matches of {} and {}, since the '
+                    'argument(s) {} cannot be identified across sessions'
+                    .format(labels[0], labels[1], ', '.join(unstable)))
+        return None
+    with open(_data('Comparison.xml'), 'rb') as f:
+        config = f.read()
+    key = hashlib.sha1()
+    for part in ([content_hash(df) for df in datasets] +
+                 [repr(list(labels)), assignment, repr(args)]):
+        key.update(part.encode('utf-8'))
+    key.update(config)
+    return key.hexdigest()
+
+
+def compare_two_datasets(datasets, labels, assignment='best', use_cache=False,
+                         prepass=False, prepass_id_columns=None,
+                         prepass_keys=['Name', 'Country', 'Fueltype', 'Capacity'],
+                         **dukeargs):
     """
     Duke-based horizontal match of two databases. Returns the matched
     dataframe including only the matched entries in a multi-indexed
@@ -66,14 +323,81 @@ def compare_two_datasets(datasets, labels, **dukeargs):
         dataframes or csv-files to use for the matching
     labels : list of strings
         Names of the databases for the resulting dataframe
-
+    assignment : 'best', 'mutual' or 'optimal', default 'best'
+        How the one-to-one matches are selected from the links, see
+        best_matches. With 'best' every entry of the first dataset is
+        linked to its best match, and conflicts are resolved by the
+        highest score. With 'mutual' only links are kept where both
+        entries are each other's best match. With 'optimal' the
+        matches maximize the total score, see optimal_matches, the
+        components are solved with n_jobs threads.
+    use_cache : bool, default False
+        Whether to store the matches in data/out/links_XX_YY.pkl and to
+        reuse them as long as the datasets, the duke configuration and
+        the arguments do not change. Functions passed as arguments are
+        identified by their module and name, lambdas and locally defined
+        functions disable the cache.
+    prepass : bool, default False
+        Whether to match entries with a shared identifier or with equal
+        name, country, fueltype and capacity beforehand, see
+        exact_matches. Only the remaining entries are compared by duke.
+    prepass_id_columns : list of strings, default None
+        identifier columns of the prepass, see exact_matches
+    prepass_keys : list of strings
+        columns which have to agree for a match in the prepass, see
+        exact_matches
+    **dukeargs : keyword-args for duke, e.g. blocking=['Country', 'Fueltype']
+        for linking only records within the same country and fueltype,
+        or candidates='qgram' for comparing only records with similar
+        names.
+        With return_scores=True all scored pairs are returned instead
+        of the matches, apply best_matches(scores, threshold) to them.
 
     """
     datasets = list(map(read_csv_if_string, datasets))
-    if not 'singlematch' in dukeargs:
-        dukeargs['singlematch']=True
-    links = duke(datasets, labels=labels, **dukeargs)
-    matches = best_matches(links)
+    if use_cache:
+        key = _link_cache_key(datasets, labels, assignment,
+                              dict(dukeargs, prepass=True,
+                                   prepass_id_columns=prepass_id_columns,
+                                   prepass_keys=prepass_keys)
+                              if prepass else dukeargs)
+        use_cache = key is not None
+    if use_cache:
+        path_name = _data_out('links_{}_{}.pkl'.format(*labels))
+        if os.path.exists(path_name):
+            stored = pd.read_pickle(path_name)
+            if stored['hash'] == key:
+                logger.info('Reading saved matches of {0} and {1}'.format(*labels))
+                return stored['matches']
+    if prepass:
+        exact = exact_matches(datasets, labels, id_columns=prepass_id_columns,
+                              keys=prepass_keys)
+        exclude = [exact[l] for l in labels[:2]]
+        if dukeargs.get('features') is not None:
+            dukeargs['features'] = [f.drop(e) for f, e in zip(dukeargs['features'], exclude)]
+        if isinstance(dukeargs.get('candidates'), pd.DataFrame):
+            candidates = dukeargs['candidates']
+            dukeargs['candidates'] = candidates[
+                ~candidates.iloc[:, 0].isin(exclude[0]) &
+                ~candidates.iloc[:, 1].isin(exclude[1])]
+        datasets = [df.drop(e) for df, e in zip(datasets, exclude)]
+    if dukeargs.get('return_scores'):
+        matches = duke(datasets, labels=labels, **dukeargs)
+    else:
+        if not 'singlematch' in dukeargs:
+            dukeargs['singlematch'] = (assignment == 'best')
+        links = duke(datasets, labels=labels, **dukeargs)
+        if assignment == 'optimal':
+            matches = optimal_matches(links, n_jobs=dukeargs.get('n_jobs', 1))
+        else:
+            matches = best_matches(links, mode=assignment)
+    if prepass:
+        if not dukeargs.get('return_scores'):
+            exact = exact.loc[:, matches.columns]
+        matches = pd.concat([exact, matches], ignore_index=True).reindex(
+                    columns=matches.columns)
+    if use_cache:
+        pd.to_pickle({'hash': key, 'matches': matches}, path_name)
     return matches
 
 def cross_matches(sets_of_pairs, labels=None):
@@ -83,6 +407,15 @@ def cross_matches(sets_of_pairs, labels=None):
     though they did not match directly but indirectly through a
     connecting identifier of another database.
 
+    The rows are the connected components of the graph of all pairs. If
+    a component contains several identifiers of the same dataset, the
+    one with the most links within the component is kept (on ties the
+    smallest one), the others are dropped. As before, rows holding an
+    identifier of the last dataset come first, ties are resolved by the
+    previous datasets, and then by the order in which the identifier of
+    the first dataset present in a row appears in the pairs. Numeric
+    identifiers are returned as floats.
+
     Parameters
     ----------
     sets_of_pairs : list
@@ -94,25 +427,65 @@ def cross_matches(sets_of_pairs, labels=None):
         of the output
 
     """
-    m_all = sets_of_pairs
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    m_all = [m.dropna() for m in sets_of_pairs]
     if labels is None:
         labels = np.unique([x.columns for x in m_all])
-    matches = pd.DataFrame(columns=labels)
-    for i in labels:
-        base = [m.set_index(i) for m in m_all if i in m]
-        match_base = pd.concat(base, axis=1).reset_index()
-        matches = pd.concat([matches, match_base])
-
-    matches = matches.drop_duplicates().reset_index(drop=True)
-    for i in labels:
-        matches = pd.concat([
-            matches.groupby(i, as_index=False, sort=False)
-                   .apply(lambda x: x.loc[x.isnull().sum(axis=1).idxmin()]),
-            matches[matches[i].isnull()]
-        ]).reset_index(drop=True)
-    return matches.loc[:,labels]
-
-def link_multiple_datasets(datasets, labels, **dukeargs):
+    labels = list(labels)
+
+    # one node per identifier and dataset, in order of appearance and sorted
+    appearance = [pd.concat([m[l] for m in m_all if l in m] +
+                            [pd.Series([], dtype=object)]).drop_duplicates()
+                  for l in labels]
+    ids = [pd.Index(a.sort_values().values) for a in appearance]
+    offsets = np.cumsum([0] + [len(i) for i in ids])
+    n = offsets[-1]
+    dataset = np.repeat(np.arange(len(labels)), [len(i) for i in ids])
+
+    edges = [(offsets[labels.index(a)] + ids[labels.index(a)].get_indexer(m[a]),
+              offsets[labels.index(b)] + ids[labels.index(b)].get_indexer(m[b]))
+             for m in m_all for a, b in [m.columns[:2]]]
+    i = np.concatenate([e[0] for e in edges] + [np.array([], dtype=int)])
+    j = np.concatenate([e[1] for e in edges] + [np.array([], dtype=int)])
+    graph = coo_matrix((np.ones(len(i)), (i, j)), shape=(n, n))
+    _, components = connected_components(graph, directed=False)
+    degree = np.bincount(np.r_[i, j], minlength=n)
+
+    # per component and dataset the node with the highest degree,
+    # nodes are ordered by identifier within every dataset
+    order = np.lexsort((np.arange(n), -degree, dataset, components))
+    first = np.r_[True, (np.diff(components[order]) != 0) |
+                        (np.diff(dataset[order]) != 0)][:n]
+    kept = order[first]
+    if (~first).any():
+        logger.warning('Dropping {} conflicting identifiers in the cross matches'
+                       .format((~first).sum()))
+
+    rows, row = np.unique(components[kept], return_inverse=True)
+    positions = np.full((len(rows), len(labels)), -1)
+    positions[row, dataset[kept]] = kept - offsets[dataset[kept]]
+    missing = positions < 0
+    first = missing.argmin(axis=1)
+    rank = np.empty(n, dtype=int)
+    for k in range(len(labels)):
+        rank[offsets[k] + ids[k].get_indexer(appearance[k])] = np.arange(len(ids[k]))
+    rank = rank[offsets[first] + positions[np.arange(len(positions)), first]]
+    positions = positions[np.lexsort([rank] + list(missing.T))]
+
+    matches = pd.DataFrame({l: pd.Series(ids[k].values).reindex(positions[:, k]).values
+                            for k, l in enumerate(labels)}, columns=labels)
+    numeric = [l for l in labels if pd.api.types.is_numeric_dtype(matches[l])]
+    matches[numeric] = matches[numeric].astype(float)
+    return matches
+
+def _compare_pair(args):
+    datasets, labels, dukeargs = args
+    logger.info('Comparing {0} with {1}'.format(*labels))
+    return compare_two_datasets(datasets, labels, **dukeargs)
+
+def link_multiple_datasets(datasets, labels, n_jobs=1, features=None, **dukeargs):
     """
     Duke-based horizontal match of multiple databases. Returns the
     matching indices of the datasets. Compares all properties of the
@@ -130,17 +503,107 @@ def link_multiple_datasets(datasets, labels, **dukeargs):
     labels : list of strings
         Names of the databases in alphabetical order and corresponding
         order to the datasets
+    n_jobs : int, default 1
+        Number of processes comparing pairs of datasets in parallel,
+        the largest pairs are scheduled first. Every duke run works in
+        its own temporary directory.
+    features : list of pandas.Dataframe, default None
+        Only for the native backend. Name features of the datasets as
+        returned by features.name_features(), which are computed once
+        and shared by all comparisons if not given.
+    **dukeargs : keyword-args for compare_two_datasets and duke, e.g.
+        use_cache=True for only recomputing the comparisons whose
+        datasets have changed, or prepass=True with prepass_id_columns
+        and prepass_keys for matching by identifiers and exact keys first
     """
     datasets = list(map(read_csv_if_string, datasets))
     combinations = list(itertools.combinations(range(len(labels)), 2))
-    all_matches = []
-    for c,d in combinations:
-        logger.info('Comparing {0} with {1}'.format(labels[c], labels[d]))
-        match = compare_two_datasets([datasets[c],datasets[d]],[labels[c],labels[d]], **dukeargs)
-        all_matches.append(match)
+    if dukeargs.get('backend') == 'native' and features is None:
+        features = [name_features(df) for df in datasets]
+    if features is not None:
+        jobs = [([datasets[c], datasets[d]], [labels[c], labels[d]],
+                 dict(dukeargs, features=[features[c], features[d]]))
+                for c, d in combinations]
+    else:
+        jobs = [([datasets[c], datasets[d]], [labels[c], labels[d]], dukeargs)
+                for c, d in combinations]
+    if n_jobs == 1:
+        all_matches = list(map(_compare_pair, jobs))
+    else:
+        order = sorted(range(len(jobs)), reverse=True,
+                       key=lambda k: len(jobs[k][0][0]) * len(jobs[k][0][1]))
+        pool = multiprocessing.Pool(n_jobs)
+        try:
+            matches = pool.map(_compare_pair, [jobs[k] for k in order], chunksize=1)
+        finally:
+            pool.close()
+        all_matches = [m for _, m in sorted(zip(order, matches), key=lambda x: x[0])]
     return cross_matches(all_matches, labels=labels)
 
 
+def link_table(cross_matches):
+    """
+    Returns the cross matches in long format, i.e. a pandas.Dataframe with
+    one row per matched entry and the columns 'plant_id' (row of the cross
+    matches), 'dataset' (label of the dataset) and 'source_row' (index
+    label of the entry in the dataset).
+
+    Parameters
+    ----------
+    cross_matches : pandas.Dataframe
+        matching indexes of the datasets, as returned by
+        link_multiple_datasets()
+    """
+    return (cross_matches.reset_index(drop=True)
+            .rename_axis('plant_id').rename_axis('dataset', axis=1)
+            .stack().rename('source_row').reset_index())
+
+
+def project_column(links, datasets, column):
+    """
+    Returns the values of one column of all matched entries as a
+    pandas.Dataframe with one row per plant and one column per dataset,
+    which corresponds to matched_dataframe(links, datasets)[column].
+
+    Parameters
+    ----------
+    links : pandas.Dataframe
+        link table as returned by link_table()
+    datasets : dict of pandas.Dataframe
+        datasets keyed by their labels, in the order of the labels
+    column : str
+        name of the column
+    """
+    plants = pd.Index(np.unique(links.plant_id.values), name=None)
+    block = {}
+    for label, df in datasets.items():
+        entries = links[links.dataset == label]
+        values = (df[column].reindex(entries.source_row.values) if column in df
+                  else pd.Series(np.nan, index=entries.source_row.values))
+        block[label] = pd.Series(values.values, index=entries.plant_id.values).reindex(plants)
+    return pd.DataFrame(block, index=plants, columns=list(datasets))
+
+
+def matched_dataframe(links, datasets, columns=None):
+    """
+    Builds the wide MultiIndex dataframe of the matched powerplants, as
+    returned by combine_multiple_datasets(), from the link table.
+
+    Parameters
+    ----------
+    links : pandas.Dataframe
+        link table as returned by link_table()
+    datasets : dict of pandas.Dataframe
+        datasets keyed by their labels, in the order of the labels
+    columns : list of strings, default None
+        columns to include, defaults to the target columns
+    """
+    if columns is None:
+        columns = target_columns()
+    return pd.concat([project_column(links, datasets, c) for c in columns],
+                     axis=1, keys=columns)
+
+
 def combine_multiple_datasets(datasets, labels, **dukeargs):
     """
     Duke-based horizontal match of multiple databases. Returns the
@@ -176,17 +639,150 @@ def combine_multiple_datasets(datasets, labels, **dukeargs):
             order as in cross_matches
         """
         datasets = list(map(read_csv_if_string, datasets))
-        for i, data in enumerate(datasets):
-            datasets[i] = data.reindex(cross_matches.iloc[:, i]).reset_index(drop=True)
-        df = pd.concat(datasets, axis=1, keys=cross_matches.columns.tolist())
-        df = df.reorder_levels([1, 0], axis=1)
-        df = df.loc[:,target_columns()]
-        return df.reset_index(drop=True)
+        return matched_dataframe(link_table(cross_matches),
+                                 OrderedDict(zip(cross_matches.columns, datasets)))
     crossmatches = link_multiple_datasets(datasets, labels, **dukeargs)
     return combined_dataframe(crossmatches, datasets)[target_columns()]
 
 
-def reduce_matched_dataframe(df, show_orig_names=False):
+def first_valid(values):
+    """
+    Returns the first non-null value of every row of a two-dimensional
+    numpy array, NaN for rows without any value.
+    """
+    valid = pd.notnull(values)
+    first = valid.argmax(axis=1)
+    result = values[np.arange(len(values)), first]
+    if result.dtype.kind in 'fc':
+        return np.where(valid.any(axis=1), result, np.nan)
+    result = result.astype(object)
+    result[~valid.any(axis=1)] = np.nan
+    return result
+
+
+def prioritise_reliability(df, rel_scores, ties='mean'):
+    """
+    Take the first most reliable value if dtype==String, else take the
+    first value of the aggregated (`ties`) values of the sources with the
+    same reliability score.
+
+    Parameters
+    ----------
+    df : pandas.Dataframe
+        values of one column, one column per source
+    rel_scores : pandas.Series
+        reliability scores of the sources in descending order
+    ties : str, default 'mean'
+        aggregation of numeric values of equally reliable sources
+    """
+    # Arrange columns in descending order of reliability
+    df = df.loc[:, rel_scores.index]
+
+    if not df.notnull().values.any():
+        logger.warn('Empty dataframe passed to `prioritise_reliability`.')
+        return pd.Series(np.nan, index=df.index)
+
+    # Aggregate data with same reliability scores for numeric columns
+    # (but DO maintain order)
+    if all(pd.api.types.is_numeric_dtype(dtype) for dtype in df.dtypes):
+        # all numeric (categorical and string columns are not)
+        df = df.groupby(rel_scores, axis=1, sort=False).agg(ties)
+
+    return pd.Series(first_valid(df.values), index=df.index)
+
+
+def concat_strings(df, rel_scores=None):
+    """
+    Joins the non-null strings of all sources with ', '.
+    """
+    result = pd.Series(np.nan, index=df.index, dtype=object)
+    for source in df.columns:
+        value = df[source].astype(object)
+        result = (result + ', ' + value).fillna(result).fillna(value)
+    return result
+
+
+def source_mapping(df, rel_scores=None):
+    """
+    Returns a dictionary of the non-null values keyed by the source for
+    every row, e.g. the projectIDs of the matched entries. The dictionaries
+    are python objects of their own, hence they are filled in a single
+    loop over the non-null values.
+    """
+    values = df.values
+    sources = np.asarray(df.columns)
+    rows, cols = np.nonzero(pd.notnull(values))
+    mappings = [{} for _ in range(len(df))]
+    for r, source, value in zip(rows, sources[cols], values[rows, cols]):
+        mappings[r][source] = value
+    return pd.Series(mappings, index=df.index)
+
+
+# Aggregation specs of reduce_matched_dataframe, every column of the
+# reduced dataframe is the result of a function (or the name of a method
+# of pandas.DataFrame aggregating over the sources) given the values of
+# all sources and their reliability scores, with additional keyword
+# arguments
+aggregation_specs = [
+    ('Name', (prioritise_reliability, {})),
+    ('Fueltype', (prioritise_reliability, {})),
+    ('Technology', (prioritise_reliability, {})),
+    ('Country', (prioritise_reliability, {})),
+    ('Set', (prioritise_reliability, {})),
+    ('Capacity', (prioritise_reliability, {'ties': 'median'})),
+    ('YearCommissioned', ('max', {})),
+    ('lat', (prioritise_reliability, {})),
+    ('lon', (prioritise_reliability, {})),
+    ('File', (concat_strings, {})),
+    ('projectID', (source_mapping, {})),
+    ('Duration', (prioritise_reliability, {}))]
+
+
+def _reduce_partition(args):
+    df, show_orig_names, datasets, aggregation = args
+    return reduce_matched_dataframe(df, show_orig_names=show_orig_names,
+                                    datasets=datasets, aggregation=aggregation)
+
+
+def _reduce_parallel(df, show_orig_names, datasets, aggregation, n_jobs):
+    """
+    Reduces the matched powerplants country by country in a process pool
+    and reassembles the partitions in the original order.
+    """
+    if datasets is None:
+        country = pd.Series(first_valid(df['Country'].values), index=df.index)
+    else:
+        country = project_column(df, datasets, 'Country')
+        country = pd.Series(first_valid(country.values), index=country.index)
+    partitions = country.fillna('').groupby(country.fillna('')).indices
+
+    def tasks():
+        for label in sorted(partitions):
+            if datasets is None:
+                yield df.iloc[partitions[label]], show_orig_names, None, aggregation
+            else:
+                links = df[df.plant_id.isin(country.index[partitions[label]])]
+                parts = OrderedDict(
+                    (l, d.loc[links.source_row[links.dataset == l].unique()])
+                    for l, d in datasets.items())
+                yield links, show_orig_names, parts, aggregation
+
+    # every worker handles a few partitions only, which bounds its memory
+    pool = multiprocessing.Pool(n_jobs, maxtasksperchild=1)
+    try:
+        reduced = list(pool.imap(_reduce_partition, tasks(), chunksize=1))
+    finally:
+        pool.close()
+    sdf = pd.concat(reduced)
+    # the partitions have categoricals of their own, which concat to object
+    for column in reduced[0].columns:
+        if any(hasattr(r[column], 'cat') for r in reduced):
+            sdf[column] = sdf[column].astype('category')
+    return sdf.reindex(index=country.index, columns=reduced[0].columns)
+
+
+def reduce_matched_dataframe(df, show_orig_names=False, datasets=None,
+                             aggregation={}, n_jobs=1):
     """
     Returns a new reduced dataframe with all names of the powerplants, according
     to the following logic:
@@ -206,59 +802,48 @@ def reduce_matched_dataframe(df, show_orig_names=False):
     df : pandas.Dataframe
         MultiIndex dataframe with the matched powerplants, as obtained from
         combined_dataframe() or match_multiple_datasets()
+    datasets : dict of pandas.Dataframe, default None
+        If given, `df` is a link table as returned by link_table() and the
+        values are read from the datasets (keyed by their labels) column by
+        column, without building the matched dataframe
+    aggregation : dict, default {}
+        Replaces or extends the aggregation_specs for single columns, e.g.
+        {'Capacity': (prioritise_reliability, {'ties': 'mean'})} or
+        {'YearCommissioned': ('min', {})}
+    n_jobs : int, default 1
+        Number of processes reducing the plants of different countries in
+        parallel, the result is the same as for a serial run
     """
-
-
-    def concat_strings(s):
-        if s.isnull().all():
-            return np.nan
-        else:
-            return s[s.notnull()].str.cat(sep = ', ')
+    if n_jobs != 1:
+        return _reduce_parallel(df, show_orig_names, datasets, aggregation, n_jobs)
 
     # define which databases are present and get their reliability_score
-    sources = df.columns.levels[1]
+    if datasets is None:
+        sources = df.columns.levels[1]
+        block = lambda column: df[column]
+    else:
+        sources = pd.Index(sorted(datasets))
+        block = lambda column: project_column(df, datasets, column)
     rel_scores = (pd.DataFrame(data_config).loc['reliability_score', sources]
                     .sort_values(ascending=False))
 
-    def prioritise_reliability(df, how='mean'):
-        """
-        Take the first most reliable value if dtype==String, else take mean of most
-        reliable values
-        """
-
-        # Arrange columns in descending order of reliability
-        df = df.loc[df.notnull().any(axis=1), rel_scores.index]
-
-        if df.empty:
-            logger.warn('Empty dataframe passed to `prioritise_reliability`.')
-            return pd.Series()
-
-        # Aggregate data with same reliability scores for numeric columns
-        # (but DO maintain order)
-        if not ((df.dtypes == object) | (df.dtypes == str)).any():
-            # all numeric
-            df = df.groupby(rel_scores, axis=1, sort=False).agg(how)
-
-        return df.apply(lambda ds: ds.dropna().iloc[0], axis=1)
-
-    sdf = pd.DataFrame.from_dict({
-        'Name': prioritise_reliability(df['Name']),
-        'Fueltype': prioritise_reliability(df['Fueltype']),
-        'Technology': prioritise_reliability(df['Technology']),
-        'Country': prioritise_reliability(df['Country']),
-        'Set': prioritise_reliability(df['Set']),
-        'Capacity': prioritise_reliability(df['Capacity'], how='median'),
-        'YearCommissioned': df['YearCommissioned'].max(axis=1),
-        'lat': prioritise_reliability(df['lat']),
-        'lon': prioritise_reliability(df['lon']),
-        'File': df['File'].apply(concat_strings, axis=1),
-        'projectID': df['projectID'].apply(lambda x: dict(x.dropna()), axis=1)
-    })
-    if 'Duration' in target_columns():
-        sdf = sdf.assign(Duration= prioritise_reliability(df['Duration']))
+    specs = [(c, aggregation.get(c, spec)) for c, spec in aggregation_specs]
+    specs += [(c, spec) for c, spec in aggregation.items()
+              if c not in dict(aggregation_specs)]
+    columns = []
+    reduced = {}
+    for column, (func, kwargs) in specs:
+        if column == 'Duration' and 'Duration' not in target_columns():
+            continue
+        if callable(func):
+            reduced[column] = func(block(column), rel_scores, **kwargs)
+        else:
+            reduced[column] = getattr(block(column), func)(axis=1, **kwargs)
+        columns.append(column)
+    sdf = pd.DataFrame(reduced).reindex(columns=columns)
 
     if show_orig_names:
-        sdf = sdf.assign(**dict(df.Name))
+        sdf = sdf.assign(**dict(block('Name')))
     sdf = clean_technology(sdf, generalize_hydros=False)
     sdf.reset_index(drop=True)
     return sdf if show_orig_names else sdf.reindex(columns=target_columns())
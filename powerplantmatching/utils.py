@@ -20,6 +20,8 @@ Utility functions for checking data completness and supporting other functions
 from __future__ import print_function, absolute_import
 from os.path import dirname
 import os
+import hashlib
+import numpy as np
 import pandas as pd
 import six
 import pycountry
@@ -123,6 +125,39 @@ def set_uncommon_fueltypes_to_other(df, fueltypes={'Bioenergy','Geothermal','Mix
     return df
 
 
+def content_hash(df, columns=None):
+    """
+    Returns a hex digest identifying the content (index and values) of
+    the dataframe, restricted to `columns` if given.
+    """
+    if columns is not None:
+        df = df.reindex(columns=columns)
+    values = pd.util.hash_pandas_object(df.astype(str), index=True).values
+    return hashlib.sha1(values.tobytes()).hexdigest()
+
+
+def map_unique(s, func):
+    """
+    Applies a (vectorized) transformation to the unique values of a
+    series only and broadcasts the result back to all rows, which is much
+    faster for repetitive columns like names or technologies. Missing
+    values stay missing.
+
+    Parameters
+    ----------
+    s : pandas.Series
+        values to transform, may be categorical
+    func : function
+        takes a pandas.Series of the unique values and returns a
+        pandas.Series or array of the same length
+    """
+    codes, uniques = pd.factorize(s)
+    result = np.asarray(func(pd.Series(np.asarray(uniques))))
+    if (codes < 0).any():
+        result = np.append(result.astype(object), np.nan)
+    return pd.Series(result[codes], index=s.index, name=s.name)
+
+
 def read_csv_if_string(data):
     from .data import data_config
     if isinstance(data, six.string_types):
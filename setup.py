@@ -21,6 +21,7 @@ setup(
     packages=find_packages(exclude=['duke_binaries', 'Hydro aggregation.py']),
     include_package_data=True,
     install_requires=['numpy','scipy','pandas>=0.19.0','networkx>=1.10','pycountry'],
+    extras_require={'jvm': ['JPype1']},
     classifiers=[
 #        'Development Status :: 3 - Alpha',
         'Environment :: Console',
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the candidate generation for the linkage
+"""
+from __future__ import absolute_import, print_function
+
+from functools import partial
+import numpy as np
+import pandas as pd
+import pytest
+
+from powerplantmatching.blocking import (block_labels, blocking_statistics,
+                                         blocks, candidate_blocks,
+                                         candidate_positions,
+                                         candidate_statistics,
+                                         qgram_candidates, qgram_index,
+                                         sorted_neighbourhood_candidates,
+                                         spatial_candidates)
+from powerplantmatching.duke import duke
+
+
+def linked_datasets(n=40, seed=0, swap_words=False):
+    # two datasets of the same plants, the names of the second one have
+    # a typo and optionally their words swapped
+    rng = np.random.RandomState(seed)
+    words = ['Lippendorf', 'Boxberg', 'Jaenschwalde', 'Niederaussem',
+             'Weisweiler', 'Neurath', 'Frimmersdorf', 'Irsching', 'Staudinger',
+             'Moorburg', 'Walsum', 'Scholven', 'Datteln', 'Heyden',
+             'Ibbenbueren', 'Mehrum', 'Wilhelmshaven', 'Reuter', 'Klingenberg',
+             'Lichterfelde']
+    first, second = rng.choice(words, n), rng.choice(words, n)
+    one = pd.DataFrame({'Name': ['{} {}'.format(a, b) for a, b in zip(first, second)],
+                        'Fueltype': rng.choice(['Hard Coal', 'Lignite',
+                                                'Natural Gas'], n),
+                        'Country': rng.choice(['Germany', 'Austria'], n),
+                        'Capacity': rng.choice([100., 200., 500.], n),
+                        'lat': rng.uniform(47, 55, n),
+                        'lon': rng.uniform(6, 14, n)})
+    two = one.copy()
+    if swap_words:
+        swap = rng.rand(n) < 0.5
+        two.loc[swap, 'Name'] = ['{} {}'.format(b, a) for a, b
+                                 in zip(first[swap], second[swap])]
+    two['Name'] = [s[:k] + s[k+1:] for s, k in zip(two.Name, rng.randint(1, 8, n))]
+    two = two.iloc[rng.permutation(n)]
+    two.index = two.index + 100
+    return [one, two]
+
+
+def linked_pairs(links):
+    return set(map(tuple, links.iloc[:, :2].values.tolist()))
+
+
+def check_candidates(candidates):
+    for swap_words, equal in [(False, True), (True, False)]:
+        datasets = linked_datasets(swap_words=swap_words)
+        full = linked_pairs(duke(datasets, labels=['A', 'B'], backend='native'))
+        links = linked_pairs(duke(datasets, labels=['A', 'B'], backend='native',
+                                  candidates=candidates))
+        assert links <= full
+        if equal:
+            assert links == full
+
+
+def test_qgram_index():
+    df = pd.DataFrame({'Name': [u'Moorburg', u'Moorbürg', u'Datteln']},
+                      index=[3, 5, 7])
+    index = qgram_index(df)
+    assert list(index['moo']) == [3, 5]
+    assert list(index['tel']) == [7]
+
+
+def test_qgram_candidates():
+    check_candidates(partial(qgram_candidates, max_df=0.2))
+    check_candidates(partial(qgram_candidates, max_df=0.2, k=1))
+    # small datasets keep their q-grams with the default share
+    check_candidates(qgram_candidates)
+    assert len(qgram_candidates(linked_datasets(), min_df=0)) == 0
+
+
+def test_sorted_neighbourhood_candidates():
+    check_candidates('sorted_neighbourhood')
+    check_candidates(partial(sorted_neighbourhood_candidates, window=3))
+
+
+def test_duke_blocking():
+    one, two = linked_datasets(swap_words=True)
+    one.loc[[0, 1, 2], 'Fueltype'] = np.nan
+    two.loc[[137, 138, 139], 'Country'] = np.nan
+    # links across blocks, which blocking drops
+    two.loc[range(110, 120), 'Fueltype'] = 'Oil'
+    for datasets, labels in [([one, two], ['A', 'B']),
+                             (pd.concat([one, two]), ['one', 'two'])]:
+        dfs = [datasets] if isinstance(datasets, pd.DataFrame) else datasets
+        full = duke(datasets, labels=labels, backend='native')
+        ids = [block_labels(df, ['Country', 'Fueltype']) for df in dfs]
+        a, b = ids[0].loc[full[labels[0]]].values, ids[-1].loc[full[labels[1]]].values
+        same_block = (a == b) | pd.isnull(a) | pd.isnull(b)
+        if len(dfs) == 2:
+            assert not same_block.all()
+        for n_jobs in [1, 3]:
+            links = duke(datasets, labels=labels, backend='native',
+                         blocking=['Country', 'Fueltype'], n_jobs=n_jobs)
+            assert linked_pairs(links) == linked_pairs(full[same_block])
+
+
+def test_block_labels_and_blocks():
+    df = pd.DataFrame({'Country': ['Germany', 'Germany', 'Austria', np.nan, 'Germany'],
+                       'Fueltype': ['Hydro', 'Hydro', 'Hydro', 'Hydro', 'Wind'],
+                       'Capacity': [100., 300., 100., 100., 400.]})
+    labels = block_labels(df)
+    assert labels.tolist()[:3] == ['Germany|Hydro', 'Germany|Hydro', 'Austria|Hydro']
+    assert pd.isnull(labels[3])
+    # 100 MW and 300 MW share a band of half a decade, 100 MW and 400 MW not
+    bands = block_labels(df.assign(Fueltype='Hydro'), capacity_bands=0.5)
+    assert bands[0] == bands[1] != bands[4]
+
+    # the record without label takes part in every block, blocks with a
+    # single record are skipped for deduplication
+    assert [(l, ps[0].tolist()) for l, ps in blocks([labels])] == \
+        [('Austria|Hydro', [2, 3]), ('Germany|Hydro', [0, 1, 3]),
+         ('Germany|Wind', [3, 4])]
+    other = pd.Series(['Germany|Hydro', 'France|Hydro'])
+    assert [(l, [p.tolist() for p in ps]) for l, ps in blocks([labels, other])] == \
+        [('France|Hydro', [[3], [1]]), ('Germany|Hydro', [[0, 1, 3], [0]])]
+
+    stats = blocking_statistics([labels, other], labels=['A', 'B'])
+    assert stats.loc['Germany|Hydro', ['A', 'B', 'pairs']].tolist() == [3, 1, 3]
+    assert stats.loc['Germany|Hydro', 'share'] == 3. / 10
+    assert stats.loc['Germany|Hydro', 'removed'] == 0.5
+    stats = blocking_statistics([labels])
+    assert stats.pairs.tolist() == [1, 3, 1]
+    assert stats.share.sum() == 5. / 10
+
+
+def test_candidate_statistics():
+    one, two = linked_datasets()
+    links = duke([one, two], labels=['A', 'B'], backend='native')
+    candidates = links.iloc[:len(links) // 2, :2]
+    stats = candidate_statistics([one, two], candidates, links)
+    assert stats['pairs'] == len(candidates)
+    assert stats['reduction_ratio'] == 1. - len(candidates) / (len(one) * len(two))
+    assert stats['pair_completeness'] == len(candidates) / float(len(links))
+    assert np.isnan(candidate_statistics([one, two], candidates)['pair_completeness'])
+
+
+def test_candidate_blocks():
+    one, two = linked_datasets(n=200)
+    # spatial candidates decompose into many small blocks
+    candidates = spatial_candidates([one, two], radius=20000.)
+    ids = candidate_blocks([one, two], candidates, min_block_size=10)
+    i, j = candidate_positions([one, two], candidates)
+    assert (ids[0].values[i] == ids[1].values[j]).all()
+    assert ids[0].nunique() > 1
+
+    # the chained pairs of the sorted neighbourhood do not
+    candidates = sorted_neighbourhood_candidates([one, two])
+    with pytest.raises(ValueError):
+        candidate_blocks([one, two], candidates, min_block_size=10)
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * 6371000. * np.arcsin(np.sqrt(a))
+
+
+def test_spatial_candidates():
+    rng = np.random.RandomState(0)
+    one, two = [pd.DataFrame({'lat': rng.uniform(50, 50.5, n),
+                              'lon': rng.uniform(8, 8.5, n)}, index=index)
+                for n, index in [(60, range(60)), (50, range(100, 150))]]
+    one.loc[[3, 7], 'lat'] = np.nan
+    two.loc[[120], 'lon'] = np.nan
+    for datasets in [[one, two], [one]]:
+        expected = set()
+        for a, r in datasets[0].iterrows():
+            for b, s in datasets[-1].iterrows():
+                if len(datasets) == 1 and a >= b:
+                    continue
+                d = haversine(r.lat, r.lon, s.lat, s.lon)
+                if np.isnan(d) or d <= 10000.:
+                    expected.add((a, b))
+        candidates = spatial_candidates(datasets, radius=10000.)
+        assert linked_pairs(candidates) == expected
+
+
+def test_sorted_neighbourhood_requires_native_backend():
+    datasets = linked_datasets()
+    for candidates in ['sorted_neighbourhood',
+                       partial(sorted_neighbourhood_candidates, window=3)]:
+        for backend in ['java', 'jvm']:
+            with pytest.raises(ValueError, match='native backend'):
+                duke(datasets, backend=backend, candidates=candidates)
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the cleaning and aggregation of single datasets
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import networkx as nx
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal, assert_series_equal
+
+from powerplantmatching import cleaning
+from powerplantmatching.cleaning import (aggregate_units, clean_powerplantname,
+                                         clean_technology, cliques,
+                                         gather_text_info)
+from powerplantmatching.config import target_columns
+from powerplantmatching.utils import map_unique
+
+
+def partition(grouped):
+    return sorted(sorted(g.index) for _, g in grouped.groupby(grouped))
+
+
+def clique_search(df, duplicates):
+    # clique search on the whole reciprocal graph, as cliques did before
+    # the grouping by connected components
+    G = nx.DiGraph()
+    G.add_nodes_from(df.index)
+    G.add_edges_from((r.one, r.two) for r in duplicates.itertuples())
+    H = G.to_undirected(reciprocal=True)
+    grouped = pd.Series(np.nan, index=df.index)
+    for i, inds in enumerate(nx.algorithms.clique.find_cliques(H)):
+        grouped.loc[inds] = i
+    return grouped
+
+
+def reciprocal(one, two):
+    return pd.DataFrame({'one': np.r_[one, two], 'two': np.r_[two, one]},
+                        columns=['one', 'two'])
+
+
+def test_cliques_triangle_with_pendant():
+    df = pd.DataFrame({'Name': range(4)}, index=[30, 10, 20, 0])
+    duplicates = reciprocal([30, 30, 10, 20], [10, 20, 20, 0])
+    expected = [[0], [10, 20, 30]]
+    assert partition(clique_search(df, duplicates)) == expected
+    for order in [slice(None), slice(None, None, -1)]:
+        grouped = cliques(df, duplicates.iloc[order]).grouped
+        assert partition(grouped) == expected
+
+
+def test_cliques_match_clique_search():
+    for seed in range(20):
+        rng = np.random.RandomState(seed)
+        n = rng.randint(5, 60)
+        df = pd.DataFrame({'Name': range(n)},
+                          index=rng.permutation(1000)[:n])
+        # disjoint groups of fully linked units, plus links in one
+        # direction only which must not join them
+        groups = rng.randint(0, n // 2, n)
+        one, two = [], []
+        for g in np.unique(groups):
+            members = df.index[groups == g]
+            for a in members:
+                for b in members[members > a]:
+                    one.append(a)
+                    two.append(b)
+        duplicates = reciprocal(one, two)
+        m = rng.randint(0, n)
+        a, b = rng.choice(df.index, m), rng.choice(df.index, m)
+        duplicates = pd.concat([duplicates, pd.DataFrame(
+            {'one': np.minimum(a, b), 'two': np.maximum(a, b)},
+            columns=['one', 'two'])])
+        duplicates = duplicates.sample(frac=1, random_state=rng)
+
+        expected = partition(clique_search(df, duplicates))
+        assert partition(cliques(df, duplicates).grouped) == expected
+        assert partition(cliques(df, duplicates, refine=None).grouped) == expected
+
+
+def test_cliques_groups_are_cliques():
+    for seed in range(20):
+        rng = np.random.RandomState(seed)
+        n = rng.randint(5, 40)
+        df = pd.DataFrame({'Name': range(n)},
+                          index=rng.permutation(1000)[:n])
+        m = rng.randint(0, 3 * n)
+        duplicates = reciprocal(rng.choice(df.index, m),
+                                rng.choice(df.index, m))
+        H = nx.Graph()
+        H.add_edges_from(zip(duplicates.one, duplicates.two))
+        cliques_of_graph = set(frozenset(c) for c in nx.find_cliques(H))
+        grouped = cliques(df, duplicates).grouped
+        assert grouped.notnull().all()
+        for group in partition(grouped):
+            # every group is part of a maximal clique of the graph
+            assert len(group) == 1 or any(set(group) <= c
+                                          for c in cliques_of_graph)
+
+
+def units(n, seed):
+    # n units of n / 2 plants, units of a plant share all but the capacity
+    rng = np.random.RandomState(seed)
+    plants = rng.randint(0, n // 2, n)
+    names = np.array(['Staudinger', 'Moorburg', 'Datteln', 'Lippendorf',
+                      'Ensdorf', 'Mehrum', 'Heyden', 'Scholven', 'Walsum',
+                      'Reuter', 'Boxberg', 'Niederaussem', 'Neurath'])
+    lat, lon = rng.uniform(47, 55, n // 2), rng.uniform(6, 14, n // 2)
+    fueltype = rng.choice(['Hard Coal', 'Lignite', 'Natural Gas'], n // 2)
+    return pd.DataFrame({'Name': names[plants % len(names)],
+                         'Fueltype': fueltype[plants],
+                         'Technology': 'Steam Turbine', 'Set': 'PP',
+                         'Country': 'Germany',
+                         'Capacity': rng.choice([300., 310.], n),
+                         'lat': lat[plants], 'lon': lon[plants], 'File': 'test',
+                         'YearCommissioned': 2000.,
+                         'projectID': ['P{}_{}'.format(seed, k) for k in range(n)]}
+                        ).reindex(columns=target_columns(detailed_columns=False))
+
+
+def test_aggregate_units_incremental(monkeypatch, tmp_path):
+    monkeypatch.setattr(cleaning, '_data_out',
+                        lambda fn: os.path.join(str(tmp_path), fn))
+    path_name = os.path.join(str(tmp_path), 'aggregation_groups_test.csv')
+    df = units(30, seed=0)
+    extended = pd.concat([df, units(8, seed=1)], ignore_index=True)
+
+    aggregate_units(df, dataset_name='test', backend='native')
+    _, incremental = aggregate_units(extended, dataset_name='test',
+                                     backend='native', incremental=True,
+                                     return_aggregation_groups=True)
+    os.remove(path_name)
+    _, full = aggregate_units(extended, dataset_name='test', backend='native',
+                              return_aggregation_groups=True)
+    assert full.nunique() < len(extended)
+    assert partition(incremental) == partition(full)
+
+    # without blocking, the duke binaries aggregate the whole dataset again
+    aggregate_units(df, dataset_name='test', backend='native')
+    duke = cleaning.duke
+    compared = []
+    def native_duke(df, **kwargs):
+        compared.append(len(df))
+        return duke(df, **dict(kwargs, backend='native'))
+    monkeypatch.setattr(cleaning, 'duke', native_duke)
+    _, fallback = aggregate_units(extended, dataset_name='test', backend='java',
+                                  incremental=True,
+                                  return_aggregation_groups=True)
+    assert compared == [len(extended)]
+    assert partition(fallback) == partition(full)
+
+
+
+def test_aggregate_units_ambiguous_project_ids(monkeypatch, tmp_path):
+    monkeypatch.setattr(cleaning, '_data_out',
+                        lambda fn: os.path.join(str(tmp_path), fn))
+    path_name = os.path.join(str(tmp_path), 'aggregation_groups_test.csv')
+    df = units(30, seed=0)
+    df.loc[[0, 1], 'projectID'] = 'x'
+    df.loc[[2, 3], 'projectID'] = np.nan
+    aggregate_units(df, dataset_name='test', backend='native')
+    # groups of ambiguous projectIDs are not saved
+    assert not os.path.exists(path_name)
+
+    # groups saved by earlier versions may still contain them
+    pd.DataFrame({'projectID': ['x', 'x', 'nan', 'nan'] + list(df.projectID[4:]),
+                  'hash': cleaning._record_hashes(df).values,
+                  'grouped': np.arange(len(df))},
+                 columns=['projectID', 'hash', 'grouped']).to_csv(path_name, index=False)
+    changed = df.assign(Capacity=df.Capacity + 1.)
+    _, full = aggregate_units(changed, dataset_name='test', backend='native',
+                              return_aggregation_groups=True)
+    for kwargs in [dict(use_saved_aggregation=True), dict(incremental=True)]:
+        _, grouped = aggregate_units(changed, dataset_name='test',
+                                     backend='native',
+                                     return_aggregation_groups=True, **kwargs)
+        assert (partition(grouped.reset_index(drop=True)) ==
+                partition(full.reset_index(drop=True)))
+
+
+plant_names = [u'Kraftwerk Lippendorf Block R', u'HKW Köln-Niehl 2',
+               u'Windpark Nord Ostsee II', u'Parque Eolico de la Sierra',
+               u'Planta tratamiento de purines Sur', u'tratamiento de purines',
+               u'Grosskraftwerk Mannheim GKM', u'Kernkraftwerk Isar 2',
+               u'Pumped Storage Power Station Vianden',
+               u'Centrale termica di Brindisi Sud', u'GuD Irsching 5',
+               u'Rheinhafen-Dampfkraftwerk Karlsruhe (RDK 8)', u'Unnamed',
+               u'Solar', u'Ørsted Avedøre', u'Moorburg A/B', u'Walsum 10',
+               u'Datteln  4', u'Kw Staudinger', u'Heizkraftwerk Reuter West',
+               u'Kraftwerk Lippendorf Block R', u'',
+               u'Central Nuclear Almaraz I-II', u'CCGT Power Plant Severn']
+
+
+def test_clean_powerplantname():
+    df = pd.DataFrame({'Name': plant_names, 'Fueltype': 'Hard Coal',
+                       'Capacity': 1.})
+    # output of the regular expression based implementation
+    expected = [u'Ccgt severn', u'Central nuclear almaraz',
+                u'Centrale termica di brindisi sud', u'Datteln',
+                u'Grosskraftwerk mannheim gkm', u'Heizkraftwerk reuter west',
+                u'Irsching', u'Isar', u'Kraftwerk lippendorf block',
+                u'Kraftwerk lippendorf block', u'Köln niehl', u'Moorburg',
+                u'Rheinhafen dampfkraftwerk karlsruhe rdk', u'Sierra', u'Solar',
+                u'Staudinger', u'Sur', u'Vianden', u'Walsum', u'Windpark nord',
+                u'Ørsted avedøre']
+    cleaned = clean_powerplantname(df)
+    assert cleaned.Name.tolist() == expected
+    assert cleaned.index.tolist() == list(range(len(expected)))
+
+
+def test_clean_powerplantname_repeated_names():
+    # words in at least 20 names are removed, which depends on how often
+    # the names repeat
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame({'Name': rng.choice(plant_names, 300),
+                       'Capacity': np.arange(300.)})
+    # output of the regular expression based implementation
+    cleaned_names = {
+        u'CCGT Power Plant Severn': u'Ccgt severn',
+        u'Central Nuclear Almaraz I-II': u'Central nuclear almaraz',
+        u'Centrale termica di Brindisi Sud': u'Centrale termica di brindisi sud',
+        u'Datteln  4': u'Datteln',
+        u'Grosskraftwerk Mannheim GKM': u'Grosskraftwerk mannheim gkm',
+        u'Heizkraftwerk Reuter West': u'Heizkraftwerk reuter west',
+        u'GuD Irsching 5': u'Irsching', u'Kernkraftwerk Isar 2': u'Isar',
+        u'HKW Köln-Niehl 2': u'Köln niehl', u'Moorburg A/B': u'Moorburg',
+        u'Rheinhafen-Dampfkraftwerk Karlsruhe (RDK 8)':
+            u'Rheinhafen dampfkraftwerk karlsruhe rdk',
+        u'Solar': u'Solar', u'Kw Staudinger': u'Staudinger',
+        u'Planta tratamiento de purines Sur': u'Sur',
+        u'Pumped Storage Power Station Vianden': u'Vianden',
+        u'Walsum 10': u'Walsum', u'Windpark Nord Ostsee II': u'Windpark nord',
+        u'Ørsted Avedøre': u'Ørsted avedøre'}
+    expected = df.assign(Name=df.Name.map(cleaned_names)).dropna()
+    cleaned = clean_powerplantname(df)
+    assert (sorted(zip(cleaned.Name, cleaned.Capacity)) ==
+            sorted(zip(expected.Name, expected.Capacity)))
+
+
+def test_map_unique():
+    s = pd.Series(['b', 'a', np.nan, 'b'], index=[3, 2, 1, 0], name='x')
+    calls = []
+    def upper(values):
+        calls.append(len(values))
+        return values.str.upper()
+    mapped = map_unique(s.astype('category'), upper)
+    assert_series_equal(mapped, pd.Series(['B', 'A', np.nan, 'B'],
+                                          index=[3, 2, 1, 0], name='x'),
+                        check_dtype=False)
+    assert calls == [2]
+
+
+def text_sample():
+    return pd.DataFrame({
+        'Name': ['Lippendorf Lignite Plant', 'HKW Nord CCGT',
+                 'Vianden Pumped Storage', 'Irsching OCGT and CCGT', np.nan,
+                 'Brown coal Boxberg', 'Battery Park',
+                 'Offshore Windpark Nordsee', 'Solar PV Park',
+                 'Heat and Power Station Steam Turbine'],
+        'Fueltype': ['Coal', 'Natural Gas', 'Hydro', 'Natural Gas', 'Coal',
+                     'Hard Coal', np.nan, 'Wind', 'Solar', 'Hard Coal'],
+        'Technology': [np.nan, 'CHP', 'Pumped storage', np.nan, 'Steam Turbine',
+                       'lignite', 'storage', np.nan, np.nan, 'ccgt'],
+        'Set': ['PP', np.nan, np.nan, 'PP', np.nan, np.nan, np.nan, 'PP',
+                np.nan, np.nan]})
+
+
+def test_gather_text_info():
+    # output of gather_fueltype_info, gather_technology_info and
+    # gather_set_info before they shared the text classification
+    technology = [np.nan, 'CHP, CCGT', 'Pumped storage, Pumped Storage',
+                  'OCGT, CCGT', 'Steam Turbine', 'lignite', 'storage',
+                  'Offshore', 'PV', 'ccgt, Steam Turbine']
+    Set = ['PP', 'CHP', 'Store', 'PP', 'PP', 'PP', 'Store', 'PP', 'PP', 'CHP']
+    df = text_sample()
+    expected = df.assign(Technology=technology, Set=Set)
+    assert_frame_equal(gather_text_info(df), expected)
+    expected['Fueltype'] = ['Lignite', 'Natural Gas', 'Hydro', 'Natural Gas',
+                            'Hard Coal', 'Lignite', np.nan, 'Wind', 'Solar',
+                            'Hard Coal']
+    assert_frame_equal(gather_text_info(df, fueltype_col=['Name', 'Technology']),
+                       expected)
+
+
+def test_clean_technology():
+    technology = ['CCGT', 'ccgt and Steam Turbine', 'Gas turbine',
+                  'Combined Cycle Power Plant', 'Open cycle', 'Pumped storage',
+                  'Reservoir, lake', 'Run-of-river', 'Weir', 'Dam', 'Battery',
+                  'Steam Turbine, CCGT, CCGT', np.nan, 'supercritical thermal',
+                  'ocgt', 'Pv', 'Onshore and Offshore', 'Water']
+    # output of the regular expression replacements one after the other
+    expected = {False: ['CCGT', 'Steam Turbine', 'OCGT', 'CCGT', 'OCGT',
+                        'Pumped Storage', 'Lake, Reservoir', 'Run-Of-River',
+                        'Weir', 'Dam', '', 'Steam Turbine', np.nan,
+                        'Steam Turbine', 'OCGT', 'Pv', 'Offshore, Onshore',
+                        'Water'],
+                True: ['CCGT', 'Steam Turbine', 'OCGT', 'CCGT', 'OCGT',
+                       'Pumped Storage', 'Reservoir', 'Run-Of-River',
+                       'Run-Of-River', 'Reservoir', '', 'Steam Turbine', np.nan,
+                       'Steam Turbine', 'OCGT', 'Pv', 'Offshore, Onshore',
+                       'Run-Of-River']}
+    for generalize_hydros in [False, True]:
+        for values in [technology, pd.Categorical(technology)]:
+            df = pd.DataFrame({'Technology': values, 'Capacity': 1.})
+            cleaned = clean_technology(df, generalize_hydros=generalize_hydros)
+            assert cleaned.Technology.dtype == 'category'
+            assert_series_equal(cleaned.Technology.astype(object),
+                                pd.Series(expected[generalize_hydros],
+                                          name='Technology', dtype=object))
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the collection of matched datasets
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from powerplantmatching import collection
+from powerplantmatching.matching import link_table, matched_dataframe
+
+from test_matching import matched_datasets
+
+
+def test_matched_collection_follows_links(monkeypatch, tmp_path):
+    _, datasets = matched_datasets()
+    labels = list(datasets)
+    first = pd.DataFrame({'CARMA': [0., 1., 2.], 'OPSD': [5., 6., 7.]},
+                         columns=labels)
+    second = pd.DataFrame({'CARMA': [3., 4.], 'OPSD': [8., 9.]},
+                          columns=labels)
+    matches = [first]
+    monkeypatch.setattr(collection, '_data_out',
+                        lambda fn: os.path.join(str(tmp_path), fn))
+    monkeypatch.setattr(collection, '_cleaned_datasets',
+                        lambda *args, **kwargs: datasets)
+    monkeypatch.setattr(collection, 'link_multiple_datasets',
+                        lambda *args, **kwargs: matches[0])
+
+    matched = collection.Collection(labels, update=True, reduced=False)
+    assert_frame_equal(matched, matched_dataframe(link_table(first), datasets))
+
+    # the matched dataset of the first links must not be returned after
+    # the links were updated
+    matches[0] = second
+    collection.Collection(labels, update=True, reduced=True)
+    cleaned = []
+    def cleaned_datasets(*args, **kwargs):
+        cleaned.append(args)
+        return datasets
+    monkeypatch.setattr(collection, '_cleaned_datasets', cleaned_datasets)
+    matched = collection.Collection(labels, reduced=False)
+    assert_frame_equal(matched, matched_dataframe(link_table(second), datasets))
+    # it is projected from the stored datasets without cleaning them again
+    assert cleaned == []
+
+    # links which do not belong to the stored datasets force an update
+    link_table(first).to_csv(os.path.join(str(tmp_path), 'Matched_{}_links.csv'
+                                          .format('_'.join(labels))), index=False)
+    matched = collection.Collection(labels, reduced=False)
+    assert len(cleaned) == 1
+    assert_frame_equal(matched, matched_dataframe(link_table(second), datasets))
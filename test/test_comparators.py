@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the string and numeric comparators
+"""
+from __future__ import absolute_import, print_function
+
+import numpy as np
+from numpy.testing import assert_allclose
+
+from powerplantmatching.comparators import (encode_strings, jaro_winkler,
+                                            jaro_winkler_batch,
+                                            jaro_winkler_tokenized,
+                                            jaro_winkler_tokenized_batch,
+                                            numeric, numeric_batch, qgram,
+                                            qgram_batch)
+
+
+def random_strings(n, seed):
+    rng = np.random.RandomState(seed)
+    tokens = [u'kraftwerk', u'nord', u'süd', u'ab', u'a', u'lippendorf',
+              u'lippendrof', u'boxberg', u'ørsted', u'2', u'ii', u'']
+    return [u' '.join(rng.choice(tokens, rng.randint(0, 4))).strip()
+            for _ in range(n)]
+
+
+def test_batch_comparators_agree_with_scalar_ones():
+    strings1, strings2 = random_strings(60, seed=0), random_strings(50, seed=1)
+    i, j = np.meshgrid(np.arange(len(strings1)), np.arange(len(strings2)),
+                       indexing='ij')
+    i, j = i.ravel(), j.ravel()
+    pairs = list(zip(i, j))
+
+    codes1, len1 = encode_strings(strings1)
+    codes2, len2 = encode_strings(strings2)
+    assert_allclose(jaro_winkler_batch(codes1[i], len1[i], codes2[j], len2[j]),
+                    [jaro_winkler(strings1[a], strings2[b]) for a, b in pairs])
+    assert_allclose(jaro_winkler_tokenized_batch(strings1, strings2, i, j,
+                                                 chunksize=100),
+                    [jaro_winkler_tokenized(strings1[a], strings2[b])
+                     for a, b in pairs])
+    assert_allclose(qgram_batch(strings1, strings2, i, j),
+                    [qgram(strings1[a], strings2[b]) for a, b in pairs])
+
+    values1 = np.r_[0., 100., 200., 210., np.arange(10.)]
+    values2 = np.r_[0., 50., 210., np.arange(10.)]
+    i, j = np.meshgrid(np.arange(len(values1)), np.arange(len(values2)),
+                       indexing='ij')
+    assert_allclose(numeric_batch(values1, values2, i.ravel(), j.ravel(), 0.3),
+                    [numeric(values1[a], values2[b], 0.3)
+                     for a, b in zip(i.ravel(), j.ravel())])
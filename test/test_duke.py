@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the native duke backend
+"""
+from __future__ import absolute_import, print_function
+
+import numpy as np
+import pandas as pd
+import pytest
+from numpy.testing import assert_allclose
+from pandas.testing import assert_frame_equal
+
+from powerplantmatching.duke import (comparator_costs, comparator_evaluations,
+                                     duke, rescore, score_matrix)
+from powerplantmatching.matching import best_matches
+
+from test_blocking import linked_datasets
+
+
+def duke_probability(sim, low, high):
+    # Duke's Property.compare
+    return low if sim < 0.5 else (high - 0.5) * sim ** 2 + 0.5
+
+
+def duke_bayes(probs):
+    # Duke's Utils.computeBayes, starting from 0.5
+    prob = 0.5
+    for p in probs:
+        prob = prob * p / (prob * p + (1. - prob) * (1. - p))
+    return prob
+
+
+def test_native_backend_scores():
+    one = pd.DataFrame({'Name': ['Martha', 'Dwayne', 'Dixon'],
+                        'Fueltype': 'Hydro', 'Country': 'Germany',
+                        'Capacity': [100., 100., 100.],
+                        'lat': [50., np.nan, np.nan],
+                        'lon': [8., np.nan, np.nan]})
+    two = pd.DataFrame({'Name': ['MARHTA', 'Duane', 'Dicksonx'],
+                        'Fueltype': 'Hydro', 'Country': 'Germany',
+                        'Capacity': [100., 200., 100.],
+                        'lat': [50., np.nan, 50.], 'lon': [8., np.nan, 8.]},
+                       index=[5, 6, 7])
+    scores = duke([one, two], labels=['A', 'B'], backend='native',
+                  return_scores=True).set_index(['A', 'B'])
+
+    # Jaro-Winkler similarities of the test suite of Duke, fueltype and
+    # country agree, the capacities are equal or differ by a factor 2,
+    # coordinates are equal or missing; low and high of Comparison.xml
+    name = lambda sim: duke_probability(sim, 0.09, 0.99)
+    fueltype, country = duke_probability(1., 0.09, 0.7), duke_probability(1., 0., 0.53)
+    capacity = lambda sim: duke_probability(sim, 0.2, 0.75)
+    geoposition = duke_probability(1., 0.1, 0.8)
+    expected = {(0, 5): [name(0.961), fueltype, country, capacity(1.), geoposition],
+                (1, 6): [name(0.84), fueltype, country, capacity(0.5)],
+                (2, 7): [name(0.813), fueltype, country, capacity(1.)]}
+    assert_allclose(scores.loc[list(expected), 'NAME'], [0.961, 0.84, 0.813],
+                    atol=5e-4)
+    assert_allclose(scores.loc[list(expected), 'scores'],
+                    [duke_bayes(p) for p in expected.values()], atol=1e-4)
+
+    # only the first pair exceeds the threshold of 0.975
+    links = duke([one, two], labels=['A', 'B'], backend='native')
+    assert links[['A', 'B']].values.tolist() == [[0, 5]]
+    assert_allclose(links.scores, scores.loc[[(0, 5)], 'scores'])
+
+
+def test_jvm_backend_agrees_with_native_one():
+    pytest.importorskip('jpype')
+    one = pd.DataFrame({'Name': ['Lippendorf', 'Boxberg', 'Moorburg', 'Datteln'],
+                        'Fueltype': ['Lignite', 'Lignite', 'Hard Coal', 'Hard Coal'],
+                        'Country': 'Germany',
+                        'Capacity': [1840., 2575., 1730., 1100.],
+                        'lat': [51.18, 51.42, 53.49, 51.63],
+                        'lon': [12.37, 14.57, 9.95, 7.33]})
+    two = pd.DataFrame({'Name': ['Moorburg', 'Boxberg', 'Lipendorf', 'Staudinger'],
+                        'Fueltype': ['Hard Coal', 'Lignite', 'Lignite', 'Hard Coal'],
+                        'Country': 'Germany',
+                        'Capacity': [1730., 2575., 1840., 510.],
+                        'lat': [53.49, 51.42, 51.18, 50.09],
+                        'lon': [9.95, 14.57, 12.37, 8.95]},
+                       index=[5, 6, 7, 8])
+    for kwargs in [dict(labels=['A', 'B']), dict(labels=['A', 'B'], singlematch=True)]:
+        native = duke([one, two], backend='native', **kwargs)
+        jvm = duke([one, two], backend='jvm', **kwargs)
+        assert (sorted(map(tuple, jvm[['A', 'B']].values.tolist())) ==
+                sorted(map(tuple, native[['A', 'B']].values.tolist())))
+        assert_allclose(jvm.sort_values(['A', 'B']).scores,
+                        native.sort_values(['A', 'B']).scores, atol=1e-3)
+
+    dedup = pd.concat([one, two], ignore_index=True)
+    native = duke(dedup, backend='native')
+    jvm = duke(dedup, backend='jvm')
+    assert (set(map(frozenset, jvm.values.tolist())) ==
+            set(map(frozenset, native.values.tolist())))
+
+
+def test_pruned_scoring(monkeypatch):
+    datasets = linked_datasets(swap_words=True)
+    scores = duke(datasets, labels=['A', 'B'], backend='native',
+                  return_scores=True)
+    comparator_evaluations.clear()
+    links = duke(datasets, labels=['A', 'B'], backend='native')
+    expected = scores[scores.scores > 0.975]
+    assert links[['A', 'B']].values.tolist() == expected[['A', 'B']].values.tolist()
+    assert_allclose(links.scores, expected.scores)
+
+    # the expensive name comparisons are skipped for most pairs
+    pairs = len(datasets[0]) * len(datasets[1])
+    assert comparator_evaluations['CAPACITY'] == pairs
+    assert comparator_evaluations['NAME'] < pairs / 2
+    evaluations = comparator_evaluations.copy()
+
+    # evaluating the names first prunes (and saves) nothing
+    monkeypatch.setitem(comparator_costs, 'JaroWinklerTokenized', 0)
+    comparator_evaluations.clear()
+    links = duke(datasets, labels=['A', 'B'], backend='native')
+    assert links[['A', 'B']].values.tolist() == expected[['A', 'B']].values.tolist()
+    assert comparator_evaluations['NAME'] == pairs
+    costs = {'NAME': 10, 'FUELTYPE': 2, 'COUNTRY': 2, 'CAPACITY': 1,
+             'GEOPOSITION': 1}
+    cost = lambda counts: sum(costs[p] * n for p, n in counts.items())
+    assert cost(comparator_evaluations) > 2 * cost(evaluations)
+
+
+def test_rescore_and_score_matrix():
+    datasets = linked_datasets(swap_words=True)
+    scores = duke(datasets, labels=['A', 'B'], backend='native',
+                  return_scores=True)
+    links = duke(datasets, labels=['A', 'B'], backend='native')
+
+    # the threshold and low/high values are applied without scoring again
+    rescored = rescore(scores)
+    assert rescored[['A', 'B']].values.tolist() == links[['A', 'B']].values.tolist()
+    assert_allclose(rescored.scores, links.scores)
+    lower = rescore(scores, threshold=0.5)
+    assert len(lower) > len(links)
+    assert_allclose(lower.scores, scores.scores[scores.scores > 0.5])
+    stricter = rescore(scores, threshold=0.5, properties={'NAME': {'high': 0.6}})
+    limits = {'NAME': (0.09, 0.6), 'FUELTYPE': (0.09, 0.7),
+              'COUNTRY': (0., 0.53), 'CAPACITY': (0.2, 0.75),
+              'GEOPOSITION': (0.1, 0.8)}
+    assert_allclose(stricter.scores,
+                    [duke_bayes([duke_probability(pair[p], *limits[p])
+                                 for p in limits if not np.isnan(pair[p])])
+                     for _, pair in stricter.iterrows()])
+    assert (stricter.scores < lower.loc[stricter.index, 'scores']).all()
+    assert_frame_equal(best_matches(scores, threshold=0.975), best_matches(links))
+
+    matrix = score_matrix(scores, datasets)
+    assert matrix.shape == (len(datasets[0]), len(datasets[1]))
+    i = datasets[0].index.get_indexer(scores.A)
+    j = datasets[1].index.get_indexer(scores.B)
+    assert_allclose(matrix.toarray()[i, j], scores.scores)
+    assert matrix.nnz == len(scores)
+    names = score_matrix(scores, datasets, column='NAME')
+    assert_allclose(names.toarray()[i, j], scores.NAME)
+
+
+def test_duke_leaves_datasets_unchanged():
+    one, two = linked_datasets()
+    one.loc[[0, 1], ['lat', 'lon']] = np.nan
+    copies = [one.copy(), two.copy()]
+    for kwargs in [dict(), dict(blocking=['Country']), dict(candidates='spatial'),
+                   dict(candidates='qgram')]:
+        duke([one, two], backend='native', **kwargs)
+        duke(one, backend='native', **kwargs)
+        assert_frame_equal(one, copies[0])
+        assert_frame_equal(two, copies[1])
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the reduction of matched powerplants
+"""
+from __future__ import absolute_import, print_function
+
+from collections import OrderedDict
+from functools import partial
+import itertools
+import os
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal, assert_series_equal
+
+from powerplantmatching import matching
+from powerplantmatching.blocking import spatial_candidates
+from powerplantmatching.config import target_columns
+from powerplantmatching.matching import (best_matches, compare_two_datasets,
+                                         concat_strings, cross_matches,
+                                         exact_matches,
+                                         link_multiple_datasets, link_table,
+                                         matched_dataframe,
+                                         optimal_matches,
+                                         reduce_matched_dataframe,
+                                         source_mapping)
+
+from test_blocking import linked_datasets
+
+
+def matched_datasets(categorical=False, n=40, seed=0):
+    rng = np.random.RandomState(seed)
+    datasets = OrderedDict()
+    for label in ['CARMA', 'OPSD']:
+        df = pd.DataFrame({
+            'Name': ['Plant {}'.format(i) for i in range(n)],
+            'Fueltype': rng.choice(['Hard Coal', 'Natural Gas', 'Hydro'], n),
+            'Technology': rng.choice(['CCGT', 'Steam Turbine', 'Reservoir',
+                                      None], n),
+            'Set': 'PP',
+            'Country': rng.choice(['Germany', 'France', 'Spain'], n),
+            'Capacity': rng.uniform(10, 1000, n),
+            'YearCommissioned': rng.randint(1950, 2015, n).astype(float),
+            'lat': rng.uniform(40, 55, n), 'lon': rng.uniform(-5, 15, n),
+            'File': label, 'projectID': ['{}{}'.format(label, i)
+                                         for i in range(n)]})
+        df = df.reindex(columns=target_columns())
+        if categorical:
+            df['Technology'] = df.Technology.astype('category')
+        datasets[label] = df
+    m = 3 * n // 4
+    cross_matches = pd.DataFrame({'CARMA': rng.permutation(n)[:m],
+                                  'OPSD': rng.permutation(n)[:m]},
+                                 columns=['CARMA', 'OPSD']).astype(float)
+    cross_matches.iloc[::4, 1] = np.nan
+    return link_table(cross_matches), datasets
+
+
+def test_reduce_categorical_technology():
+    links, datasets = matched_datasets(categorical=False)
+    expected = reduce_matched_dataframe(matched_dataframe(links, datasets))
+    links, datasets = matched_datasets(categorical=True)
+    reduced = reduce_matched_dataframe(matched_dataframe(links, datasets))
+    assert reduced.Technology.notnull().sum() > 0
+    assert_frame_equal(reduced, expected)
+    assert_frame_equal(reduce_matched_dataframe(links, datasets=datasets),
+                       expected)
+
+
+def test_reduce_parallel():
+    n = 200
+    _, datasets = matched_datasets(n=n)
+    # partitions by country with technologies of their own, such that the
+    # reduced partitions have different categories
+    country = np.array(['Germany', 'France', 'Spain'])[np.arange(n) % 3]
+    technology = np.array(['CCGT', 'Reservoir', 'Marine'])[np.arange(n) % 3]
+    for df in datasets.values():
+        df['Country'] = country
+        df['Technology'] = pd.Categorical(technology)
+    plants = np.random.RandomState(1).permutation(n)[:150].astype(float)
+    links = link_table(pd.DataFrame({'CARMA': plants, 'OPSD': plants},
+                                    columns=['CARMA', 'OPSD']))
+    for df, kwargs in [(matched_dataframe(links, datasets), {}),
+                       (links, dict(datasets=datasets))]:
+        serial = reduce_matched_dataframe(df, **kwargs)
+        parallel = reduce_matched_dataframe(df, n_jobs=2, **kwargs)
+        assert_frame_equal(parallel, serial)
+
+
+def test_cross_matches_order_and_dtypes():
+    pairs = [pd.DataFrame({'CARMA': [7, 1, 3], 'ENTSOE': [11, 10, 12]},
+                          columns=['CARMA', 'ENTSOE']),
+             pd.DataFrame({'CARMA': [1, 5], 'OPSD': [20, 21]},
+                          columns=['CARMA', 'OPSD']),
+             pd.DataFrame({'ENTSOE': [10, 13], 'OPSD': [20, 22]},
+                          columns=['ENTSOE', 'OPSD'])]
+    expected = pd.DataFrame([[1, 10, 20], [np.nan, 13, 22], [5, np.nan, 21],
+                             [7, 11, np.nan], [3, 12, np.nan]],
+                            columns=['CARMA', 'ENTSOE', 'OPSD'])
+    assert_frame_equal(cross_matches(pairs, ['CARMA', 'ENTSOE', 'OPSD']),
+                       expected)
+    # identifiers in all rows are floats as well
+    assert_frame_equal(cross_matches(pairs[:1], ['CARMA', 'ENTSOE']),
+                       pairs[0].astype(float))
+
+
+def exact_datasets():
+    one = pd.DataFrame({'Name': ['Staudinger', 'Moorburg', 'Datteln',
+                                 'Lippendorf', 'Ensdorf'],
+                        'Country': ['Germany'] * 4 + ['France'],
+                        'Fueltype': 'Hard Coal',
+                        'Capacity': [500., 1600., 1100., 900., 300.],
+                        'projectID': [['BNA1'], ['BNA2', 'BNA3'], ['BNA4'],
+                                      ['BNA9'], ['BNA5']],
+                        'EIC': [[], [], ['11WD4'], [], []]},
+                       index=[10, 11, 12, 13, 14])
+    two = pd.DataFrame({'Name': ['Kw Staudinger', 'Hamburg Moorburg',
+                                 'Datteln 4', 'LIPPENDORF', 'Ensdorf'],
+                        'Country': 'Germany', 'Fueltype': 'Hard Coal',
+                        'Capacity': [510., 1650., 1050., 900., 280.],
+                        'projectID': ['BNA1', 'BNA3', 'X', 'Y', 'BNA5'],
+                        'EIC': [np.nan, np.nan, '11WD4', np.nan, np.nan]})
+    return [df.reindex(columns=target_columns() + ['EIC']) for df in [one, two]]
+
+
+def test_exact_matches():
+    datasets = exact_datasets()
+    # shared projectIDs and EIC codes within the same country, and equal
+    # normalized names, countries, fueltypes and capacities
+    expected = pd.DataFrame({'CARMA': [10, 11, 12, 13], 'OPSD': [0, 1, 2, 3],
+                             'scores': 1.},
+                            columns=['CARMA', 'OPSD', 'scores'])
+    assert_frame_equal(exact_matches(datasets, ['CARMA', 'OPSD']), expected)
+    assert_frame_equal(exact_matches(datasets, ['CARMA', 'OPSD'],
+                                     id_columns=['projectID']),
+                       expected.drop(2).reset_index(drop=True))
+
+
+def test_compare_two_datasets_prepass():
+    datasets = exact_datasets()
+    matches = compare_two_datasets(datasets, ['CARMA', 'OPSD'], prepass=True,
+                                   backend='native')
+    assert_frame_equal(matches, pd.DataFrame({'CARMA': [10, 11, 12, 13],
+                                              'OPSD': [0, 1, 2, 3]},
+                                             columns=['CARMA', 'OPSD']))
+    matches = compare_two_datasets(datasets, ['CARMA', 'OPSD'], prepass=True,
+                                   prepass_id_columns=['projectID'],
+                                   backend='native')
+    assert 12 not in matches.CARMA.values
+
+
+def test_compare_two_datasets_cache(monkeypatch, tmp_path):
+    calls = []
+    def counting_duke(*args, **kwargs):
+        calls.append(1)
+        return duke(*args, **kwargs)
+    duke = matching.duke
+    monkeypatch.setattr(matching, 'duke', counting_duke)
+    monkeypatch.setattr(matching, '_data_out',
+                        lambda fn: os.path.join(str(tmp_path), fn))
+
+    datasets = exact_datasets()
+    kwargs = dict(backend='native', use_cache=True,
+                  candidates=partial(spatial_candidates, radius=1e6))
+    matches = compare_two_datasets(datasets, ['CARMA', 'OPSD'], **kwargs)
+    assert len(calls) == 1
+    # an equal partial is a cache hit
+    kwargs['candidates'] = partial(spatial_candidates, radius=1e6)
+    assert_frame_equal(compare_two_datasets(datasets, ['CARMA', 'OPSD'], **kwargs),
+                       matches)
+    assert len(calls) == 1
+    # changed datasets and arguments invalidate the cache
+    datasets[0].loc[13, 'Capacity'] = 950.
+    compare_two_datasets(datasets, ['CARMA', 'OPSD'], **kwargs)
+    assert len(calls) == 2
+    kwargs['candidates'] = partial(spatial_candidates, radius=2e6)
+    compare_two_datasets(datasets, ['CARMA', 'OPSD'], **kwargs)
+    compare_two_datasets(datasets, ['CARMA', 'OPSD'], **kwargs)
+    assert len(calls) == 3
+    # lambdas cannot be identified and are never cached
+    kwargs['candidates'] = lambda *args, **kw: spatial_candidates(*args, **kw)
+    compare_two_datasets(datasets, ['CARMA', 'OPSD'], **kwargs)
+    compare_two_datasets(datasets, ['CARMA', 'OPSD'], **kwargs)
+    assert len(calls) == 5
+
+
+def random_links(seed, n=5, m=5, density=0.6):
+    rng = np.random.RandomState(seed)
+    i, j = np.nonzero(rng.rand(n, m) < density)
+    return pd.DataFrame({'CARMA': i + 10, 'OPSD': j + 20,
+                         'scores': rng.uniform(0.9, 1., len(i))},
+                        columns=['CARMA', 'OPSD', 'scores'])
+
+
+def assert_one_to_one(matches):
+    assert not matches.CARMA.duplicated().any()
+    assert not matches.OPSD.duplicated().any()
+
+
+def test_mutual_best_matches():
+    for seed in range(20):
+        links = random_links(seed)
+        matches = best_matches(links, mode='mutual')
+        assert_one_to_one(matches)
+        best_of = lambda column: (links.sort_values('scores', ascending=False)
+                                  .drop_duplicates(column)
+                                  .set_index(column)['OPSD' if column == 'CARMA'
+                                                     else 'CARMA'])
+        for c, o in matches[['CARMA', 'OPSD']].values:
+            assert best_of('CARMA')[c] == o and best_of('OPSD')[o] == c
+
+
+def test_optimal_matches():
+    for seed in range(20):
+        links = random_links(seed)
+        scores = links.set_index(['CARMA', 'OPSD']).scores
+        matches = optimal_matches(links)
+        assert_one_to_one(matches)
+        total = scores.reindex(pd.MultiIndex.from_arrays(
+            [matches.CARMA, matches.OPSD])).sum()
+        # brute force over all assignments, missing links count as zero
+        best = max(sum(scores.get((10 + k, 20 + l), 0.)
+                       for k, l in enumerate(assignment))
+                   for assignment in itertools.permutations(range(5)))
+        assert np.isclose(total, best)
+
+
+def test_compare_two_datasets_optimal(monkeypatch):
+    links = random_links(0)
+    def linked(datasets, labels, singlematch, **kwargs):
+        assert not singlematch
+        return links
+    monkeypatch.setattr(matching, 'duke', linked)
+    datasets = [pd.DataFrame(index=range(10, 15)), pd.DataFrame(index=range(20, 25))]
+    assert_frame_equal(compare_two_datasets(datasets, ['CARMA', 'OPSD'],
+                                            assignment='optimal'),
+                       optimal_matches(links))
+
+
+def test_link_multiple_datasets_parallel():
+    one, two = linked_datasets(swap_words=True)
+    three = linked_datasets()[1]
+    three.index = three.index + 100
+    datasets = [one, two, three]
+    copies = [df.copy() for df in datasets]
+    serial = link_multiple_datasets(datasets, ['A', 'B', 'C'], backend='native')
+    parallel = link_multiple_datasets(datasets, ['A', 'B', 'C'], n_jobs=3,
+                                      backend='native')
+    assert serial.notnull().all(axis=1).sum() > len(one) / 2
+    assert_frame_equal(parallel, serial)
+    for df, copy in zip(datasets, copies):
+        assert_frame_equal(df, copy)
+
+
+def test_concat_strings_and_source_mapping():
+    df = pd.DataFrame({'CARMA': ['c1', np.nan, 'c3', np.nan],
+                       'ENTSOE': [np.nan, np.nan, 'e3', 'e4'],
+                       'OPSD': ['o1', np.nan, 'o3', np.nan]},
+                      columns=['CARMA', 'ENTSOE', 'OPSD'], index=[5, 3, 8, 1])
+    assert_series_equal(concat_strings(df),
+                        pd.Series(['c1, o1', np.nan, 'c3, e3, o3', 'e4'],
+                                  index=df.index, dtype=object))
+    assert source_mapping(df).tolist() == [
+        {'CARMA': 'c1', 'OPSD': 'o1'}, {},
+        {'CARMA': 'c3', 'ENTSOE': 'e3', 'OPSD': 'o3'}, {'ENTSOE': 'e4'}]
+    assert (source_mapping(df).index == df.index).all()
+
+
+def test_cross_matches_non_transitive():
+    labels = ['CARMA', 'ENTSOE', 'OPSD']
+    # CARMA 3 and 0 are connected through ENTSOE 11 and OPSD 21, the
+    # component keeps the identifier with the most links, on ties the
+    # smallest one
+    pairs = [pd.DataFrame({'CARMA': [3], 'ENTSOE': [11]}, columns=labels[:2]),
+             pd.DataFrame({'CARMA': [0], 'OPSD': [21]}, columns=labels[::2]),
+             pd.DataFrame({'ENTSOE': [11], 'OPSD': [21]}, columns=labels[1:])]
+    assert_frame_equal(cross_matches(pairs, labels),
+                       pd.DataFrame([[0., 11., 21.]], columns=labels))
+    pairs[1] = pd.DataFrame({'CARMA': [0, 3], 'OPSD': [21, 22]},
+                            columns=labels[::2])
+    assert_frame_equal(cross_matches(pairs, labels),
+                       pd.DataFrame([[3., 11., 21.]], columns=labels))
+
+    # pairs which chain three plants of every dataset into a cycle form a
+    # single row
+    pairs = [pd.DataFrame({'CARMA': [1, 2, 0], 'ENTSOE': [12, 13, 10]},
+                          columns=labels[:2]),
+             pd.DataFrame({'CARMA': [1, 0, 2], 'OPSD': [23, 21, 20]},
+                          columns=labels[::2]),
+             pd.DataFrame({'ENTSOE': [13, 11, 10], 'OPSD': [21, 20, 23]},
+                          columns=labels[1:])]
+    assert_frame_equal(cross_matches(pairs, labels),
+                       pd.DataFrame([[0., 10., 20.]], columns=labels))
+
+
+def test_optimal_matches_sparse_components():
+    for seed in range(10):
+        links = random_links(seed, n=30, m=20, density=0.2)
+        i, _ = pd.factorize(links.CARMA)
+        j, _ = pd.factorize(links.OPSD)
+        n1, n2 = i.max() + 1, j.max() + 1
+        dense = matching._assign_component(i, j, links.scores.values, n1, n2)
+        sparse = matching._assign_component(i, j, links.scores.values, n1, n2,
+                                            max_dense=0)
+        weights = np.zeros((n1, n2))
+        weights[i, j] = links.scores.values
+        assert len(set(sparse[0])) == len(sparse[0])
+        assert len(set(sparse[1])) == len(sparse[1])
+        assert (weights[sparse] > 0).all()
+        assert np.isclose(weights[sparse].sum(), weights[dense].sum())